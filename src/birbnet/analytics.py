@@ -0,0 +1,334 @@
+from inspect import cleandoc
+from pathlib import Path
+
+from .data_utils import RunDataset, sql_string
+from .exceptions import MisconfiguredException
+from .types import DateInterval
+
+# profile counts binned in the degrees report
+COUNT_COLUMNS = ["followers_count", "following_count", "tweet_count", "listed_count"]
+
+# link shorteners and alternate domains counted as the site they belong to
+DOMAIN_ALIASES = {
+    "youtu.be": "youtube.com",
+    "amzn.to": "amazon.com",
+    "fb.me": "facebook.com",
+    "instagr.am": "instagram.com",
+    "x.com": "twitter.com",
+}
+
+# second level labels under country code TLDs that aren't registrable on their
+# own, so a domain under them keeps three labels, such as bbc.co.uk
+SECOND_LEVEL_LABELS = ["ac", "co", "com", "edu", "gov", "net", "or", "org"]
+
+# accounts created before Twitter launched have bad creation dates
+TWITTER_LAUNCH_DATE = "2006-03-21"
+
+# each follow in the edges table, with source following target, for runs with
+# only one edge type, which have no follows table (see `create_follows_table`)
+FOLLOWS_SQL = """
+    SELECT CASE WHEN edge_type = 'followers' THEN target ELSE source END AS source,
+           CASE WHEN edge_type = 'followers' THEN source ELSE target END AS target
+    FROM edges
+"""
+
+
+class RunAnalytics:
+    """Reports about a run's users and edges, written to Parquet files.
+
+    Reports are made from the tables in the run's DuckDB database, so
+    `make-db` needs to be run first. Each report is a single query copied
+    straight to a Parquet file, so DuckDB scans and aggregates the tables in
+    parallel with `threads` threads, and spills to disk rather than running
+    out of memory when a query needs more than `memory_limit`. The database
+    is opened read only, so several reports can be made at once.
+    """
+
+    def __init__(
+        self,
+        run_dataset: RunDataset,
+        table_name: str = "users",
+        threads: int | None = None,
+        memory_limit: str | None = None,
+    ) -> None:
+        if not run_dataset.db_path.exists():
+            raise MisconfiguredException(
+                f"No database found for run {run_dataset.run_id}. Run make-db first."
+            )
+        self.run_dataset = run_dataset
+        self.table_name = table_name
+        self.conn = run_dataset.make_duckdb_conn(
+            threads=threads, memory_limit=memory_limit, read_only=True
+        )
+
+    def __enter__(self) -> "RunAnalytics":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def get_output_path(self, report: str) -> Path:
+        return self.run_dataset.analysis_path / f"{report}.parquet"
+
+    def degrees(self, output_path: Path | None = None) -> tuple[Path, int]:
+        """Write the distributions of users' profile counts and edges.
+
+        Counts are binned by powers of ten. Out and in degrees are only
+        included if the edges table was made, and count the users each user
+        follows and is followed by in the crawl rather than their profile, so
+        they are only complete for users with those lists crawled. Follows
+        found in both lists of a crawl of both edge types are counted once.
+        """
+        self._check_table(self.table_name)
+        degrees_sql = f"""
+            UNPIVOT (SELECT {", ".join(COUNT_COLUMNS)} FROM {self.table_name})
+            ON {", ".join(COUNT_COLUMNS)}
+            INTO NAME metric VALUE value
+        """
+        if self._has_table("edges"):
+            follows = "follows" if self._has_table("follows") else f"({FOLLOWS_SQL})"
+            degrees_sql += f"""
+                UNION ALL SELECT 'out_degree', count(*) FROM {follows} GROUP BY source
+                UNION ALL SELECT 'in_degree', count(*) FROM {follows} GROUP BY target
+            """
+        return self.write_report(
+            "degrees",
+            f"""
+            SELECT metric,
+                   bin_start::BIGINT AS bin_start,
+                   greatest(bin_start * 10, 1)::BIGINT AS bin_end,
+                   count(*) AS users,
+                   100 * count(*) / sum(count(*)) OVER (PARTITION BY metric)
+                       AS percentage
+            FROM (
+                SELECT metric, {log_bin_sql("value")} AS bin_start
+                FROM ({degrees_sql})
+            )
+            GROUP BY metric, bin_start
+            ORDER BY metric, bin_start
+            """,
+            output_path,
+        )
+
+    def follow_ratios(self, output_path: Path | None = None) -> tuple[Path, int]:
+        """Write the distribution of users' ratios of followers to following.
+
+        Ratios are binned by powers of ten, with users without followers in a
+        bin of their own from 0 to 0. Users who don't follow anyone have no
+        ratio, and are counted in a bin with null bounds.
+        """
+        self._check_table(self.table_name)
+        return self.write_report(
+            "follow_ratios",
+            f"""
+            SELECT bin_start,
+                   bin_start * 10 AS bin_end,
+                   count(*) AS users,
+                   100 * count(*) / sum(count(*)) OVER () AS percentage,
+                   median(followers_count) AS median_followers
+            FROM (
+                SELECT followers_count,
+                       {log_bin_sql("followers_count / following_count")}
+                           AS bin_start
+                FROM {self.table_name}
+                WHERE following_count > 0
+                UNION ALL
+                SELECT followers_count, NULL
+                FROM {self.table_name}
+                WHERE following_count = 0
+            )
+            GROUP BY bin_start
+            ORDER BY bin_start NULLS LAST
+            """,
+            output_path,
+        )
+
+    def account_ages(
+        self, interval: DateInterval = "month", output_path: Path | None = None
+    ) -> tuple[Path, int]:
+        """Write the number of accounts created in each day, week, month or year."""
+        self._check_table(self.table_name)
+        return self.write_report(
+            "account_ages",
+            f"""
+            SELECT created,
+                   date_diff('day', created, current_date) AS account_age,
+                   count(*) AS users,
+                   sum(count(*)) OVER (ORDER BY created)::BIGINT AS cumulative_users
+            FROM (
+                SELECT date_trunc('{interval}', created_at)::DATE AS created
+                FROM {self.table_name}
+                WHERE created_at >= '{TWITTER_LAUNCH_DATE}'
+            )
+            GROUP BY created
+            ORDER BY created
+            """,
+            output_path,
+        )
+
+    def url_domains(
+        self, min_followers: int = 0, output_path: Path | None = None
+    ) -> tuple[Path, int]:
+        """Write the number of users linking to each domain in their profile.
+
+        URLs are taken from users' `urls` lists and rolled up to their
+        registered domain, so links to www.bbc.co.uk and news.bbc.co.uk both
+        count towards bbc.co.uk. Only users with at least `min_followers`
+        followers are counted.
+        """
+        self._check_table(self.table_name)
+        domain_sql = domain_alias_sql(registered_domain_sql("host"))
+        return self.write_report(
+            "url_domains",
+            f"""
+            SELECT domain,
+                   count(DISTINCT id) AS users,
+                   count(*) AS links
+            FROM (
+                SELECT id, {domain_sql} AS domain
+                FROM (
+                    SELECT id, string_split({url_host_sql("url")}, '.') AS host
+                    FROM (
+                        SELECT id, unnest(urls) AS url
+                        FROM {self.table_name}
+                        WHERE followers_count >= {int(min_followers)}
+                    )
+                )
+                WHERE host[-1] != ''
+            )
+            GROUP BY domain
+            ORDER BY users DESC, domain
+            """,
+            output_path,
+        )
+
+    def reciprocity(
+        self,
+        top: int | None = 100,
+        min_edges: int = 10,
+        output_path: Path | None = None,
+    ) -> tuple[Path, int]:
+        """Write the crawled users with the largest share of reciprocated edges.
+
+        An edge is reciprocated if the edge back the other way, of the same
+        type, was also crawled. Only edges to users that were crawled
+        themselves can be known to be reciprocated or not, so reciprocity is
+        the share of those, and users with fewer than `min_edges` of them are
+        left out. The `top` users are kept, or all of them if None.
+        """
+        self._check_table("edges")
+        limit = "" if top is None else f"LIMIT {int(top)}"
+        return self.write_report(
+            "reciprocity",
+            f"""
+            WITH crawled AS (
+                SELECT DISTINCT source AS user_id FROM edges
+            ),
+            edge_counts AS (
+                SELECT edges.source AS user_id,
+                       edges.edge_type,
+                       count(*) AS edges,
+                       count(crawled.user_id) AS crawled_edges
+                FROM edges
+                LEFT JOIN crawled ON edges.target = crawled.user_id
+                GROUP BY ALL
+            ),
+            mutual AS (
+                SELECT edges.source AS user_id,
+                       edges.edge_type,
+                       count(*) AS mutual
+                FROM edges
+                JOIN edges AS back_edges
+                    ON edges.source = back_edges.target
+                    AND edges.target = back_edges.source
+                    AND edges.edge_type = back_edges.edge_type
+                GROUP BY ALL
+            )
+            SELECT edge_counts.user_id,
+                   users.username,
+                   edge_counts.edge_type,
+                   edge_counts.edges,
+                   edge_counts.crawled_edges,
+                   coalesce(mutual.mutual, 0) AS mutual,
+                   coalesce(mutual.mutual, 0) / nullif(edge_counts.crawled_edges, 0)
+                       AS reciprocity
+            FROM edge_counts
+            LEFT JOIN mutual USING (user_id, edge_type)
+            LEFT JOIN {self.table_name} AS users ON edge_counts.user_id = users.id
+            WHERE edge_counts.crawled_edges >= {int(min_edges)}
+            ORDER BY reciprocity DESC NULLS LAST, mutual DESC, edge_counts.user_id
+            {limit}
+            """,
+            output_path,
+        )
+
+    def write_report(
+        self, report: str, select_sql: str, output_path: Path | None = None
+    ) -> tuple[Path, int]:
+        """Copy the results of a query to a Parquet file, returning its path and rows.
+
+        Defaults to `<report>.parquet` in the run's analysis directory.
+        """
+        output_path = output_path or self.get_output_path(report)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        [rows] = self.conn.execute(
+            f"""
+            COPY ({cleandoc(select_sql)})
+            TO {sql_string(str(output_path))} (FORMAT parquet)
+            """
+        ).fetchone()
+        return output_path, rows
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def _has_table(self, table_name: str) -> bool:
+        tables = self.conn.execute(
+            "SELECT count(*) FROM duckdb_tables() WHERE table_name = ?", [table_name]
+        )
+        return tables.fetchone()[0] > 0
+
+    def _check_table(self, table_name: str) -> None:
+        if not self._has_table(table_name):
+            raise MisconfiguredException(
+                f"No {table_name} table found for run {self.run_dataset.run_id}. "
+                "Run make-db first."
+            )
+
+
+def log_bin_sql(value: str) -> str:
+    """The power of ten bin a non-negative value is in, with 0 in a bin of 0."""
+    return f"CASE WHEN {value} <= 0 THEN 0 ELSE 10 ** floor(log10({value})) END"
+
+
+def url_host_sql(url: str) -> str:
+    """The lower cased host name of a URL, or an empty string if it has none."""
+    return f"lower(regexp_extract({url}, '^[a-zA-Z][a-zA-Z0-9+.-]*://([^/:?#]+)', 1))"
+
+
+def registered_domain_sql(labels: str) -> str:
+    """The registered domain of a host name's list of labels.
+
+    This keeps the last two labels, or three under the common second level
+    labels of country code TLDs, such as .co.uk, which covers most domains
+    without needing the full public suffix list.
+    """
+    second_level_labels = ", ".join(map(sql_string, SECOND_LEVEL_LABELS))
+    return f"""
+        CASE
+            WHEN len({labels}) >= 3
+                AND len({labels}[-1]) = 2
+                AND {labels}[-2] IN ({second_level_labels})
+            THEN array_to_string({labels}[-3:], '.')
+            ELSE array_to_string({labels}[-2:], '.')
+        END
+    """
+
+
+def domain_alias_sql(domain: str) -> str:
+    """The domain a domain is an alias of, or the domain itself."""
+    aliases = " ".join(
+        f"WHEN {sql_string(alias)} THEN {sql_string(target)}"
+        for alias, target in DOMAIN_ALIASES.items()
+    )
+    return f"CASE {domain} {aliases} ELSE {domain} END"
@@ -0,0 +1,306 @@
+import contextlib
+import io
+import logging
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+
+from .mock_api import MockAPIServer, MockTwitterAPI, make_power_law_graph
+from .types import Benchmark, Edge, StorageFormat
+
+logger = logging.getLogger(__package__)
+
+BENCHMARKS = list(Benchmark.__args__)
+
+BENCH_RUN_ID = "bench"
+
+# seconds importing the CLI may take before check-startup fails. nearly all of it
+# is typer, as commands import everything else they need when they're run.
+STARTUP_BUDGET = 0.5
+
+
+@dataclass
+class BenchmarkOptions:
+    """Scale of the synthetic graph and settings for the code being measured."""
+
+    # number of users in the synthetic graph, and how many each follows on average
+    users: int = 10_000
+    mean_follows: float = 50
+    depth: int = 2
+    edge: Edge = "following"
+    concurrency: int = 4
+    storage: StorageFormat = "json"
+    # number of users with the most follows to fetch in the fetch_users benchmark
+    fetch_users: int = 10
+    # processes used by crawl_stats, and threads used by make_db
+    workers: int = 1
+    # behaviour of the mock API, see MockTwitterAPI
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    seed: int = 0
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    wall_time: float
+    requests: int = 0
+    pages: int = 0
+    edges: int = 0
+    peak_rss: int = 0
+
+    @property
+    def requests_per_second(self) -> float:
+        return self.requests / self.wall_time if self.wall_time else 0.0
+
+    @property
+    def pages_per_second(self) -> float:
+        return self.pages / self.wall_time if self.wall_time else 0.0
+
+    @property
+    def edges_per_second(self) -> float:
+        return self.edges / self.wall_time if self.wall_time else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            **asdict(self),
+            "requests_per_second": self.requests_per_second,
+            "pages_per_second": self.pages_per_second,
+            "edges_per_second": self.edges_per_second,
+        }
+
+
+@dataclass
+class BenchmarkReport:
+    options: BenchmarkOptions
+    results: list[BenchmarkResult] = field(default_factory=list)
+    commit: str | None = None
+    created_at: str = field(
+        default_factory=lambda: datetime.now(timezone.utc).isoformat()
+    )
+
+    def to_dict(self) -> dict:
+        return {
+            "commit": self.commit,
+            "created_at": self.created_at,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "options": asdict(self.options),
+            "results": [result.to_dict() for result in self.results],
+        }
+
+
+def run_benchmarks(
+    options: BenchmarkOptions, benchmarks: list[str] = BENCHMARKS
+) -> BenchmarkReport:
+    """Run benchmarks against a mock API serving a synthetic graph.
+
+    Each benchmark runs in a fresh process, so peak RSS is measured for it
+    alone, while the mock API is served from this one. All benchmarks share a
+    temporary data directory, so crawl_stats and make_db use the output of the
+    crawl benchmark, which is run first if they need it.
+    """
+    report = BenchmarkReport(options=options, commit=get_commit())
+    logger.info("Generating graph of %d users", options.users)
+    graph = make_power_law_graph(
+        options.users, mean_follows=options.mean_follows, seed=options.seed
+    )
+    api = MockTwitterAPI(
+        graph,
+        latency=options.latency,
+        jitter=options.jitter,
+        error_rate=options.error_rate,
+        seed=options.seed,
+    )
+    degrees = graph.out_degree() if options.edge == "following" else graph.in_degree()
+    # a seed with about the average number of follows, like a typical user
+    seed_user_id = int(graph.ids[np.argmax(degrees >= options.mean_follows)])
+    fetch_user_ids = graph.ids[np.argsort(degrees)[::-1][: options.fetch_users]]
+    needs_crawl = {"crawl_stats", "make_db"} & set(benchmarks)
+    if needs_crawl and "crawl" not in benchmarks:
+        benchmarks = ["crawl", *benchmarks]
+
+    with tempfile.TemporaryDirectory() as data_path, MockAPIServer(api) as server:
+        context = {
+            "api_url": server.url,
+            "data_path": data_path,
+            "seed_user_id": seed_user_id,
+            "fetch_user_ids": fetch_user_ids.tolist(),
+        }
+        for name in benchmarks:
+            logger.info("Running %s benchmark", name)
+            before = api.stats.copy()
+            with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+                result = executor.submit(_run_benchmark, name, options, context)
+                result = result.result()
+            served = api.stats - before
+            result.requests = served["requests"]
+            result.pages = served["pages"]
+            report.results.append(result)
+    return report
+
+
+@dataclass
+class StartupResult:
+    # fastest time taken to import the CLI, in seconds
+    seconds: float
+    # modules that took longest to import themselves, excluding their imports
+    slowest_imports: list[tuple[str, float]]
+
+
+def measure_startup(repeat: int = 5, top: int = 10) -> StartupResult:
+    """Time importing the CLI in fresh interpreters, as when a command is run.
+
+    The fastest of `repeat` runs is used, as slower runs are mostly noise from
+    other processes. Times come from Python's -X importtime output, so they
+    don't include starting the interpreter itself.
+    """
+    best = None
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import birbnet.cli"],
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+        imports = []
+        for line in output.stderr.splitlines():
+            if not line.startswith("import time:") or "[us]" in line:
+                continue
+            self_us, cumulative_us, module = line[len("import time:") :].split("|")
+            imports.append((module.strip(), int(self_us), int(cumulative_us)))
+        seconds = (
+            next(
+                cumulative
+                for module, _, cumulative in imports
+                if module == "birbnet.cli"
+            )
+            / 1e6
+        )
+        if best is None or seconds < best.seconds:
+            slowest = sorted(imports, key=lambda row: row[1], reverse=True)[:top]
+            best = StartupResult(
+                seconds, [(module, self_us / 1e6) for module, self_us, _ in slowest]
+            )
+    return best
+
+
+def get_commit() -> str | None:
+    """Get the git commit of the working directory, if it's in a repository."""
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+            cwd=Path(__file__).parent,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.stdout.strip()
+
+
+def get_peak_rss() -> int:
+    """Peak resident set size of this process in bytes."""
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in kilobytes on Linux, but bytes on macOS
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+
+def _run_benchmark(name: str, options: BenchmarkOptions, context: dict):
+    # runs in a fresh process, so configure it before the code being measured
+    # reads any settings
+    from . import config, crawler
+    from .rate_limit import CredentialPool
+
+    config.API_URL = context["api_url"]
+    config.DATA_PATH = Path(context["data_path"])
+    config.PROFILE_CACHE_PATH = config.DATA_PATH / "profiles.db"
+    # the mock API doesn't rate limit unless asked to, so neither does the crawler
+    for edge in Edge.__args__:
+        crawler._credential_pools[edge] = CredentialPool.from_tokens(
+            ["bench-token"], limit=sys.maxsize, name=edge
+        )
+
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        edges = BENCHMARK_FUNCTIONS[name](options, context)
+    wall_time = time.perf_counter() - start_time
+    return BenchmarkResult(
+        name=name, wall_time=wall_time, edges=edges, peak_rss=get_peak_rss()
+    )
+
+
+def _bench_crawl(options: BenchmarkOptions, context: dict) -> int:
+    from .crawler import BirbCrawler
+
+    birb_crawler = BirbCrawler(
+        options.edge,
+        user_id=str(context["seed_user_id"]),
+        run_id=BENCH_RUN_ID,
+        depth=options.depth,
+        concurrency=options.concurrency,
+        storage=options.storage,
+        exclude_path=None,
+    )
+    birb_crawler.crawl()
+    return birb_crawler.crawled_count
+
+
+def _bench_fetch_users(options: BenchmarkOptions, context: dict) -> int:
+    from .crawler import UserFetcher
+
+    edges = 0
+    for user_id in context["fetch_user_ids"]:
+        user_fetcher = UserFetcher(
+            str(user_id),
+            options.edge,
+            run_id=f"{BENCH_RUN_ID}_fetch_users",
+            storage=options.storage,
+        )
+        edges += len(user_fetcher.fetch_users(resume=False))
+    return edges
+
+
+def _bench_crawl_stats(options: BenchmarkOptions, context: dict) -> int:
+    from .data_utils import RunDataset
+    from .stats import compute_crawl_stats
+
+    run_dataset = RunDataset(BENCH_RUN_ID)
+    stats = compute_crawl_stats(
+        run_dataset,
+        run_dataset.get_user_paths(),
+        write_edges=True,
+        workers=options.workers,
+    )
+    return stats.edges
+
+
+def _bench_make_db(options: BenchmarkOptions, context: dict) -> int:
+    from .data_utils import RunDataset
+
+    run_dataset = RunDataset(BENCH_RUN_ID)
+    run_dataset.make_db("users", threads=options.workers)
+    conn = run_dataset.make_duckdb_conn()
+    edges = conn.sql("SELECT count(*) FROM edges").fetchone()[0]
+    conn.close()
+    return edges
+
+
+BENCHMARK_FUNCTIONS = {
+    "crawl": _bench_crawl,
+    "fetch_users": _bench_fetch_users,
+    "crawl_stats": _bench_crawl_stats,
+    "make_db": _bench_make_db,
+}
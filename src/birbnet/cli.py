@@ -1,28 +1,31 @@
 import locale
 import logging
+import time
+from datetime import datetime, timedelta
 from inspect import cleandoc
-from statistics import mean, median
+from pathlib import Path
 from typing import Optional
 
-import jsonlines
-import orjson
-import pandas as pd
-import requests
 import typer
-from humanize import naturalsize
-from rich import print, print_json
-from rich.progress import track
+from rich import print
 
-from . import config, http_utils, data_utils, validate
+from . import config, validate
 from .config import DEFAULTS
-from .crawler import BirbCrawler
 from .exceptions import MisconfiguredException
-from .models import USER_FIELDS, User
+from .types import Benchmark
 
+# the CLI is run often by scripts, so only what's needed to parse arguments is
+# imported here. commands import the modules they use, which pull in heavy
+# dependencies such as duckdb, pyarrow and pydantic.
 
-locale.setlocale(locale.LC_ALL, "")
 logger = logging.getLogger(__package__)
 app = typer.Typer()
+query_app = typer.Typer(help="Query the neighborhoods of users in a run's graph.")
+app.add_typer(query_app, name="query")
+analyze_app = typer.Typer(
+    help="Write reports about a run's users and edges to Parquet, using DuckDB."
+)
+app.add_typer(analyze_app, name="analyze")
 
 
 def user_id_callback(value: str):
@@ -41,6 +44,62 @@ def edge_callback(value: str):
     return value
 
 
+def scheduler_policy_callback(value: str):
+    try:
+        validate.validate_scheduler_policy(value)
+    except MisconfiguredException as error:
+        raise typer.BadParameter(error.msg)
+    return value
+
+
+def storage_format_callback(value: str):
+    try:
+        validate.validate_storage_format(value)
+    except MisconfiguredException as error:
+        raise typer.BadParameter(error.msg)
+    return value
+
+
+def compression_callback(value: Optional[str]):
+    try:
+        validate.validate_compression(value)
+    except MisconfiguredException as error:
+        raise typer.BadParameter(error.msg)
+    return value
+
+
+def crawl_edge_callback(value: str):
+    try:
+        validate.validate_crawl_edge(value)
+    except MisconfiguredException as error:
+        raise typer.BadParameter(error.msg)
+    return value
+
+
+def direction_callback(value: str):
+    try:
+        validate.validate_direction(value)
+    except MisconfiguredException as error:
+        raise typer.BadParameter(error.msg)
+    return value
+
+
+def date_interval_callback(value: str):
+    try:
+        validate.validate_date_interval(value)
+    except MisconfiguredException as error:
+        raise typer.BadParameter(error.msg)
+    return value
+
+
+def large_user_policy_callback(value: str):
+    try:
+        validate.validate_large_user_policy(value)
+    except MisconfiguredException as error:
+        raise typer.BadParameter(error.msg)
+    return value
+
+
 @app.command()
 def get_users(
     run_id: str = typer.Argument(
@@ -54,15 +113,93 @@ def get_users(
     ),
     edge: str = typer.Option(
         "following",
-        help="The direction of user relationships to crawl.",
-        callback=edge_callback,
+        help="The direction of user relationships to crawl: following, followers "
+        "or both.",
+        callback=crawl_edge_callback,
     ),
     depth: Optional[int] = typer.Option(
         DEFAULTS.crawler_depth,
         help="Crawl depth to stop at in the connected user graph.",
     ),
+    concurrency: int = typer.Option(
+        DEFAULTS.crawler_concurrency,
+        help="Number of users to fetch pages for concurrently.",
+    ),
+    storage: str = typer.Option(
+        DEFAULTS.storage_format,
+        help="Format to save crawled users in: json or columnar.",
+        callback=storage_format_callback,
+    ),
+    compression: Optional[str] = typer.Option(
+        DEFAULTS.storage_compression,
+        help="Compress JSON user files with zstd or gzip.",
+        callback=compression_callback,
+    ),
+    policy: str = typer.Option(
+        DEFAULTS.crawler_policy,
+        help="Order to expand users in: bfs, fewest_edges or most_inlinks.",
+        callback=scheduler_policy_callback,
+    ),
+    max_pages: Optional[int] = typer.Option(
+        DEFAULTS.crawler_max_pages,
+        help="Maximum number of pages to fetch for each user.",
+    ),
+    max_edges: Optional[int] = typer.Option(
+        DEFAULTS.crawler_max_edges,
+        help="Maximum number of follows to fetch for each user, from their counts.",
+    ),
+    large_users: str = typer.Option(
+        DEFAULTS.crawler_large_users,
+        help="What to do with users over --max-edges: sample or skip.",
+        callback=large_user_policy_callback,
+    ),
+    probe_counts: bool = typer.Option(
+        False,
+        "--probe-counts",
+        help="Look up follow counts of users missing from the profile cache.",
+    ),
+    estimate: bool = typer.Option(
+        False,
+        "--estimate",
+        help="Only print the projected pages and time of the crawl.",
+    ),
+    exclude_file: Path = typer.Option(
+        config.EXCLUDE_USERS_PATH,
+        help="File of user IDs to never expand, one per line.",
+    ),
+    worker: bool = typer.Option(
+        False,
+        "--worker",
+        help="Share the crawl with other workers through the run's work queue.",
+    ),
+    worker_id: Optional[str] = typer.Option(
+        None,
+        help="Name for this worker. Defaults to the host name and process ID.",
+    ),
+    metrics_port: Optional[int] = typer.Option(
+        None,
+        help="Port to serve Prometheus metrics on at /metrics while crawling.",
+    ),
+    metrics_host: str = typer.Option(
+        DEFAULTS.metrics_host,
+        help="Interface to serve metrics on. Use 0.0.0.0 to expose them to others.",
+    ),
+    metrics_interval: int = typer.Option(
+        DEFAULTS.metrics_interval,
+        help="Seconds between snapshots written to the run's metrics log.",
+    ),
+    baseline: Optional[str] = typer.Option(
+        None,
+        help="Run ID of an earlier crawl. Only changes since it are saved.",
+    ),
 ):
     """Run the crawler starting at a specific user ID."""
+    from .crawler import BirbCrawler, get_credential_pool
+
+    if compression is not None and storage != "json":
+        raise typer.BadParameter("Only --storage json user files are compressed.")
+    if baseline is not None and storage != "columnar":
+        raise typer.BadParameter("Recrawls against a baseline need --storage columnar.")
     logger.setLevel(logging.INFO)
     print(
         cleandoc(
@@ -71,12 +208,76 @@ def get_users(
             seed_user_id: {user_id}
             depth:        {depth}
             edge:         {edge}
+            concurrency:  {concurrency}
+            storage:      {storage}
+            compression:  {compression}
+            policy:       {policy}
+            max_pages:    {max_pages}
+            max_edges:    {max_edges}
+            large_users:  {large_users}
+            baseline:     {baseline}
             """
         )
     )
-    crawler = BirbCrawler(user_id=user_id, edge=edge, depth=depth, run_id=run_id)
-    crawler.crawl()
+    crawler = BirbCrawler(
+        user_id=user_id,
+        edge=edge,
+        depth=depth,
+        run_id=run_id,
+        concurrency=concurrency,
+        storage=storage,
+        compression=compression,
+        policy=policy,
+        max_pages=max_pages,
+        max_edges=max_edges,
+        large_users=large_users,
+        probe_counts=probe_counts,
+        exclude_path=exclude_file,
+        metrics_port=metrics_port,
+        metrics_host=metrics_host,
+        metrics_interval=metrics_interval,
+        baseline_run_id=baseline,
+    )
+    # workers share the coordinator's crawl, so they don't spend their rate
+    # limits on projecting it again unless asked to
+    if not worker or estimate:
+        projection = crawler.estimate()
+        if projection is None:
+            print("The crawl has already reached its depth.")
+        else:
+            print(
+                f"Depth {projection.depth}: about {projection.pages} pages for "
+                f"{projection.users} users ({projection.counted} with known counts, "
+                f"{projection.sampled} sampled, {projection.skipped} skipped), "
+                f"taking {timedelta(seconds=round(projection.seconds))}"
+            )
+            print(
+                f"Whole crawl: at most {projection.crawl_pages} pages, taking at most "
+                f"{timedelta(seconds=round(projection.crawl_seconds))}"
+            )
+    if estimate:
+        return
+    if worker:
+        crawler.work(worker_id=worker_id)
+    else:
+        crawler.crawl()
+    for level in crawler.level_stats:
+        print(
+            f"Depth {level.depth}: expanded {level.fetched + level.loaded} of "
+            f"{level.frontier_size} users ({level.fetched} fetched, "
+            f"{level.loaded} loaded, {level.skipped} skipped, "
+            f"{level.sampled} sampled), "
+            f"{level.edges} edges, {level.new_users} new users"
+        )
     print(f"Retrieved {crawler.crawled_count} users from Twitter.")
+    for edge in crawler.edges:
+        for usage in get_credential_pool(edge).usage():
+            print(
+                f"Credential {usage['credential']} ({edge}): "
+                f"{usage['requests']} requests, "
+                f"{usage['rate_limited']} rate limited, "
+                f"{usage['wait_seconds']}s waiting"
+            )
 
 
 @app.command()
@@ -86,10 +287,37 @@ def make_db(
         help="Run ID of dataset to transform and create a DB from.",
     ),
     table_name: str = typer.Option("users", "--table-name"),
+    workers: Optional[int] = typer.Option(
+        None,
+        "--workers",
+        help="Number of threads DuckDB reads crawled files with. Defaults to cores.",
+    ),
+    incremental: bool = typer.Option(
+        False,
+        "--incremental",
+        help="Only load crawled files that haven't been loaded into the table yet.",
+    ),
+    edges: bool = typer.Option(
+        True,
+        "--edges/--no-edges",
+        help="Also create edges and crawl_depth tables.",
+    ),
+    seed_user_id: Optional[str] = typer.Option(
+        None,
+        help="User the crawl started at, for crawl depths. Defaults to the run's seed.",
+    ),
 ):
     """Create a DuckDB database with cleaned & transformed results from a crawl."""
+    from . import data_utils
+
     run_dataset = data_utils.RunDataset(run_id)
-    run_dataset.make_db(table_name)
+    run_dataset.make_db(
+        table_name,
+        threads=workers,
+        incremental=incremental,
+        edges=edges,
+        seed_user_id=int(seed_user_id) if seed_user_id else None,
+    )
     print(f"Successfully made and wrote database to {run_dataset.db_path}")
 
 
@@ -100,45 +328,199 @@ def crawl_stats(
         help="Run ID of dataset to generate stats for.",
     ),
     write_edges: bool = typer.Option(False, "--write-edges"),
+    approx_nodes: bool = typer.Option(
+        False,
+        "--approx-nodes",
+        help="Estimate distinct nodes using constant memory instead of counting.",
+    ),
+    workers: int = typer.Option(
+        1,
+        "--workers",
+        help="Number of processes to parse crawled files with.",
+    ),
+    from_manifest: bool = typer.Option(
+        False,
+        "--manifest",
+        help="Only print stats kept in the run's manifest, without reading files.",
+    ),
 ):
     """Calculate and print statistics about the output of a target crawl."""
+    from humanize import naturalsize
+    from rich.progress import Progress
+
+    from . import data_utils
+    from .manifest import RunManifest
+    from .snapshots import RunSnapshot
+    from .stats import compute_crawl_stats, read_user_ids
+
+    locale.setlocale(locale.LC_ALL, "")
     run_dataset = data_utils.RunDataset(run_id)
-    crawled_paths = run_dataset.users_path.glob("*.json")
-    all_user_ids = set()
-    edges = []
-    edge_counts = []
-    node_counts = []
-    size = 0
-    for user_file in track(list(crawled_paths)):
-        with jsonlines.open(user_file, "r", loads=orjson.loads) as reader:
-            user_ids = [int(user["id"]) for user in reader]
-        if write_edges:
-            source_user_id = data_utils.get_user_id_from_path(user_file)
-            edges.extend([(source_user_id, user_id) for user_id in user_ids])
-        edge_counts.append(len(user_ids))
-        prev_node_count = len(all_user_ids)
-        all_user_ids.update(user_ids)
-        new_node_count = len(all_user_ids) - prev_node_count
-        node_counts.append(new_node_count)
-        size += user_file.stat().st_size
+    # the follow lists of a recrawl are rebuilt from its deltas and baseline
+    is_recrawl = run_dataset.read_recrawl_info() is not None
+    with RunManifest(run_dataset) as manifest:
+        if from_manifest:
+            manifest_stats = manifest.stats()
+            print(f"Users crawled: {manifest_stats.users_crawled:>12n}")
+            print(f"Edges:         {manifest_stats.edges:>12n}")
+            print(f"Mean edges:    {round(manifest_stats.mean_edges):>12n}")
+            print(f"Median edges:  {manifest_stats.median_edges:>12n}")
+            print(f"Size on disk:  {naturalsize(manifest_stats.size):>12}")
+            for depth, users in manifest_stats.users_by_depth.items():
+                label = f"Depth {'unknown' if depth is None else depth}:"
+                print(f"{label:14} {users:>12n}")
+            return
+        # listed from the manifest, as globbing the users of a large run is slow
+        crawled_paths = manifest.get_user_paths(deltas=is_recrawl)
+    with Progress() as progress:
+        task = progress.add_task("Reading crawled files...", total=len(crawled_paths))
+        stats = compute_crawl_stats(
+            run_dataset,
+            crawled_paths,
+            write_edges=write_edges,
+            approx_nodes=approx_nodes,
+            workers=workers,
+            progress=lambda advance: progress.advance(task, advance),
+            read_ids=(
+                RunSnapshot(run_dataset).read_user_file if is_recrawl else read_user_ids
+            ),
+        )
     # print stats output
-    print(f"Users crawled: {len(edge_counts):>12n}")
-    print(f"Nodes:         {len(all_user_ids):>12n}")
-    print(f"Edges:         {sum(edge_counts):>12n}")
-    print(f"Mean edges:    {round(mean(edge_counts)):>12n}")
-    print(f"Median edges:  {median(edge_counts):>12n}")
-    print(f"Size on disk:  {naturalsize(size):>12}")
-
-    # write output files
-    stats_df = pd.DataFrame({"nodes_counts": node_counts, "edge_counts": edge_counts})
-    stats_df.to_parquet(
-        run_dataset.crawl_stats_path, compression="snappy", engine="pyarrow"
+    print(f"Users crawled: {stats.users_crawled:>12n}")
+    print(f"Nodes:         {stats.nodes:>12n}")
+    print(f"Edges:         {stats.edges:>12n}")
+    print(f"Mean edges:    {round(stats.mean_edges):>12n}")
+    print(f"Median edges:  {stats.median_edges:>12n}")
+    print(f"Size on disk:  {naturalsize(stats.size):>12}")
+    print(
+        f"Read {round(stats.files_per_second):n} files/s, "
+        f"{naturalsize(stats.bytes_per_second)}/s in {stats.elapsed:.1f}s"
     )
-    if write_edges:
-        edges_df = pd.DataFrame(edges, columns=["source", "target"])
-        edges_df.to_parquet(
-            run_dataset.edges_path, compression="snappy", engine="pyarrow"
+
+
+@app.command()
+def backfill_manifest(
+    run_id: str = typer.Argument(
+        ...,
+        help="Run ID of dataset to add user files missing from the manifest of.",
+    ),
+):
+    """Add user files saved without the manifest, such as by older versions."""
+    from . import data_utils
+    from .manifest import RunManifest
+
+    locale.setlocale(locale.LC_ALL, "")
+    with RunManifest(data_utils.RunDataset(run_id)) as manifest:
+        added = manifest.backfill()
+        print(f"Added {added:n} user files to the manifest, of {len(manifest):n}")
+
+
+@app.command()
+def snapshot(
+    run_id: str = typer.Argument(
+        ...,
+        help="Run ID of a crawl or recrawl to rebuild the follow graph of.",
+    ),
+    as_of: Optional[datetime] = typer.Option(
+        None,
+        help="Use the latest run in the chain of baselines started by this date.",
+    ),
+    output_path: Optional[Path] = typer.Option(
+        None,
+        "--output",
+        help="Parquet file to write edges to. Defaults to the run's edges.parquet.",
+    ),
+):
+    """Rebuild the edges of a recrawl from its baselines, for graph-stats."""
+    from . import data_utils
+    from .snapshots import RunSnapshot
+
+    locale.setlocale(locale.LC_ALL, "")
+    run_dataset = data_utils.RunDataset(run_id)
+    if as_of is None:
+        run_snapshot = RunSnapshot(run_dataset)
+    else:
+        try:
+            run_snapshot = RunSnapshot.as_of(run_dataset, as_of.astimezone())
+        except MisconfiguredException as error:
+            raise typer.BadParameter(error.msg)
+    output_path = output_path or run_snapshot.run_dataset.edges_path
+    edges = run_snapshot.write_edges(output_path)
+    print(f"Wrote {edges:n} edges of run {run_snapshot.run_id} to {output_path}")
+
+
+@app.command()
+def edge_changes(
+    run_id: str = typer.Argument(
+        ...,
+        help="Run ID of a recrawl to get the edges added and removed in.",
+    ),
+    output_path: Optional[Path] = typer.Option(
+        None,
+        "--output",
+        help="Parquet file to write changes to. Defaults to edge_changes.parquet.",
+    ),
+):
+    """Write the edges added and removed in a recrawl since its baseline."""
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    from . import data_utils
+    from .snapshots import RunSnapshot
+
+    locale.setlocale(locale.LC_ALL, "")
+    run_dataset = data_utils.RunDataset(run_id)
+    if run_dataset.read_recrawl_info() is None:
+        raise typer.BadParameter(f"Run {run_id} is not a recrawl of another run.")
+    changes = RunSnapshot(run_dataset).read_changes()
+    output_path = output_path or run_dataset.dataset_path / "edge_changes.parquet"
+    pq.write_table(changes, output_path, compression="snappy")
+    for row in changes["change"].value_counts().to_pylist():
+        print(f"{row['values'].capitalize() + ':':14} {row['counts']:>12n}")
+    print(f"Users changed: {len(pc.unique(changes['source'])):>12n}")
+    print(f"Wrote edge changes to {output_path}")
+
+
+@app.command()
+def graph_stats(
+    run_id: str = typer.Argument(
+        ...,
+        help="Run ID of dataset to analyse the follow graph of.",
+    ),
+    rebuild: bool = typer.Option(
+        False,
+        "--rebuild",
+        help="Rebuild the cached graph even if the edges file hasn't changed.",
+    ),
+    top: int = typer.Option(10, help="Number of top users by PageRank to show."),
+):
+    """Calculate degree, PageRank, k-core and component metrics for each user."""
+    import numpy as np
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    from . import data_utils
+    from .graph import Graph, compute_node_metrics
+
+    locale.setlocale(locale.LC_ALL, "")
+    run_dataset = data_utils.RunDataset(run_id)
+    if not run_dataset.edges_path.exists():
+        raise typer.BadParameter(
+            f"No edges file found for run {run_id}. "
+            "Run crawl-stats with --write-edges first."
         )
+    graph = Graph.from_run(run_dataset, rebuild=rebuild)
+    metrics = compute_node_metrics(graph)
+    pq.write_table(metrics, run_dataset.node_metrics_path, compression="snappy")
+    components = metrics.column("component").to_numpy()
+    print(f"Nodes:         {graph.num_nodes:>12n}")
+    print(f"Edges:         {graph.num_edges:>12n}")
+    print(f"Components:    {len(np.unique(components)):>12n}")
+    print(f"Max core:      {pc.max(metrics['core_number']).as_py() or 0:>12n}")
+    print(f"Top {top} users by PageRank:")
+    ranked = metrics.sort_by([("pagerank", "descending")]).slice(0, top)
+    for row in ranked.to_pylist():
+        print(f"  {row['user_id']:>20}  {row['pagerank']:.6f}")
+    print(f"Wrote node metrics to {run_dataset.node_metrics_path}")
 
 
 @app.command()
@@ -152,25 +534,216 @@ def id_lookup(
         False,
         help="Display JSON from API response instead of a cleaned User model.",
     ),
+    refresh: bool = typer.Option(
+        False,
+        "--refresh",
+        help="Look up the user from the API even if they are in the profile cache.",
+    ),
 ):
     """Use to Twitter API to retrieve details about a target user from their ID."""
-    response = requests.get(
-        f"https://api.twitter.com/2/users/{user_id}",
-        headers=http_utils.create_headers(),
-        params=http_utils.prepare_params({"user.fields": USER_FIELDS}),
-    )
-    response.raise_for_status()
-    data = response.json()
-    if "data" not in data:
-        print(f"Retrieving user with ID {user_id} failed. Response:")
-        print_json(data)
+    from rich import print_json
+
+    from .models import User
+    from .profile_cache import hydrate
+
+    profiles = hydrate([int(user_id)], refresh=refresh, concurrency=1)
+    if int(user_id) not in profiles:
+        print(f"Retrieving user with ID {user_id} failed.")
+        raise typer.Exit(code=1)
+    data = profiles[int(user_id)]
     if json:
-        print_json(data=response.json())
+        print_json(data=data)
         return
-    user = User.from_data(data["data"])
+    user = User.from_data(data)
     print(user)
 
 
+@app.command()
+def hydrate_users(
+    ids_path: Path = typer.Argument(
+        ...,
+        help="File of user IDs to look up, one per line, or a .npy file of IDs.",
+    ),
+    output_path: Optional[Path] = typer.Option(
+        None,
+        "--output",
+        help="JSON lines or .parquet file to write the profiles found to.",
+    ),
+    refresh: bool = typer.Option(
+        False,
+        "--refresh",
+        help="Look up all users from the API, even if they are in the profile cache.",
+    ),
+    concurrency: int = typer.Option(
+        DEFAULTS.crawler_concurrency,
+        help="Number of lookup requests to make concurrently.",
+    ),
+):
+    """Look up the profiles of many users, 100 per request, using the profile cache."""
+    import orjson
+    import pyarrow.parquet as pq
+    from rich.progress import Progress
+
+    from . import data_utils
+    from .models import users_to_table
+    from .profile_cache import ProfileCache, hydrate
+
+    locale.setlocale(locale.LC_ALL, "")
+    user_ids = data_utils.read_user_id_file(ids_path)
+    with ProfileCache() as profile_cache:
+        cached = len(profile_cache.get_many(user_ids)) if not refresh else 0
+        with Progress() as progress:
+            task = progress.add_task(
+                "Looking up users...", total=len(set(user_ids)) - cached
+            )
+            profiles = hydrate(
+                user_ids,
+                profile_cache,
+                refresh=refresh,
+                concurrency=concurrency,
+                progress=lambda advance: progress.advance(task, advance),
+            )
+    found = [
+        profiles[user_id] for user_id in dict.fromkeys(user_ids) if user_id in profiles
+    ]
+    if output_path is not None and output_path.suffix == ".parquet":
+        pq.write_table(users_to_table(found), output_path)
+    elif output_path is not None:
+        with open(output_path, "wb") as f:
+            for user in found:
+                f.write(orjson.dumps(user) + b"\n")
+    print(f"Users requested:  {len(set(user_ids)):>12n}")
+    print(f"From cache:       {cached:>12n}")
+    print(f"Looked up:        {len(profiles) - cached:>12n}")
+    print(f"Not found:        {len(set(user_ids)) - len(profiles):>12n}")
+
+
+@app.command()
+def bench(
+    output_path: Optional[Path] = typer.Option(
+        None,
+        "--output",
+        help="JSON file to save results to. Defaults to bench_<time>.json.",
+    ),
+    benchmark: Optional[list[str]] = typer.Option(
+        None,
+        help=f"Benchmark to run, can be repeated. One of {Benchmark.__args__}.",
+    ),
+    users: int = typer.Option(10_000, help="Number of users in the synthetic graph."),
+    mean_follows: float = typer.Option(50, help="Mean number of follows per user."),
+    depth: int = typer.Option(2, help="Depth of the crawl benchmark."),
+    edge: str = typer.Option("following", callback=edge_callback),
+    concurrency: int = typer.Option(DEFAULTS.crawler_concurrency),
+    storage: str = typer.Option(
+        DEFAULTS.storage_format, callback=storage_format_callback
+    ),
+    fetch_users: int = typer.Option(
+        10, help="Number of users with the most follows to fetch."
+    ),
+    workers: int = typer.Option(1, help="Workers for crawl-stats and make-db."),
+    latency: float = typer.Option(0.0, help="Seconds the mock API takes to respond."),
+    jitter: float = typer.Option(0.0, help="Random extra latency, up to this many."),
+    error_rate: float = typer.Option(0.0, help="Fraction of requests that fail."),
+    seed: int = typer.Option(0, help="Random seed for the synthetic graph."),
+):
+    """Benchmark crawling and processing a synthetic graph from a mock API."""
+    import orjson
+    from humanize import naturalsize
+
+    from .bench import BENCHMARKS, BenchmarkOptions, run_benchmarks
+
+    logger.setLevel(logging.INFO)
+    for name in benchmark or []:
+        if name not in BENCHMARKS:
+            raise typer.BadParameter(f"Benchmark must be one of {BENCHMARKS}.")
+    options = BenchmarkOptions(
+        users=users,
+        mean_follows=mean_follows,
+        depth=depth,
+        edge=edge,
+        concurrency=concurrency,
+        storage=storage,
+        fetch_users=fetch_users,
+        workers=workers,
+        latency=latency,
+        jitter=jitter,
+        error_rate=error_rate,
+        seed=seed,
+    )
+    report = run_benchmarks(options, benchmark or BENCHMARKS)
+    for result in report.results:
+        print(
+            f"{result.name:12} {result.wall_time:8.2f}s "
+            f"{result.requests_per_second:10.1f} requests/s "
+            f"{result.pages_per_second:10.1f} pages/s "
+            f"{result.edges_per_second:12.1f} edges/s "
+            f"{naturalsize(result.peak_rss):>10} peak RSS"
+        )
+    if output_path is None:
+        output_path = Path(f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    output_path.write_bytes(orjson.dumps(report.to_dict(), option=orjson.OPT_INDENT_2))
+    print(f"Wrote results to {output_path}")
+
+
+@app.command()
+def check_startup(
+    budget: Optional[float] = typer.Option(
+        None, help="Seconds importing the CLI may take. Defaults to 0.5."
+    ),
+    repeat: int = typer.Option(5, help="Number of times to import the CLI."),
+):
+    """Check the CLI starts within a time budget, exiting with 1 if it doesn't."""
+    from .bench import STARTUP_BUDGET, measure_startup
+
+    budget = STARTUP_BUDGET if budget is None else budget
+    result = measure_startup(repeat=repeat)
+    print(f"Imported CLI in {result.seconds:.3f}s, budget is {budget:.3f}s")
+    print("Slowest imports:")
+    for module, seconds in result.slowest_imports:
+        print(f"  {seconds:8.3f}s  {module}")
+    if result.seconds > budget:
+        print("CLI startup is over budget.")
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def mock_api(
+    port: int = typer.Option(8000, help="Port to serve the mock API on."),
+    users: int = typer.Option(10_000, help="Number of users in the synthetic graph."),
+    mean_follows: float = typer.Option(50, help="Mean number of follows per user."),
+    latency: float = typer.Option(0.0, help="Seconds the mock API takes to respond."),
+    jitter: float = typer.Option(0.0, help="Random extra latency, up to this many."),
+    error_rate: float = typer.Option(0.0, help="Fraction of requests that fail."),
+    rate_limit: Optional[int] = typer.Option(
+        None, help="Requests allowed per token and endpoint each window."
+    ),
+    rate_window: float = typer.Option(15 * 60, help="Seconds in a rate limit window."),
+    seed: int = typer.Option(0, help="Random seed for the synthetic graph."),
+):
+    """Serve a mock Twitter API with a synthetic graph, for testing the crawler."""
+    from .mock_api import MockAPIServer, MockTwitterAPI, make_power_law_graph
+
+    logger.setLevel(logging.INFO)
+    graph = make_power_law_graph(users, mean_follows=mean_follows, seed=seed)
+    api = MockTwitterAPI(
+        graph,
+        latency=latency,
+        jitter=jitter,
+        error_rate=error_rate,
+        rate_limit=rate_limit,
+        rate_window=rate_window,
+        seed=seed,
+    )
+    server = MockAPIServer(api, port=port)
+    print(f"Serving {graph.num_nodes} users and {graph.num_edges} edges")
+    print(f"Set BIRBNET_API_URL={server.url} to crawl the mock API")
+    print(f"Example seed user ID: {graph.ids[0]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server.server_close()
+
+
 @app.command()
 def get_config():
     """Display the current configuration of Birbnet."""
@@ -182,3 +755,278 @@ def get_config():
         item = f"{setting:{padding_len}}{str(value)}"
         results.append(item)
     print("\n".join(results))
+
+
+def load_graph_query(run_id: str, rebuild: bool = False):
+    from . import data_utils
+    from .query import GraphQuery
+
+    try:
+        return GraphQuery.from_run(data_utils.RunDataset(run_id), rebuild=rebuild)
+    except MisconfiguredException as error:
+        raise typer.BadParameter(error.msg)
+
+
+@query_app.command("neighborhood")
+def query_neighborhood(
+    run_id: str = typer.Argument(..., help="Run ID of dataset to query the graph of."),
+    user_id: int = typer.Argument(..., help="User to get the neighborhood of."),
+    hops: int = typer.Option(1, help="Maximum number of edges from the user."),
+    direction: str = typer.Option(
+        "out",
+        help="Edges to follow: out of users, into them, or both.",
+        callback=direction_callback,
+    ),
+    linked_to: Optional[int] = typer.Option(
+        None,
+        help="Only keep users with an edge to this user.",
+    ),
+    output: Optional[Path] = typer.Option(
+        None,
+        help="Parquet file to write the user IDs and distances to.",
+    ),
+):
+    """Find the users within a number of hops of a user."""
+    import pyarrow.parquet as pq
+
+    graph_query = load_graph_query(run_id)
+    try:
+        neighborhood = graph_query.neighborhood(user_id, hops, direction, linked_to)
+    except MisconfiguredException as error:
+        raise typer.BadParameter(error.msg)
+    counts = neighborhood.group_by("distance").aggregate([("user_id", "count")])
+    for row in counts.sort_by("distance").to_pylist():
+        print(f"{row['distance']} hops: {row['user_id_count']} users")
+    if output is not None:
+        pq.write_table(neighborhood, output)
+        print(f"Wrote {neighborhood.num_rows} users to {output}")
+    else:
+        print("\n".join(map(str, neighborhood["user_id"].to_pylist())))
+
+
+@query_app.command("mutual")
+def query_mutual(
+    run_id: str = typer.Argument(..., help="Run ID of dataset to query the graph of."),
+    user_id: int = typer.Argument(..., help="User to get the mutual follows of."),
+):
+    """Find the users with edges both to and from a user."""
+    graph_query = load_graph_query(run_id)
+    try:
+        user_ids = graph_query.mutual_follows(user_id)
+    except MisconfiguredException as error:
+        raise typer.BadParameter(error.msg)
+    print(f"{len(user_ids)} mutual follows")
+    print("\n".join(map(str, user_ids.tolist())))
+
+
+@query_app.command("common")
+def query_common(
+    run_id: str = typer.Argument(..., help="Run ID of dataset to query the graph of."),
+    user_id: int = typer.Argument(..., help="First user."),
+    other_user_id: int = typer.Argument(..., help="Second user."),
+    direction: str = typer.Option(
+        "out",
+        help="Edges to follow: out of users, into them, or both.",
+        callback=direction_callback,
+    ),
+):
+    """Find the users that are neighbors of both of two users."""
+    graph_query = load_graph_query(run_id)
+    try:
+        user_ids = graph_query.common_neighbors(user_id, other_user_id, direction)
+    except MisconfiguredException as error:
+        raise typer.BadParameter(error.msg)
+    print(f"{len(user_ids)} common neighbors")
+    print("\n".join(map(str, user_ids.tolist())))
+
+
+@query_app.command("path")
+def query_path(
+    run_id: str = typer.Argument(..., help="Run ID of dataset to query the graph of."),
+    source_user_id: int = typer.Argument(..., help="User the path starts at."),
+    target_user_id: int = typer.Argument(..., help="User the path ends at."),
+    direction: str = typer.Option(
+        "out",
+        help="Edges to follow: out of users, into them, or both.",
+        callback=direction_callback,
+    ),
+):
+    """Find a shortest path between two users."""
+    graph_query = load_graph_query(run_id)
+    try:
+        path = graph_query.shortest_path(source_user_id, target_user_id, direction)
+    except MisconfiguredException as error:
+        raise typer.BadParameter(error.msg)
+    if path is None:
+        print(f"No path from {source_user_id} to {target_user_id}")
+        raise typer.Exit(1)
+    print(f"{len(path) - 1} hops: {' -> '.join(map(str, path))}")
+
+
+def open_run_analytics(
+    run_id: str, table_name: str, threads: int | None, memory_limit: str | None
+):
+    from . import data_utils
+    from .analytics import RunAnalytics
+
+    try:
+        return RunAnalytics(
+            data_utils.RunDataset(run_id),
+            table_name=table_name,
+            threads=threads,
+            memory_limit=memory_limit,
+        )
+    except MisconfiguredException as error:
+        raise typer.BadParameter(error.msg)
+
+
+def run_report(run_analytics, report: str, **kwargs) -> None:
+    """Write a report with a method of `RunAnalytics`, printing where it went."""
+    start = time.perf_counter()
+    with run_analytics:
+        try:
+            output_path, rows = getattr(run_analytics, report)(**kwargs)
+        except MisconfiguredException as error:
+            raise typer.BadParameter(error.msg)
+    elapsed = time.perf_counter() - start
+    print(f"Wrote {rows:n} rows to {output_path} in {elapsed:.1f}s")
+
+
+@analyze_app.command("degrees")
+def analyze_degrees(
+    run_id: str = typer.Argument(..., help="Run ID of dataset to analyze."),
+    output: Optional[Path] = typer.Option(
+        None,
+        help="Parquet file to write to. Defaults to analysis/degrees.parquet.",
+    ),
+    table_name: str = typer.Option("users", "--table-name"),
+    threads: Optional[int] = typer.Option(
+        None,
+        help="Number of threads DuckDB runs the query with. Defaults to cores.",
+    ),
+    memory_limit: Optional[str] = typer.Option(
+        None,
+        help="Memory DuckDB can use before spilling to disk, such as 8GB.",
+    ),
+):
+    """Write the distributions of users' follow counts and degrees."""
+    locale.setlocale(locale.LC_ALL, "")
+    run_analytics = open_run_analytics(run_id, table_name, threads, memory_limit)
+    run_report(run_analytics, "degrees", output_path=output)
+
+
+@analyze_app.command("ratios")
+def analyze_ratios(
+    run_id: str = typer.Argument(..., help="Run ID of dataset to analyze."),
+    output: Optional[Path] = typer.Option(
+        None,
+        help="Parquet file to write to. Defaults to analysis/follow_ratios.parquet.",
+    ),
+    table_name: str = typer.Option("users", "--table-name"),
+    threads: Optional[int] = typer.Option(
+        None,
+        help="Number of threads DuckDB runs the query with. Defaults to cores.",
+    ),
+    memory_limit: Optional[str] = typer.Option(
+        None,
+        help="Memory DuckDB can use before spilling to disk, such as 8GB.",
+    ),
+):
+    """Write the distribution of users' ratios of followers to following."""
+    locale.setlocale(locale.LC_ALL, "")
+    run_analytics = open_run_analytics(run_id, table_name, threads, memory_limit)
+    run_report(run_analytics, "follow_ratios", output_path=output)
+
+
+@analyze_app.command("account-age")
+def analyze_account_age(
+    run_id: str = typer.Argument(..., help="Run ID of dataset to analyze."),
+    interval: str = typer.Option(
+        "month",
+        help="Period to count account creations over: day, week, month or year.",
+        callback=date_interval_callback,
+    ),
+    output: Optional[Path] = typer.Option(
+        None,
+        help="Parquet file to write to. Defaults to analysis/account_ages.parquet.",
+    ),
+    table_name: str = typer.Option("users", "--table-name"),
+    threads: Optional[int] = typer.Option(
+        None,
+        help="Number of threads DuckDB runs the query with. Defaults to cores.",
+    ),
+    memory_limit: Optional[str] = typer.Option(
+        None,
+        help="Memory DuckDB can use before spilling to disk, such as 8GB.",
+    ),
+):
+    """Write the number of accounts created in each period."""
+    locale.setlocale(locale.LC_ALL, "")
+    run_analytics = open_run_analytics(run_id, table_name, threads, memory_limit)
+    run_report(run_analytics, "account_ages", interval=interval, output_path=output)
+
+
+@analyze_app.command("domains")
+def analyze_domains(
+    run_id: str = typer.Argument(..., help="Run ID of dataset to analyze."),
+    min_followers: int = typer.Option(
+        0,
+        help="Only count users with at least this many followers.",
+    ),
+    output: Optional[Path] = typer.Option(
+        None,
+        help="Parquet file to write to. Defaults to analysis/url_domains.parquet.",
+    ),
+    table_name: str = typer.Option("users", "--table-name"),
+    threads: Optional[int] = typer.Option(
+        None,
+        help="Number of threads DuckDB runs the query with. Defaults to cores.",
+    ),
+    memory_limit: Optional[str] = typer.Option(
+        None,
+        help="Memory DuckDB can use before spilling to disk, such as 8GB.",
+    ),
+):
+    """Write the number of users linking to each domain from their profile."""
+    locale.setlocale(locale.LC_ALL, "")
+    run_analytics = open_run_analytics(run_id, table_name, threads, memory_limit)
+    run_report(
+        run_analytics, "url_domains", min_followers=min_followers, output_path=output
+    )
+
+
+@analyze_app.command("reciprocity")
+def analyze_reciprocity(
+    run_id: str = typer.Argument(..., help="Run ID of dataset to analyze."),
+    top: int = typer.Option(
+        100,
+        help="Number of most reciprocated users to keep. Keeps all if 0.",
+    ),
+    min_edges: int = typer.Option(
+        10,
+        help="Only keep users with at least this many edges to crawled users.",
+    ),
+    output: Optional[Path] = typer.Option(
+        None,
+        help="Parquet file to write to. Defaults to analysis/reciprocity.parquet.",
+    ),
+    table_name: str = typer.Option("users", "--table-name"),
+    threads: Optional[int] = typer.Option(
+        None,
+        help="Number of threads DuckDB runs the query with. Defaults to cores.",
+    ),
+    memory_limit: Optional[str] = typer.Option(
+        None,
+        help="Memory DuckDB can use before spilling to disk, such as 8GB.",
+    ),
+):
+    """Write the crawled users with the largest share of reciprocated edges."""
+    locale.setlocale(locale.LC_ALL, "")
+    run_analytics = open_run_analytics(run_id, table_name, threads, memory_limit)
+    run_report(
+        run_analytics,
+        "reciprocity",
+        top=top or None,
+        min_edges=min_edges,
+        output_path=output,
+    )
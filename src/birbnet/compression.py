@@ -0,0 +1,74 @@
+import gzip
+import os
+from pathlib import Path
+
+from .exceptions import MisconfiguredException
+from .types import Compression
+
+# file extensions of JSON lines user files, by what they're compressed with
+JSON_EXTENSIONS = {None: "json", "gzip": "json.gz", "zstd": "json.zst"}
+
+# compression levels balancing speed and size, as pages are written while crawling
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def get_json_extension(compression: Compression | None) -> str:
+    """Get the extension of new JSON lines user files saved with a compression."""
+    return JSON_EXTENSIONS[compression]
+
+
+def get_compression(path: os.PathLike | str) -> Compression | None:
+    """Get what a file is compressed with from its extension, or None if it isn't."""
+    name = Path(path).name
+    if name.endswith(".gz"):
+        return "gzip"
+    if name.endswith(".zst"):
+        return "zstd"
+    return None
+
+
+def is_json_user_file(path: os.PathLike | str) -> bool:
+    """Check if a path is a JSON lines user file, compressed or not."""
+    name = Path(path).name
+    return any(name.endswith(f".{extension}") for extension in JSON_EXTENSIONS.values())
+
+
+def read_compressed(path: os.PathLike | str) -> bytes:
+    """Read the contents of a file, decompressing them according to its extension."""
+    data = Path(path).read_bytes()
+    compression = get_compression(path)
+    if compression == "gzip":
+        return gzip.decompress(data)
+    if compression == "zstd":
+        # frames written in pieces don't record their size, so stream them
+        return _import_zstandard().ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+
+def write_compressed(path: os.PathLike | str, data: bytes) -> None:
+    """Write data to a file, compressed according to its extension.
+
+    The file is written to a temporary path and then renamed, so it only
+    exists once it is complete.
+    """
+    path = Path(path)
+    compression = get_compression(path)
+    if compression == "gzip":
+        data = gzip.compress(data, compresslevel=GZIP_LEVEL)
+    elif compression == "zstd":
+        data = _import_zstandard().ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    tmp_path.write_bytes(data)
+    tmp_path.replace(path)
+
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise MisconfiguredException(
+            "zstd compressed user files need the zstandard package. "
+            "Install it with: pip install birbnet[zstd]"
+        )
+    return zstandard
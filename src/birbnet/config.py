@@ -1,14 +1,38 @@
 import os
 from pathlib import Path
+from typing import Optional
 
-from pydantic.dataclasses import dataclass
+from dataclasses import dataclass
 
 BEARER_TOKEN = os.getenv("BIRBNET_TWITTER_BEARER_TOKEN")
 
+# comma separated bearer tokens. when set, crawl requests are spread across all
+# of these tokens, each with its own rate limit, instead of using BEARER_TOKEN.
+BEARER_TOKENS = [
+    token
+    for token in os.getenv("BIRBNET_TWITTER_BEARER_TOKENS", "").split(",")
+    if token.strip()
+]
+
 SEED_USER_ID = os.getenv("BIRBNET_TWITTER_USER_ID")
 
+# base URL of the Twitter API. can be pointed at a stub server for testing.
+API_URL = os.getenv("BIRBNET_API_URL", "https://api.twitter.com/2").rstrip("/")
+
 DATA_PATH = Path(os.getenv("BIRBNET_DATA_PATH", Path.home() / "birbnet_data"))
 
+# SQLite database of user profiles shared by all runs, filled from every page the
+# crawler fetches and used to look up users without calling the API again.
+PROFILE_CACHE_PATH = Path(
+    os.getenv("BIRBNET_PROFILE_CACHE_PATH", DATA_PATH / "profiles.db")
+)
+
+# file of user IDs the crawler never expands, one per line. useful for accounts
+# with so many follows that fetching them would use up the rate limit.
+EXCLUDE_USERS_PATH = Path(
+    os.getenv("BIRBNET_EXCLUDE_USERS_PATH", DATA_PATH / "excluded_users.txt")
+)
+
 
 @dataclass
 class Defaults:
@@ -20,5 +44,64 @@ class Defaults:
     # limited request quota for this endpoint less effective.
     crawler_max_results: int = 1000
 
+    # number of users the crawler fetches pages for concurrently. all requests
+    # share the same rate limit, so this mostly helps to keep the quota used
+    # while other requests are waiting on the network.
+    crawler_concurrency: int = 4
+
+    # how crawled users are saved. "json" writes the full API response for each
+    # user's follows as JSON lines. "columnar" writes an int64 .npy file of IDs
+    # per user, plus one deduplicated Arrow store of profiles for the whole run.
+    storage_format: str = "json"
+
+    # compression for JSON lines user files: "zstd", "gzip" or None. compressed
+    # files are read transparently, so a run can mix them with plain files, such
+    # as when switching an existing run over to compression. zstd needs the
+    # zstandard package.
+    storage_compression: Optional[str] = None
+
+    # order users in each depth are expanded in. "bfs" expands them in the order
+    # they were found, "fewest_edges" expands users with the fewest follows of
+    # the type being crawled first, and "most_inlinks" expands users linked to
+    # by the most already crawled users first.
+    crawler_policy: str = "bfs"
+
+    # maximum number of pages to fetch for any one user, or None for no limit.
+    # users with more follows than this only have their first pages saved.
+    crawler_max_pages: Optional[int] = None
+
+    # maximum number of follows to fetch for any one user, or None for no limit.
+    # users are checked against their follow counts before any pages are fetched,
+    # using profiles in the profile cache, so large accounts don't use up the
+    # rate limit. "sample" fetches only the first follows of users over the
+    # budget, and "skip" doesn't fetch them at all.
+    crawler_max_edges: Optional[int] = None
+    crawler_large_users: str = "sample"
+
+    # retries of API requests that fail with a connection error or a 5xx status.
+    # retries back off exponentially from the base number of seconds up to the
+    # maximum, waiting a random fraction of that so concurrent requests spread
+    # out. requests rejected by the rate limit wait for it to reset instead.
+    http_max_retries: int = 5
+    http_backoff_base: float = 1.0
+    http_backoff_max: float = 60.0
+
+    # seconds a profile in the profile cache is used for before it's considered
+    # stale and looked up from the API again.
+    profile_cache_ttl: int = 7 * 24 * 60 * 60
+
+    # seconds a crawl worker holds a user it has claimed from the run's work
+    # queue. workers renew their leases while alive, so this is how long it takes
+    # for users claimed by a worker that died to be handed to another worker.
+    worker_lease_seconds: int = 5 * 60
+
+    # seconds between snapshots of crawl metrics written to the run's metrics
+    # log. they are also served for Prometheus when a metrics port is given.
+    metrics_interval: int = 60
+
+    # interface the metrics port listens on. only local connections are
+    # accepted unless this is changed, for example to "0.0.0.0" for all.
+    metrics_host: str = "127.0.0.1"
+
 
 DEFAULTS = Defaults()
@@ -1,93 +1,592 @@
+import asyncio
 import logging
 import os
+import socket
+from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
+from typing import BinaryIO
 
-import jsonlines
+import httpx
+import numpy as np
 import orjson
-import requests
-from pyrate_limiter import Duration, Limiter, RequestRate
-from requests.adapters import HTTPAdapter, Retry
 
 from . import config, http_utils, data_utils, validate
+from .compression import (
+    JSON_EXTENSIONS,
+    get_json_extension,
+    read_compressed,
+    write_compressed,
+)
+from .manifest import RunManifest
+from .exceptions import MisconfiguredException
 from .config import DEFAULTS
+from .metrics import (
+    BYTES_WRITTEN,
+    FRONTIER_REMAINING,
+    FRONTIER_SIZE,
+    PAGES_FETCHED,
+    USERS_EXPANDED,
+    USERS_FETCHED,
+    WRITE_SECONDS,
+    record_metrics,
+)
 from .models import USER_FIELDS
-from .types import Edge
+from .preflight import (
+    FrontierEstimate,
+    combine_estimates,
+    estimate_frontier,
+    plan_fetch,
+)
+from .profile_cache import ProfileCache, hydrate_async
+from .rate_limit import CredentialPool
+from .scheduler import FrontierScheduler, read_exclusion_file
+from .snapshots import (
+    DELTA_EXTENSION,
+    RunSnapshot,
+    apply_delta,
+    diff_edges,
+    read_delta_file,
+    start_recrawl,
+    write_delta_file,
+)
+from .storage import ProfileStore, profiles_to_users, read_edge_file, write_edge_file
+from .types import (
+    Compression,
+    CrawlEdge,
+    Edge,
+    LargeUserPolicy,
+    SchedulerPolicy,
+    StorageFormat,
+)
+from .work_queue import WorkQueue
 
 logger = logging.getLogger(__package__)
 
-# 15 requests every 15 minutes plus some padding to add tolerance
-limiter = Limiter(RequestRate(15, 15 * Duration.MINUTE + 10))
+# follow lookups are limited to 15 requests every 15 minutes per token, counted
+# separately for following and followers lookups, so each has its own pool. the
+# pools are created on first use and shared by all requests made by this process.
+_credential_pools: dict[Edge, CredentialPool] = {}
 api_requests = 0
 
 
+@dataclass
+class LevelStats:
+    """Counts collected while expanding a single depth of a crawl.
+
+    Users are counted once for each edge type crawled, so a crawl of both
+    edges counts each follow list.
+    """
+
+    depth: int
+    frontier_size: int
+    fetched: int = 0
+    loaded: int = 0
+    skipped: int = 0
+    sampled: int = 0
+    edges: int = 0
+    new_users: int = 0
+
+
+def get_credential_pool(edge: Edge) -> CredentialPool:
+    """Get the process-wide pool of bearer tokens used for lookups of an edge type."""
+    if edge not in _credential_pools:
+        _credential_pools[edge] = CredentialPool.from_tokens(
+            http_utils.get_bearer_tokens(), limit=15, window=15 * 60, name=edge
+        )
+    return _credential_pools[edge]
+
+
 class BirbCrawler:
     """Class for crawling followers or following users given an initial user."""
 
     def __init__(
         self,
-        edge: Edge,
+        edge: CrawlEdge,
         user_id: str | None = None,
         run_id: str | None = None,
         depth: int = DEFAULTS.crawler_depth,
+        concurrency: int = DEFAULTS.crawler_concurrency,
+        storage: StorageFormat = DEFAULTS.storage_format,
+        compression: Compression | None = DEFAULTS.storage_compression,
+        policy: SchedulerPolicy = DEFAULTS.crawler_policy,
+        max_pages: int | None = DEFAULTS.crawler_max_pages,
+        max_edges: int | None = DEFAULTS.crawler_max_edges,
+        large_users: LargeUserPolicy = DEFAULTS.crawler_large_users,
+        probe_counts: bool = False,
+        exclude_path: Path | None = config.EXCLUDE_USERS_PATH,
+        metrics_port: int | None = None,
+        metrics_host: str = DEFAULTS.metrics_host,
+        metrics_interval: float = DEFAULTS.metrics_interval,
+        baseline_run_id: str | None = None,
     ) -> None:
         """Initialise a BirbCrawler instance.
 
         Arguments:
-        edge       -- Specifies crawl direction: "following" or "followers".
+        edge             -- Specifies crawl direction: "following", "followers" or
+                            "both", which fetches both for each user at once.
 
         Keyword Arguments:
-        user_id    -- User to start crawl at. if None uses BIRBNET_SEED_USER_ID.
-        run_id     -- ID used to track this run for saving output and resuming.
-        depth      -- Crawl depth to stop at in the connected user graph.
+        user_id          -- User to start crawl at. if None uses BIRBNET_SEED_USER_ID.
+        run_id           -- ID used to track this run for saving output and resuming.
+        depth            -- Crawl depth to stop at in the connected user graph.
+        concurrency      -- Number of users to fetch pages for at the same time.
+        storage          -- Format to save crawled users in: "json" or "columnar".
+        compression      -- Compression for JSON user files: "zstd", "gzip" or None.
+        policy           -- Order to expand users in each depth. See FrontierScheduler.
+        max_pages        -- Maximum number of pages to fetch for each user.
+        max_edges        -- Maximum number of follows to fetch for each user.
+        large_users      -- Users over max_edges are "sample"d or "skip"ped.
+        probe_counts     -- Look up follow counts missing from the profile cache.
+        exclude_path     -- File of user IDs to never expand, if it exists.
+        metrics_port     -- Port to serve Prometheus metrics on. if None not served.
+        metrics_host     -- Interface to serve metrics on. Defaults to localhost.
+        metrics_interval -- Seconds between snapshots in the run's metrics log.
+        baseline_run_id  -- Earlier run to only store changes to follow lists since.
         """
         self.edge = edge
+        self.edges = data_utils.get_crawl_edges(edge)
         self.user_id = user_id or config.SEED_USER_ID
         self.run_id = run_id
         self.depth = depth
+        self.concurrency = concurrency
+        self.storage = storage
+        self.compression = compression
+        self.max_pages = max_pages
+        self.max_edges = max_edges
+        self.large_users = large_users
+        self.probe_counts = probe_counts
+        self.scheduler = FrontierScheduler(policy, edge)
+        self.excluded_user_ids = read_exclusion_file(exclude_path)
+        self.metrics_port = metrics_port
+        self.metrics_host = metrics_host
+        self.metrics_interval = metrics_interval
         self.crawled_count = 0
         self.request_count = 0
+        self.level_stats: list[LevelStats] = []
+        self.estimates: list[FrontierEstimate] = []
+        # estimates made by `estimate` before the crawl, by depth, so the crawl
+        # doesn't look up the same follow counts again
+        self._preflight_estimates: dict[int, FrontierEstimate] = {}
+        # opened for the duration of each crawl
+        self.profile_store: ProfileStore | None = None
+        self.profile_cache: ProfileCache | None = None
+        self.manifest: RunManifest | None = None
 
         if self.run_id is None:
             date = datetime.now().strftime("%Y%m%d")
             self.run_id = f"{self.user_id}_{date}"
         validate.validate_user_id(self.user_id)
-        validate.validate_edge(self.edge)
+        validate.validate_crawl_edge(self.edge)
+        validate.validate_storage_format(self.storage)
+        validate.validate_compression(self.compression)
+        validate.validate_scheduler_policy(policy)
+        validate.validate_large_user_policy(large_users)
+        self.run_dataset = data_utils.RunDataset(self.run_id)
+        self.baseline_run_id = baseline_run_id
+        self.baseline = None
+        if baseline_run_id is not None:
+            if self.storage != "columnar":
+                raise MisconfiguredException(
+                    "Recrawls against a baseline must use columnar storage."
+                )
+            self.baseline = RunSnapshot(data_utils.RunDataset(baseline_run_id))
 
-    def crawl(self, user_ids: list[str] | None = None, current_depth: int = 0) -> None:
-        """Perform a crawl of specified users, or start with seed user."""
-        if current_depth == self.depth:
-            return
-        if current_depth == 0:
-            logger.info("Starting crawl with run ID: %s", self.run_id)
-        if user_ids is None:
-            user_ids = [self.user_id]
-        new_depth = current_depth + 1
-        logger.info("Crawler at depth %d", new_depth)
-        for i, user_id in enumerate(user_ids):
-            if user_id in {"5380672", "87403396", "17881816", "37599351", "15210670"}:
-                logger.info("Depth %d: SKIPPED user %s", new_depth, user_id)
-                continue
-            user_fetcher = UserFetcher(user_id, self.edge, run_id=self.run_id)
-            if user_fetcher.output_path.exists():
-                users = user_fetcher.read_users()
-                source = "LOADED"
-            else:
-                users = user_fetcher.fetch_users()
-                user_fetcher.write_users(users)
-                source = "FETCHED"
-            logger.info(
-                "Depth %d: %s %d users for user %s (%d/%d)",
-                new_depth,
-                source,
-                len(users),
-                user_id,
-                i + 1,
-                len(user_ids),
+    def crawl(self) -> None:
+        """Perform a breadth-first crawl starting at the seed user.
+
+        Each depth's frontier is persisted to the run dataset before it is
+        expanded, so an interrupted crawl resumes at the last frontier written
+        rather than walking the graph again from the seed user. Every user is
+        expanded at most once, no matter how many paths lead to them.
+        """
+        asyncio.run(self.crawl_async())
+
+    async def crawl_async(self) -> None:
+        logger.info("Starting crawl with run ID: %s", self.run_id)
+        if self.baseline_run_id is not None:
+            start_recrawl(self.run_dataset, self.baseline_run_id)
+        start_depth, frontier, visited = self.load_frontier()
+        if start_depth == 0:
+            self.run_dataset.write_frontier(0, frontier)
+        else:
+            logger.info("Resuming crawl from frontier at depth %d", start_depth)
+
+        self.profile_store = (
+            ProfileStore(self.run_dataset) if self.storage == "columnar" else None
+        )
+        self.profile_cache = ProfileCache()
+        self.manifest = RunManifest(self.run_dataset)
+        try:
+            async with record_metrics(
+                self.run_dataset.get_metrics_path(),
+                self.metrics_interval,
+                self.metrics_port,
+                self.metrics_host,
+            ), http_utils.make_async_client(self.concurrency) as client:
+                for depth in range(start_depth, self.depth):
+                    next_frontier = await self.crawl_level(
+                        client, frontier, depth, visited
+                    )
+                    if depth + 1 < self.depth:
+                        self.run_dataset.write_frontier(depth + 1, next_frontier)
+                    frontier = next_frontier
+        finally:
+            self.manifest.close()
+            self.profile_cache.close()
+            if self.profile_store is not None:
+                self.profile_store.close()
+
+    def load_frontier(self) -> tuple[int, list[int], set[int]]:
+        """Get the depth and users of the frontier to crawl next, and users seen.
+
+        This is the last frontier written to the run dataset, or the seed user
+        for a new crawl. Nothing is written.
+        """
+        start_depth = self.run_dataset.last_frontier_depth()
+        if start_depth is None:
+            frontier = [int(self.user_id)]
+            return 0, frontier, set(frontier)
+        frontier = self.run_dataset.read_frontier(start_depth).tolist()
+        visited = set()
+        for depth in range(start_depth + 1):
+            visited.update(self.run_dataset.read_frontier(depth).tolist())
+        return start_depth, frontier, visited
+
+    def estimate(self) -> FrontierEstimate | None:
+        """Estimate the cost of the crawl from the frontier it would start at.
+
+        Nothing is crawled, but follow counts are looked up if `probe_counts`
+        is set. Returns None if the crawl has already reached its depth. The
+        estimate is kept for when `crawl` is next run, which starts at the same
+        frontier, rather than made again.
+        """
+        return asyncio.run(self.estimate_async())
+
+    async def estimate_async(self) -> FrontierEstimate | None:
+        start_depth, frontier, _ = self.load_frontier()
+        if start_depth >= self.depth:
+            return None
+        self.profile_cache = ProfileCache()
+        self.manifest = RunManifest(self.run_dataset)
+        try:
+            async with http_utils.make_async_client(self.concurrency) as client:
+                estimate = await self.preflight(client, frontier, start_depth)
+        finally:
+            self.manifest.close()
+            self.profile_cache.close()
+        self._preflight_estimates[start_depth] = estimate
+        return estimate
+
+    def work(
+        self,
+        worker_id: str | None = None,
+        lease_seconds: float = DEFAULTS.worker_lease_seconds,
+        poll_interval: float = 5,
+    ) -> None:
+        """Expand users from the run's shared work queue until the crawl is done.
+
+        Any number of processes can work on the same run at once. Each claims
+        users from a queue in the run's dataset, expands them, and adds the
+        users found to the queue, until no users are left to expand. Users are
+        claimed in order of depth rather than by the scheduler policy. The
+        first worker to start adds the seed user to the queue.
+        """
+        asyncio.run(self.work_async(worker_id, lease_seconds, poll_interval))
+
+    async def work_async(
+        self,
+        worker_id: str | None = None,
+        lease_seconds: float = DEFAULTS.worker_lease_seconds,
+        poll_interval: float = 5,
+    ) -> None:
+        worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        logger.info("Starting worker %s with run ID: %s", worker_id, self.run_id)
+        if self.baseline_run_id is not None:
+            start_recrawl(self.run_dataset, self.baseline_run_id)
+        if not self.run_dataset.get_frontier_path(0).exists():
+            # records the seed user, as in a crawl run by a single process
+            self.run_dataset.write_frontier(0, [int(self.user_id)])
+        self.profile_store = (
+            ProfileStore(self.run_dataset, writer_id=worker_id)
+            if self.storage == "columnar"
+            else None
+        )
+        self.profile_cache = ProfileCache()
+        self.manifest = RunManifest(self.run_dataset)
+        work_queue = WorkQueue(self.run_dataset, self.depth, lease_seconds)
+        work_queue.seed(int(self.user_id))
+        level_stats: dict[int, LevelStats] = {}
+
+        async def renew_leases() -> None:
+            while True:
+                await asyncio.sleep(lease_seconds / 3)
+                await asyncio.to_thread(work_queue.renew, worker_id)
+
+        async def worker(client: httpx.AsyncClient) -> None:
+            while True:
+                # queue transactions can wait on other workers' transactions,
+                # so they run in threads to keep this worker's fetches going
+                claimed = await asyncio.to_thread(work_queue.claim, worker_id)
+                if not claimed:
+                    counts = await asyncio.to_thread(work_queue.counts)
+                    if counts["pending"] == 0 and counts["leased"] == 0:
+                        return
+                    # users leased by other workers may still add to the queue
+                    await asyncio.sleep(poll_interval)
+                    continue
+                [(user_id, depth)] = claimed
+                stats = level_stats.setdefault(
+                    depth, LevelStats(depth=depth + 1, frontier_size=0)
+                )
+                stats.frontier_size += 1
+                FRONTIER_SIZE.inc(depth=depth + 1)
+                source, user_ids = await self.expand_user(client, user_id, stats)
+                stats.edges += len(user_ids)
+                # awaited before adding, as other workers share the stats
+                new_users = await asyncio.to_thread(
+                    work_queue.complete,
+                    worker_id,
+                    user_id,
+                    depth,
+                    user_ids.tolist(),
+                    status="skipped" if source == "SKIPPED" else "done",
+                )
+                stats.new_users += new_users
+                logger.info(
+                    "Depth %d: %s %d users for user %s (%s)",
+                    depth + 1,
+                    source,
+                    len(user_ids),
+                    user_id,
+                    worker_id,
+                )
+
+        renewer = asyncio.create_task(renew_leases())
+        try:
+            async with record_metrics(
+                self.run_dataset.get_metrics_path(worker_id),
+                self.metrics_interval,
+                self.metrics_port,
+                self.metrics_host,
+            ), http_utils.make_async_client(self.concurrency) as client:
+                await asyncio.gather(*(worker(client) for _ in range(self.concurrency)))
+        finally:
+            renewer.cancel()
+            work_queue.release(worker_id)
+            work_queue.close()
+            self.manifest.close()
+            self.profile_cache.close()
+            if self.profile_store is not None:
+                self.profile_store.close()
+        self.level_stats = [level_stats[depth] for depth in sorted(level_stats)]
+        self.crawled_count = sum(stats.edges for stats in self.level_stats)
+
+    async def crawl_level(
+        self,
+        client: httpx.AsyncClient,
+        frontier: list[int],
+        depth: int,
+        visited: set[int],
+    ) -> list[int]:
+        """Expand all users in a frontier, returning the next frontier.
+
+        Users are expanded in the order given by the crawler's scheduler policy,
+        with up to `concurrency` users fetched at once, all sharing the
+        process-wide credential pool of each edge type. Users not seen before
+        are added to `visited` as they are discovered.
+        """
+        level_stats = LevelStats(depth=depth + 1, frontier_size=len(frontier))
+        next_frontier = []
+        logger.info("Crawler at depth %d", depth + 1)
+        estimate = self._preflight_estimates.pop(depth, None)
+        if estimate is None:
+            estimate = await self.preflight(client, frontier, depth)
+        self.estimates.append(estimate)
+        logger.info(
+            "Depth %d needs about %d pages for %d users (%d sampled, %d skipped), "
+            "taking %.0f seconds. Rest of crawl at most %d pages, %.0f seconds",
+            depth + 1,
+            estimate.pages,
+            estimate.users,
+            estimate.sampled,
+            estimate.skipped,
+            estimate.seconds,
+            estimate.crawl_pages,
+            estimate.crawl_seconds,
+        )
+        for user_id in frontier:
+            self.scheduler.push(user_id)
+        FRONTIER_SIZE.set(len(frontier), depth=depth + 1)
+        expanded = 0
+
+        async def worker() -> None:
+            nonlocal expanded
+            while (user_id := self.scheduler.pop()) is not None:
+                FRONTIER_REMAINING.set(len(self.scheduler), depth=depth + 1)
+                source, user_ids = await self.expand_user(client, user_id, level_stats)
+                expanded += 1
+                logger.info(
+                    "Depth %d: %s %d users for user %s (%d/%d)",
+                    depth + 1,
+                    source,
+                    len(user_ids),
+                    user_id,
+                    expanded,
+                    len(frontier),
+                )
+                level_stats.edges += len(user_ids)
+                for new_user_id in user_ids.tolist():
+                    if new_user_id not in visited:
+                        visited.add(new_user_id)
+                        next_frontier.append(new_user_id)
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        level_stats.new_users = len(next_frontier)
+        self.crawled_count += level_stats.edges
+        self.level_stats.append(level_stats)
+        logger.info("Finished depth %d: %s", depth + 1, level_stats)
+        return next_frontier
+
+    async def preflight(
+        self, client: httpx.AsyncClient, frontier: list[int], depth: int
+    ) -> FrontierEstimate:
+        """Estimate the pages and time needed to expand a frontier, before fetching.
+
+        Follow counts come from profiles in the profile cache, which has every
+        user in pages fetched before. With `probe_counts`, users missing from
+        the cache are looked up in batches of 100 first, which uses the
+        separate, larger rate limit of users lookups. Users that are excluded
+        or already saved aren't counted. With both edge types, each is
+        estimated with its own rate limit and the estimates are combined.
+        """
+        estimates = []
+        for edge in self.edges:
+            user_ids = [
+                user_id
+                for user_id in frontier
+                if user_id not in self.excluded_user_ids
+                and not self.make_user_fetcher(user_id, edge).is_saved()
+            ]
+            counts = self.get_edge_counts(user_ids, edge)
+            missing = [user_id for user_id, count in counts.items() if count is None]
+            if self.probe_counts and missing:
+                logger.info("Looking up %s counts of %d users", edge, len(missing))
+                await hydrate_async(
+                    client, missing, self.profile_cache, concurrency=self.concurrency
+                )
+                counts.update(self.get_edge_counts(missing, edge))
+            estimate = estimate_frontier(
+                depth + 1,
+                counts,
+                DEFAULTS.crawler_max_results,
+                self.max_pages,
+                self.max_edges,
+                self.large_users,
+            )
+            credential_pool = get_credential_pool(edge)
+            estimate.seconds = credential_pool.projected_time(estimate.pages)
+            estimate.crawl_pages = estimate.projected_pages(self.depth - depth - 1)
+            estimate.crawl_seconds = credential_pool.projected_time(
+                estimate.crawl_pages
+            )
+            estimates.append(estimate)
+        return combine_estimates(estimates)
+
+    def get_edge_counts(self, user_ids: list[int], edge: Edge) -> dict[int, int | None]:
+        """Get users' numbers of follows of an edge type from cached profiles."""
+        profiles = self.profile_cache.get_many(user_ids)
+        count_field = f"{edge}_count"
+        return {
+            user_id: profiles.get(user_id, {})
+            .get("public_metrics", {})
+            .get(count_field)
+            for user_id in user_ids
+        }
+
+    def make_user_fetcher(
+        self, user_id: int, edge: Edge, depth: int | None = None
+    ) -> "UserFetcher":
+        return UserFetcher(
+            str(user_id),
+            edge,
+            run_id=self.run_id,
+            storage=self.storage,
+            compression=self.compression,
+            profile_store=self.profile_store,
+            profile_cache=self.profile_cache,
+            baseline=self.baseline,
+            manifest=self.manifest,
+            depth=depth,
+        )
+
+    async def expand_user(
+        self, client: httpx.AsyncClient, user_id: int, level_stats: LevelStats
+    ) -> tuple[str, np.ndarray]:
+        """Load IDs of users connected to a user, fetching them if not yet saved.
+
+        Users in the exclusion file are skipped. With both edge types, the
+        user's following and followers are expanded at the same time, each
+        under its own endpoint's rate limit, and the IDs of both are returned
+        together.
+        """
+        if user_id in self.excluded_user_ids:
+            level_stats.skipped += len(self.edges)
+            USERS_EXPANDED.inc(depth=level_stats.depth, source="SKIPPED")
+            return "SKIPPED", np.empty(0, dtype=np.int64)
+        results = await asyncio.gather(
+            *(
+                self.expand_user_edge(client, user_id, edge, level_stats)
+                for edge in self.edges
+            )
+        )
+        sources = [source for source, _ in results]
+        source = next(
+            (source for source in ["FETCHED", "LOADED"] if source in sources),
+            "SKIPPED",
+        )
+        USERS_EXPANDED.inc(depth=level_stats.depth, source=source)
+        return source, np.concatenate([user_ids for _, user_ids in results])
+
+    async def expand_user_edge(
+        self,
+        client: httpx.AsyncClient,
+        user_id: int,
+        edge: Edge,
+        level_stats: LevelStats,
+    ) -> tuple[str, np.ndarray]:
+        """Load IDs of the users connected to a user by one edge type.
+
+        Users with more follows than `max_edges`, going by their cached
+        profile, are sampled or skipped. The connections found are passed to
+        the scheduler to update the priorities of waiting users.
+        """
+        # level stats are numbered by the depth of the users found
+        user_fetcher = self.make_user_fetcher(
+            user_id, edge, depth=level_stats.depth - 1
+        )
+        if user_fetcher.is_saved():
+            level_stats.loaded += 1
+            source = "LOADED"
+            users = user_fetcher.read_users() if self.scheduler.needs_profiles else None
+            user_ids = user_fetcher.read_user_ids()
+        else:
+            [count] = self.get_edge_counts([user_id], edge).values()
+            fetch, stop_at = plan_fetch(count, self.max_edges, self.large_users)
+            if not fetch:
+                logger.info("Skipping user %s with %d %s", user_id, count, edge)
+                level_stats.skipped += 1
+                return "SKIPPED", np.empty(0, dtype=np.int64)
+            if stop_at is not None:
+                level_stats.sampled += 1
+            users = await user_fetcher.fetch_users_async(
+                client, stop_at=stop_at, max_pages=self.max_pages
             )
-            new_user_ids = [user["id"] for user in users]
-            self.crawled_count += len(new_user_ids)
-            self.crawl(user_ids=new_user_ids, current_depth=new_depth)
+            level_stats.fetched += 1
+            source = "FETCHED"
+            user_ids = np.array([int(user["id"]) for user in users], dtype=np.int64)
+        self.scheduler.record_expansion(user_ids.tolist(), users)
+        return source, user_ids
 
 
 class UserFetcher:
@@ -97,89 +596,318 @@ class UserFetcher:
         edge: Edge,
         run_id: str | None = None,
         output_dir_path: os.PathLike | str | None = None,
+        storage: StorageFormat = DEFAULTS.storage_format,
+        compression: Compression | None = DEFAULTS.storage_compression,
+        profile_store: ProfileStore | None = None,
+        profile_cache: ProfileCache | None = None,
+        baseline: RunSnapshot | None = None,
+        manifest: RunManifest | None = None,
+        depth: int | None = None,
     ):
         self.user_id = user_id
         self.edge = edge
         self.run_dataset = data_utils.RunDataset(run_id, output_dir_path)
-        self.session = self._make_session()
-
-    def _make_session(self):
-        retries = Retry(
-            total=5, backoff_factor=0.1, status_forcelist=[500, 502, 503, 504]
-        )
-        session = requests.Session()
-        session.headers.update(http_utils.create_headers())
-        session.mount("http://", HTTPAdapter(max_retries=retries))
-        return session
+        self.storage = storage
+        # only used by JSON storage, for new user files
+        self.compression = compression
+        # only used by columnar storage. opened on demand if not provided, and
+        # then kept for later fetches and reads
+        self.profile_store = profile_store
+        self._owns_profile_store = False
+        # if provided, every page of users fetched is added to the shared cache
+        self.profile_cache = profile_cache
+        # if provided, only changes since the baseline's follow list are saved,
+        # which needs columnar storage for the profiles
+        self.baseline = baseline
+        # if provided, saved users are looked up in and added to the run's
+        # manifest, at their depth, instead of checking for their files
+        self.manifest = manifest
+        self.depth = depth
 
     @property
     def request_url(self) -> str:
-        return f"https://api.twitter.com/2/users/{self.user_id}/{self.edge}"
+        return f"{config.API_URL}/users/{self.user_id}/{self.edge}"
 
     @property
     def output_path(self) -> Path:
-        file_name = f"{self.user_id}_{self.edge}.json"
-        return self.run_dataset.get_user_path(file_name)
+        """Path of the user's file, with files saved earlier used as they are.
+
+        A JSON user file already saved with another compression, or none, is
+        used in place of a new one, so compression can be changed mid-run, and
+        files saved by older runs outside of shard directories are used where
+        they are. Files saved in another storage format aren't used, so the
+        user is fetched again in this one.
+        """
+        path = self._find_saved_path()
+        if path is None:
+            path = self.run_dataset.get_user_path(
+                self._get_file_name(self._extensions[0])
+            )
+        return path
+
+    @property
+    def _extensions(self) -> list[str]:
+        """Extensions of the user files this fetcher reads, new files' first."""
+        if self.baseline is not None:
+            return [DELTA_EXTENSION]
+        if self.storage == "columnar":
+            return ["edges.npy"]
+        return [get_json_extension(self.compression), *JSON_EXTENSIONS.values()]
+
+    def _find_saved_path(self) -> Path | None:
+        """Path of the user's saved file, from the manifest if provided."""
+        if self.manifest is not None:
+            path = self.manifest.get_path(int(self.user_id), self.edge)
+            if path is not None and path.name in map(
+                self._get_file_name, self._extensions
+            ):
+                return path
+            return None
+        for extension in self._extensions:
+            path = self.run_dataset.find_user_path(self._get_file_name(extension))
+            if path is not None:
+                return path
+        return None
+
+    def _get_file_name(self, extension: str) -> str:
+        return f"{self.user_id}_{self.edge}.{extension}"
+
+    def is_saved(self) -> bool:
+        """Check if the user's file has been saved, from the manifest if provided."""
+        if self.manifest is not None:
+            return self._find_saved_path() is not None
+        return self.output_path.exists()
+
+    @property
+    def partial_path(self) -> Path:
+        return self.output_path.with_name(f"{self.output_path.name}.partial")
+
+    @property
+    def checkpoint_path(self) -> Path:
+        return self.output_path.with_name(f"{self.output_path.name}.checkpoint")
 
     def fetch_users(
         self,
         resume: bool = True,
         stop_at: int | None = None,
         max_results: int = DEFAULTS.crawler_max_results,
-    ) -> dict:
-        if self.output_path.exists() and resume:
+        max_pages: int | None = None,
+    ) -> list[dict]:
+        """Fetch all users connected to this user, blocking until done."""
+
+        async def fetch() -> list[dict]:
+            async with http_utils.make_async_client(max_connections=1) as client:
+                return await self.fetch_users_async(
+                    client,
+                    resume=resume,
+                    stop_at=stop_at,
+                    max_results=max_results,
+                    max_pages=max_pages,
+                )
+
+        if self.storage == "columnar":
+            self._get_profile_store()
+        try:
+            return asyncio.run(fetch())
+        finally:
+            if self._owns_profile_store:
+                # finishes the open part, the store can still be added to
+                self.profile_store.close()
+
+    async def fetch_users_async(
+        self,
+        client: httpx.AsyncClient,
+        resume: bool = True,
+        stop_at: int | None = None,
+        max_results: int = DEFAULTS.crawler_max_results,
+        max_pages: int | None = None,
+    ) -> list[dict]:
+        """Fetch all users connected to this user, writing them to the output path.
+
+        Each page is appended to a partial file as it arrives, and the cursor
+        for the next page is saved to a checkpoint file alongside it. If
+        `resume` is True, an interrupted fetch continues from the checkpoint.
+        The partial file is only moved to the output path once the last page
+        has been written, or `max_pages` pages have been fetched.
+        """
+        if self.is_saved() and resume:
             return self.read_users()
 
-        users = []
-        pagination_token = None
-        max_results = max_results if stop_at is None else min(max_results, stop_at)
-        logger.info("Fetching %s for user %s", self.edge, self.user_id)
-        while True:
-            response = self.get_follows_request(
-                pagination_token=pagination_token, max_results=max_results
+        checkpoint = self.read_checkpoint() if resume else None
+        if checkpoint is None:
+            users = []
+            pagination_token = None
+            checkpoint = {"next_token": None, "pages": 0, "size": 0}
+            logger.info("Fetching %s for user %s", self.edge, self.user_id)
+        else:
+            users = self.read_partial_users(checkpoint["size"])
+            pagination_token = checkpoint["next_token"]
+            logger.info(
+                "Resuming fetch of %s for user %s at page %d",
+                self.edge,
+                self.user_id,
+                checkpoint["pages"] + 1,
             )
-            if "data" not in response:
-                logger.info("Failed to retrieve user %s.", self.user_id)
-                break
-            users.extend(response["data"])
-            pagination_token = response["meta"].get("next_token")
-            if pagination_token is None:
-                break
-            if stop_at is not None and len(users) >= stop_at:
-                break
+
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        max_results = max_results if stop_at is None else min(max_results, stop_at)
+        mode = "r+b" if checkpoint["size"] else "wb"
+        with open(self.partial_path, mode) as partial_file:
+            partial_file.truncate(checkpoint["size"])
+            partial_file.seek(checkpoint["size"])
+            while stop_at is None or len(users) < stop_at:
+                response = await self.get_follows_request(
+                    client, pagination_token=pagination_token, max_results=max_results
+                )
+                if "data" not in response:
+                    logger.info("Failed to retrieve user %s.", self.user_id)
+                    break
+                users.extend(response["data"])
+                PAGES_FETCHED.inc(edge=self.edge)
+                USERS_FETCHED.inc(len(response["data"]), edge=self.edge)
+                self.write_page(partial_file, response["data"])
+                if self.profile_cache is not None:
+                    self.profile_cache.put(response["data"])
+                pagination_token = response["meta"].get("next_token")
+                if pagination_token is None:
+                    break
+                checkpoint["next_token"] = pagination_token
+                checkpoint["pages"] += 1
+                checkpoint["size"] = partial_file.tell()
+                self.write_checkpoint(checkpoint)
+                if max_pages is not None and checkpoint["pages"] >= max_pages:
+                    logger.info(
+                        "Stopping fetch for user %s at %d pages",
+                        self.user_id,
+                        max_pages,
+                    )
+                    break
+        if self.storage == "columnar":
+            self.write_user_ids(np.fromfile(self.partial_path, dtype=np.int64))
+            self.partial_path.unlink()
+        elif self.compression is not None:
+            write_compressed(self.output_path, self.partial_path.read_bytes())
+            self.partial_path.unlink()
+        else:
+            self.partial_path.replace(self.output_path)
+        self.checkpoint_path.unlink(missing_ok=True)
+        self.record_saved(len(users))
         return users
 
-    @limiter.ratelimit("follow-lookup", delay=True)
-    def get_follows_request(
+    def write_page(self, partial_file: BinaryIO, users: list[dict]) -> None:
+        """Append a page of users to the partial file for this fetch.
+
+        With columnar storage only the user IDs go in the partial file, and
+        their profiles are added to the run's profile store.
+        """
+        with WRITE_SECONDS.time(storage=self.storage):
+            if self.storage == "columnar":
+                self._get_profile_store().add(users)
+                user_ids = np.array([int(user["id"]) for user in users], dtype=np.int64)
+                data = user_ids.tobytes()
+            else:
+                data = b"".join(orjson.dumps(user) + b"\n" for user in users)
+            partial_file.write(data)
+            partial_file.flush()
+        BYTES_WRITTEN.inc(len(data), kind="users")
+
+    async def get_follows_request(
         self,
+        client: httpx.AsyncClient,
         pagination_token: str | None = None,
         max_results: int = DEFAULTS.crawler_max_results,
     ) -> dict:
         global api_requests
-        response = self.session.get(
-            self.request_url,
-            params=http_utils.prepare_params(
-                {
-                    "max_results": max_results,
-                    "pagination_token": pagination_token,
-                    "user.fields": USER_FIELDS,
-                }
-            ),
+        params = http_utils.prepare_params(
+            {
+                "max_results": max_results,
+                "pagination_token": pagination_token,
+                "user.fields": USER_FIELDS,
+            }
+        )
+        response, credential = await http_utils.get_with_credentials(
+            client, self.request_url, params, get_credential_pool(self.edge), self.edge
         )
-        response.raise_for_status()
         api_requests += 1
-        logger.info("Request number: %d", api_requests)
+        logger.info("Request number: %d (%s)", api_requests, credential.name)
         return response.json()
 
-    def write_users(self, users: dict, force: bool = False) -> None:
-        if self.output_path.exists() and not force:
+    def write_users(self, users: list[dict], force: bool = False) -> None:
+        if self.is_saved() and not force:
             logger.info("Skipping already retrieved data: %s", self.output_path.name)
             return
         self.output_path.parent.mkdir(parents=True, exist_ok=True)
-        with jsonlines.open(self.output_path, "w") as writer:
-            writer.write_all(users)
+        if self.storage == "columnar":
+            self._get_profile_store().add(users)
+            if self._owns_profile_store:
+                # finishes the open part, the store can still be added to
+                self.profile_store.close()
+            user_ids = np.array([int(user["id"]) for user in users], dtype=np.int64)
+            self.write_user_ids(user_ids)
+        else:
+            write_compressed(
+                self.output_path,
+                b"".join(orjson.dumps(user) + b"\n" for user in users),
+            )
+        self.record_saved(len(users))
+
+    def record_saved(self, edges: int) -> None:
+        """Add the user's saved file to the manifest, if there is one."""
+        if self.manifest is not None:
+            self.manifest.record(
+                int(self.user_id), self.edge, self.output_path, edges, self.depth
+            )
+
+    def write_user_ids(self, user_ids: np.ndarray) -> None:
+        """Write IDs of users for columnar storage, or their changes for a recrawl."""
+        if self.baseline is None:
+            write_edge_file(self.output_path, user_ids)
+            return
+        baseline_user_ids = self.baseline.get_user_ids(int(self.user_id), self.edge)
+        write_delta_file(self.output_path, *diff_edges(baseline_user_ids, user_ids))
 
     def read_users(self) -> list[dict]:
-        with jsonlines.open(self.output_path, "r", loads=orjson.loads) as reader:
-            users = [user for user in reader]
-        return users
+        if self.storage == "columnar":
+            return self._lookup_profiles(self.read_user_ids())
+        lines = read_compressed(self.output_path).splitlines()
+        return [orjson.loads(line) for line in lines]
+
+    def read_user_ids(self) -> np.ndarray:
+        """Read just the IDs of users, which are memory mapped for columnar storage."""
+        if self.baseline is not None:
+            baseline_user_ids = self.baseline.get_user_ids(int(self.user_id), self.edge)
+            return apply_delta(baseline_user_ids, *read_delta_file(self.output_path))
+        if self.storage == "columnar":
+            return read_edge_file(self.output_path)
+        lines = read_compressed(self.output_path).splitlines()
+        return np.fromiter(
+            (int(orjson.loads(line)["id"]) for line in lines), dtype=np.int64
+        )
+
+    def read_partial_users(self, size: int) -> list[dict]:
+        """Read users from pages written to the partial file before `size`."""
+        with open(self.partial_path, "rb") as partial_file:
+            data = partial_file.read(size)
+        if self.storage == "columnar":
+            return self._lookup_profiles(np.frombuffer(data, dtype=np.int64))
+        return [orjson.loads(line) for line in data.splitlines()]
+
+    def _get_profile_store(self) -> ProfileStore:
+        if self.profile_store is None:
+            self.profile_store = ProfileStore(self.run_dataset)
+            self._owns_profile_store = True
+        return self.profile_store
+
+    def _lookup_profiles(self, user_ids: np.ndarray) -> list[dict]:
+        return profiles_to_users(self._get_profile_store().lookup(user_ids))
+
+    def read_checkpoint(self) -> dict | None:
+        """Read the checkpoint of an interrupted fetch, if there is one."""
+        if not (self.checkpoint_path.exists() and self.partial_path.exists()):
+            return None
+        return orjson.loads(self.checkpoint_path.read_bytes())
+
+    def write_checkpoint(self, checkpoint: dict) -> None:
+        tmp_path = self.checkpoint_path.with_suffix(".tmp")
+        tmp_path.write_bytes(orjson.dumps(checkpoint))
+        tmp_path.replace(self.checkpoint_path)
@@ -1,11 +1,56 @@
+import hashlib
 import os
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from datetime import datetime
 from inspect import cleandoc
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import duckdb
+import numpy as np
+import orjson
+import pyarrow as pa
+import pyarrow.dataset as ds
 from duckdb import DuckDBPyConnection
 
 from . import config
+from .compression import JSON_EXTENSIONS, is_json_user_file
+from .types import CrawlEdge, Edge
+
+if TYPE_CHECKING:
+    from .snapshots import RunSnapshot
+
+# number of files loaded together in each transaction of an incremental update
+INGEST_BATCH_SIZE = 10_000
+
+# source user and edge type in the names of JSON user files, compressed or not
+USER_JSON_FILE_REGEX = "'(\\d+)_(\\w+)\\.json(\\.gz|\\.zst)?$'"
+
+# edges go from each crawled user to the users in their follow list, with the
+# type of the list, so the edges of a crawl of both types can be told apart.
+# IDs are int64, like the .npy user files, and are only cast to UBIGINT when
+# they're loaded into DuckDB tables
+EDGES_SCHEMA = pa.schema(
+    [
+        ("source", pa.int64()),
+        ("target", pa.int64()),
+        ("edge_type", pa.dictionary(pa.int8(), pa.string())),
+    ]
+)
+
+
+@dataclass
+class DbUpdate:
+    """What an incremental update of a run's database loaded."""
+
+    files: int = 0
+    # users whose edges were loaded for the first time
+    new_user_ids: list[int] = field(default_factory=list)
+    # user files that replaced the edges loaded from an earlier file
+    replaced: int = 0
+    # whether the tables were made from scratch
+    created: bool = False
 
 
 class RunDataset:
@@ -31,82 +76,895 @@ class RunDataset:
     def crawl_stats_path(self) -> Path:
         return self.dataset_path / "crawl_stats.parquet"
 
+    @property
+    def manifest_path(self) -> Path:
+        return self.dataset_path / "manifest.db"
+
+    @property
+    def recrawl_path(self) -> Path:
+        return self.dataset_path / "recrawl.json"
+
+    def read_recrawl_info(self) -> dict | None:
+        """Get the baseline run of a recrawl and when it started, if this is one."""
+        if not self.recrawl_path.exists():
+            return None
+        return orjson.loads(self.recrawl_path.read_bytes())
+
+    def write_recrawl_info(self, recrawl: dict) -> None:
+        self.dataset_path.mkdir(parents=True, exist_ok=True)
+        self.recrawl_path.write_bytes(orjson.dumps(recrawl))
+
+    def get_created_at(self) -> datetime:
+        """Get when a run was started, for finding the snapshot at a date."""
+        recrawl = self.read_recrawl_info()
+        if recrawl is not None:
+            return datetime.fromisoformat(recrawl["created_at"])
+        # full crawls write their first frontier when they start
+        path = self.get_frontier_path(0)
+        if not path.exists():
+            path = self.dataset_path
+        return datetime.fromtimestamp(path.stat().st_mtime).astimezone()
+
+    def get_metrics_path(self, worker_id: str | None = None) -> Path:
+        """Directory of the metrics log of a crawl, with one per crawl worker."""
+        if worker_id is None:
+            return self.dataset_path / "metrics"
+        return self.dataset_path / f"metrics-{worker_id}"
+
     @property
     def edges_path(self) -> Path:
         return self.dataset_path / "edges.parquet"
 
     @property
-    def users_json_glob(self):
-        return self.users_path / "*.json"
+    def profiles_path(self) -> Path:
+        return self.dataset_path / "profiles"
+
+    @property
+    def queue_path(self) -> Path:
+        return self.dataset_path / "queue.db"
+
+    @property
+    def analysis_path(self) -> Path:
+        return self.dataset_path / "analysis"
+
+    @property
+    def graph_path(self) -> Path:
+        return self.dataset_path / "graph"
+
+    @property
+    def node_metrics_path(self) -> Path:
+        return self.dataset_path / "node_metrics.parquet"
+
+    @property
+    def frontier_path(self) -> Path:
+        return self.dataset_path / "frontier"
+
+    @property
+    def users_json_globs(self) -> list[str]:
+        """Globs of the JSON user files in the run, compressed or not.
+
+        Only globs with files are included, as DuckDB fails on globs without
+        any, apart from plain JSON, which is kept so an empty run fails clearly.
+        """
+        globs = [
+            str(self.users_path / pattern)
+            for extension in JSON_EXTENSIONS.values()
+            for pattern in self._user_file_patterns(f"*.{extension}")
+            if any(self.users_path.glob(pattern))
+        ]
+        return globs or [str(self.users_path / "*.json")]
 
     def get_user_path(self, file_name: str) -> Path:
-        return self.dataset_path / "users" / file_name
+        """Path to save a user file at, in the shard directory of its user."""
+        return self.users_path / get_user_shard(file_name) / file_name
+
+    def find_user_path(self, file_name: str) -> Path | None:
+        """Path of a saved user file, sharded or in the flat layout of older runs."""
+        for path in [self.get_user_path(file_name), self.users_path / file_name]:
+            if path.exists():
+                return path
+        return None
+
+    def glob_user_files(self, pattern: str) -> list[Path]:
+        """Get the sorted user files matching a pattern, in either layout."""
+        return sorted(
+            path
+            for user_pattern in self._user_file_patterns(pattern)
+            for path in self.users_path.glob(user_pattern)
+        )
+
+    def _user_file_patterns(self, pattern: str) -> list[str]:
+        # runs from before user files were sharded keep them all in users/
+        return [pattern, f"*/{pattern}"]
+
+    def get_user_paths(self) -> list[Path]:
+        """Get the paths of all completed user files, in either storage format."""
+        return sorted(
+            [
+                *(
+                    path
+                    for extension in JSON_EXTENSIONS.values()
+                    for path in self.glob_user_files(f"*.{extension}")
+                ),
+                *self.glob_user_files("*.edges.npy"),
+            ]
+        )
+
+    def get_frontier_path(self, depth: int) -> Path:
+        return self.frontier_path / f"depth_{depth}.npy"
+
+    def write_frontier(self, depth: int, user_ids: list[int]) -> None:
+        """Persist the user IDs to be expanded at a crawl depth.
+
+        The file is written to a temporary path and then renamed, so that a
+        frontier file only exists once it is complete.
+        """
+        path = self.get_frontier_path(depth)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.asarray(user_ids, dtype=np.int64))
+        tmp_path.replace(path)
+
+    def read_frontier(self, depth: int) -> np.ndarray:
+        return np.load(self.get_frontier_path(depth))
+
+    def last_frontier_depth(self) -> int | None:
+        """Return the deepest persisted frontier, or None if there are none."""
+        depth = 0
+        while self.get_frontier_path(depth).exists():
+            depth += 1
+        return depth - 1 if depth > 0 else None
 
-    def make_duckdb_conn(self) -> DuckDBPyConnection:
+    def make_duckdb_conn(
+        self,
+        threads: int | None = None,
+        memory_limit: str | None = None,
+        read_only: bool = False,
+    ) -> DuckDBPyConnection:
+        """Connect to the run's database.
+
+        `memory_limit` is a DuckDB size such as "8GB". Queries that need more
+        memory than the limit spill to a temporary directory next to the
+        database rather than failing.
+        """
+        duckdb_config = {"preserve_insertion_order": "false"}
+        if threads is not None:
+            duckdb_config["threads"] = threads
+        if memory_limit is not None:
+            duckdb_config["memory_limit"] = memory_limit
         return duckdb.connect(
-            str(self.db_path),
-            config={"preserve_insertion_order": "false"}
+            str(self.db_path), read_only=read_only, config=duckdb_config
         )
 
-    def make_db(self, table_name: str) -> None:
-        create_table_sql = create_duckdb_table_sql(table_name, self.users_json_glob)
-        conn = self.make_duckdb_conn()
-        print("Creating table...")
-        conn.sql(create_table_sql)
-        print("Finished creating table.")
+    def get_seed_user_id(self) -> int | None:
+        """Get the user a crawl started at, from its first frontier or the config."""
+        if self.get_frontier_path(0).exists():
+            return int(self.read_frontier(0)[0])
+        if config.SEED_USER_ID is not None:
+            return int(config.SEED_USER_ID)
+        return None
+
+    def make_db(
+        self,
+        table_name: str,
+        threads: int | None = None,
+        incremental: bool = False,
+        edges: bool = True,
+        seed_user_id: int | None = None,
+    ) -> None:
+        """Load all crawled users into a table, reading files in parallel.
+
+        DuckDB splits the files matched by the users glob across `threads`
+        threads, which defaults to the number of cores. If `incremental` is
+        True, only files not already loaded into the table are read, and crawl
+        depths are only updated from the users added. See `update_db`.
+
+        If `edges` is True, an edges table with the source and target of every
+        edge, and a crawl_depth table with the depth each user was found at
+        from the seed user, are also made. For a crawl of both edge types, a
+        follows table of the deduplicated follows is made too. See
+        `create_follows_table`.
+        """
+        conn = self.make_duckdb_conn(threads=threads)
+        snapshot = self.get_recrawl_snapshot()
+        update = None
+        if incremental:
+            print("Updating table...")
+            update = self.update_db(conn, table_name, edges=edges, snapshot=snapshot)
+            print(
+                f"Finished updating table with {update.files} new files, "
+                f"{update.replaced} replacing earlier files."
+            )
+        else:
+            profile_paths = sorted(self.profiles_path.glob("part-*.arrow"))
+            if profile_paths:
+                # a run saved in columnar storage has its profiles in Arrow files
+                conn.register("profiles", ds.dataset(profile_paths, format="ipc"))
+                create_table_sql = create_duckdb_profiles_table_sql(table_name)
+            else:
+                create_table_sql = create_duckdb_table_sql(
+                    table_name, self.users_json_globs
+                )
+            print("Creating table...")
+            conn.sql(create_table_sql)
+            if edges:
+                print("Creating edges table...")
+                self.create_edges_table(conn, snapshot)
+            # the rebuilt table has no primary key to upsert into, so a following
+            # incremental update needs to start again from scratch
+            conn.sql(f"DROP TABLE IF EXISTS {get_manifest_table_name(table_name)}")
+            conn.sql(
+                f"DROP TABLE IF EXISTS {get_profiles_manifest_table_name(table_name)}"
+            )
+            print("Finished creating table.")
+        if edges:
+            edge_types = conn.sql("SELECT DISTINCT edge_type FROM edges").fetchall()
+            if len(edge_types) > 1:
+                print("Creating follows table...")
+                create_follows_table(conn)
+            seed_user_id = seed_user_id or self.get_seed_user_id()
+            if seed_user_id is None:
+                print("No seed user ID found, skipping crawl depth table.")
+            elif (
+                update is not None
+                and not update.created
+                and update.replaced == 0
+                and has_crawl_depths(conn, seed_user_id)
+            ):
+                print("Updating crawl depth table...")
+                update_crawl_depth_table(conn, update.new_user_ids)
+            else:
+                print("Creating crawl depth table...")
+                create_crawl_depth_table(conn, seed_user_id)
         conn.close()
         print("Closed connection.")
 
+    def get_recrawl_snapshot(self) -> "RunSnapshot | None":
+        """Get the snapshot of a recrawl, to rebuild its follow lists, or None."""
+        # imported here, as snapshots imports this module
+        from .snapshots import RunSnapshot
+
+        return RunSnapshot(self) if self.read_recrawl_info() is not None else None
+
+    def create_edges_table(
+        self, conn: DuckDBPyConnection, snapshot: "RunSnapshot | None" = None
+    ) -> None:
+        """Create the edges table from all user files, sorted by source and target.
+
+        The source user and edge type of each edge come from the name of the
+        file it was read from. Sorting lets DuckDB skip row groups when
+        filtering or joining on source, and to a lesser degree target.
+        """
+        edge_selects = []
+        if any(map(is_json_user_file, self.get_user_paths())):
+            edge_selects.append(
+                select_edges_json_sql(sql_string_list(self.users_json_globs))
+            )
+        edge_file_paths = self.glob_user_files("*.edges.npy")
+        read_ids = None
+        if snapshot is not None:
+            edge_file_paths += snapshot.get_delta_paths()
+            read_ids = snapshot.read_user_file
+        if edge_file_paths:
+            conn.register("edge_files", read_edge_files(edge_file_paths, read_ids))
+            edge_selects.append("SELECT * FROM edge_files")
+        conn.sql(create_duckdb_edges_table_sql())
+        if edge_selects:
+            conn.sql(
+                f"""
+                INSERT INTO edges
+                SELECT * FROM ({" UNION ALL ".join(edge_selects)})
+                ORDER BY source, target
+                """
+            )
+
+    def update_db(
+        self,
+        conn: DuckDBPyConnection,
+        table_name: str,
+        edges: bool = True,
+        batch_size: int = INGEST_BATCH_SIZE,
+        snapshot: "RunSnapshot | None" = None,
+    ) -> DbUpdate:
+        """Load users from files not yet ingested into a table.
+
+        Ingested user files are recorded in a manifest table by user and edge
+        type, and new users are upserted into the table by ID, so there's no
+        need to deduplicate all users again. A user file is loaded if its user
+        and edge type haven't been, or if it's at another path than the file
+        they were loaded from, such as after being recompressed, moved into a
+        shard directory or fetched again. The user's edges of that type from
+        the earlier file are then replaced rather than duplicated. Profile
+        parts of columnar runs are recorded by path. The delta files of a
+        recrawl are loaded as the full follow lists rebuilt from them by
+        `snapshot`.
+
+        The first update creates the tables and loads all files. Each batch of
+        files is loaded in its own transaction, together with recording it in
+        the manifest, so an interrupted update can be resumed. New edges are
+        appended to the edges table, which is then sorted again by source and
+        target, as `make_db` leaves it.
+        """
+        manifest_table = get_manifest_table_name(table_name)
+        profiles_manifest_table = get_profiles_manifest_table_name(table_name)
+        update = DbUpdate()
+        existing_tables = {row[0] for row in conn.sql("SHOW TABLES").fetchall()}
+        if manifest_table in existing_tables:
+            columns = conn.sql(f"DESCRIBE {manifest_table}").fetchall()
+            if "user_id" not in {column[0] for column in columns}:
+                print("Reloading all files, as they were ingested by file name.")
+                existing_tables.remove(manifest_table)
+        if manifest_table not in existing_tables:
+            update.created = True
+            conn.sql(create_duckdb_users_table_sql(table_name))
+            conn.sql(create_duckdb_edges_table_sql())
+            conn.sql(
+                f"""
+                CREATE OR REPLACE TABLE {manifest_table} (
+                    user_id UBIGINT,
+                    edge_type VARCHAR,
+                    filename VARCHAR,
+                    ingested_at TIMESTAMPTZ DEFAULT current_timestamp,
+                    PRIMARY KEY (user_id, edge_type)
+                )
+                """
+            )
+            conn.sql(
+                f"""
+                CREATE OR REPLACE TABLE {profiles_manifest_table} (
+                    filename VARCHAR PRIMARY KEY,
+                    ingested_at TIMESTAMPTZ DEFAULT current_timestamp
+                )
+                """
+            )
+        elif edges and "edges" not in existing_tables:
+            conn.sql(create_duckdb_edges_table_sql())
+        ingested = {
+            (user_id, edge_type): filename
+            for user_id, edge_type, filename in conn.sql(
+                f"SELECT user_id, edge_type, filename FROM {manifest_table}"
+            ).fetchall()
+        }
+        ingested_profiles = {
+            row[0]
+            for row in conn.sql(
+                f"SELECT filename FROM {profiles_manifest_table}"
+            ).fetchall()
+        }
+        # profile parts of columnar runs only have users, user files only have
+        # edges, except for JSON user files which have both.
+        new_paths = [
+            path
+            for path in sorted(self.profiles_path.glob("part-*.arrow"))
+            if self._get_relative_path(path) not in ingested_profiles
+        ] + [
+            path
+            for key, path in self._get_latest_user_paths(snapshot).items()
+            if ingested.get(key) != self._get_relative_path(path)
+        ]
+        for i in range(0, len(new_paths), batch_size):
+            batch_paths = new_paths[i : i + batch_size]
+            profile_paths = [
+                str(path) for path in batch_paths if path.suffix == ".arrow"
+            ]
+            user_paths = [path for path in batch_paths if path.suffix != ".arrow"]
+            json_paths = [str(path) for path in user_paths if is_json_user_file(path)]
+            edge_file_paths = [path for path in user_paths if path.suffix == ".npy"]
+            keys = [
+                (get_user_id_from_path(path), get_edge_type_from_path(path))
+                for path in user_paths
+            ]
+            replaced_keys = [key for key in keys if key in ingested]
+            conn.begin()
+            if profile_paths:
+                conn.register("profiles", ds.dataset(profile_paths, format="ipc"))
+                conn.execute(
+                    upsert_users_sql(table_name, select_profiles_sql("profiles"))
+                )
+                conn.unregister("profiles")
+                conn.execute(
+                    f"INSERT INTO {profiles_manifest_table} (filename) "
+                    "SELECT unnest(?)",
+                    [[self._get_relative_path(path) for path in profile_paths]],
+                )
+            if json_paths:
+                conn.execute(
+                    upsert_users_sql(table_name, select_users_json_sql("?")),
+                    [json_paths],
+                )
+            if edges and replaced_keys:
+                conn.register("replaced_users", _keys_table(replaced_keys))
+                conn.execute(
+                    """
+                    DELETE FROM edges USING replaced_users
+                    WHERE edges.source = replaced_users.user_id
+                      AND edges.edge_type = replaced_users.edge_type
+                    """
+                )
+                conn.unregister("replaced_users")
+            if edges and json_paths:
+                conn.execute(
+                    f"INSERT INTO edges {select_edges_json_sql('?')}", [json_paths]
+                )
+            if edges and edge_file_paths:
+                conn.register(
+                    "edge_files",
+                    read_edge_files(
+                        edge_file_paths,
+                        None if snapshot is None else snapshot.read_user_file,
+                    ),
+                )
+                conn.execute("INSERT INTO edges SELECT * FROM edge_files")
+                conn.unregister("edge_files")
+            if user_paths:
+                filenames = [self._get_relative_path(path) for path in user_paths]
+                conn.register("ingested_users", _keys_table(keys, filenames))
+                conn.execute(
+                    f"""
+                    INSERT INTO {manifest_table} (user_id, edge_type, filename)
+                    SELECT user_id, edge_type, filename FROM ingested_users
+                    ON CONFLICT DO UPDATE SET
+                        filename = excluded.filename,
+                        ingested_at = now()
+                    """
+                )
+                conn.unregister("ingested_users")
+            conn.commit()
+            update.files += len(batch_paths)
+            update.replaced += len(replaced_keys)
+            update.new_user_ids.extend(
+                user_id for user_id, edge in keys if (user_id, edge) not in ingested
+            )
+        if edges and update.files:
+            conn.sql(
+                "CREATE OR REPLACE TABLE edges AS FROM edges ORDER BY source, target"
+            )
+        return update
+
+    def _get_relative_path(self, path: Path | str) -> str:
+        return Path(path).relative_to(self.dataset_path).as_posix()
+
+    def _get_latest_user_paths(
+        self, snapshot: "RunSnapshot | None" = None
+    ) -> dict[tuple[int, str], Path]:
+        """Get the completed user file of each user and edge type.
+
+        If a user was saved in more than one file, such as before and after
+        the run's storage format was changed, the latest file is used. The
+        delta files of a recrawl are included if its `snapshot` is given.
+        """
+        paths = self.get_user_paths()
+        if snapshot is not None:
+            paths += snapshot.get_delta_paths()
+        user_paths = {}
+        for path in paths:
+            key = (get_user_id_from_path(path), get_edge_type_from_path(path))
+            earlier_path = user_paths.get(key)
+            if (
+                earlier_path is None
+                or earlier_path.stat().st_mtime <= path.stat().st_mtime
+            ):
+                user_paths[key] = path
+        return user_paths
+
+
+def get_manifest_table_name(table_name: str) -> str:
+    return f"{table_name}_ingested_files"
+
+
+def get_profiles_manifest_table_name(table_name: str) -> str:
+    return f"{table_name}_ingested_profiles"
+
+
+def _keys_table(
+    keys: list[tuple[int, str]], filenames: list[str] | None = None
+) -> pa.Table:
+    """A table of users and edge types, and their files if given, for DuckDB."""
+    user_ids, edge_types = zip(*keys)
+    columns = {
+        "user_id": pa.array(user_ids, type=pa.uint64()),
+        "edge_type": pa.array(edge_types, type=pa.string()),
+    }
+    if filenames is not None:
+        columns["filename"] = pa.array(filenames, type=pa.string())
+    return pa.table(columns)
+
+
+def get_user_shard(file_name: str) -> str:
+    """Name of the directory a user's files are sharded into.
+
+    Files are spread over 256 directories by a hash of the user ID, so no one
+    directory holds more than a small fraction of a large run's files, and
+    the followers and following files of a user are kept together.
+    """
+    user_id = file_name.split("_")[0]
+    return hashlib.blake2b(user_id.encode(), digest_size=1).hexdigest()
+
 
 def get_user_id_from_path(user_path: os.PathLike) -> int:
     return int(Path(user_path).name.split("_")[0])
 
 
-def create_duckdb_table_sql(table_name: str, users_json_glob: Path | str) -> str:
+def get_crawl_edges(edge: CrawlEdge) -> list[Edge]:
+    """The edge types fetched for each user by a crawl of `edge`."""
+    return list(Edge.__args__) if edge == "both" else [edge]
+
+
+def get_edge_type_from_path(user_path: os.PathLike) -> str:
+    return Path(user_path).name.split("_")[1].split(".")[0]
+
+
+def read_user_id_file(path: os.PathLike) -> list[int]:
+    """Read user IDs from a .npy file, or a text file with one ID per line.
+
+    In text files, anything after a # on a line is a comment.
+    """
+    path = Path(path)
+    if path.suffix == ".npy":
+        return np.load(path).tolist()
+    user_ids = []
+    for line in path.read_text().splitlines():
+        line = line.split("#", 1)[0].strip()
+        if line:
+            user_ids.append(int(line))
+    return user_ids
+
+
+def read_edge_files(
+    edge_file_paths: list[Path],
+    read_ids: Callable[[Path], np.ndarray] | None = None,
+) -> pa.RecordBatchReader:
+    """Stream the edges in columnar user files, one record batch per file.
+
+    Files are memory mapped, unless they are read with `read_ids`, such as
+    `RunSnapshot.read_user_file` for the delta files of a recrawl.
+    """
+
+    def batches():
+        for path in edge_file_paths:
+            if read_ids is None:
+                targets = np.load(path, mmap_mode="r")
+            else:
+                targets = read_ids(path)
+            source = get_user_id_from_path(path)
+            edge_type = get_edge_type_from_path(path)
+            yield pa.record_batch(
+                [
+                    pa.array(np.full(len(targets), source, dtype=np.int64)),
+                    pa.array(np.asarray(targets, dtype=np.int64)),
+                    pa.DictionaryArray.from_arrays(
+                        np.zeros(len(targets), dtype=np.int8), [edge_type]
+                    ),
+                ],
+                schema=EDGES_SCHEMA,
+            )
+
+    return pa.RecordBatchReader.from_batches(EDGES_SCHEMA, batches())
+
+
+def create_crawl_depth_table(conn: DuckDBPyConnection, seed_user_id: int) -> None:
+    """Create a table of the fewest edges from the seed user to each user.
+
+    The graph is walked breadth first, one depth per query, until no new
+    users are found. Users with `crawled` set had their own edges crawled.
+    """
+    conn.sql("CREATE OR REPLACE TEMP TABLE depths (user_id UBIGINT, depth INTEGER)")
+    conn.execute("INSERT INTO depths VALUES (?, 0)", [seed_user_id])
+    depth = 0
+    while True:
+        conn.execute(
+            """
+            INSERT INTO depths
+            SELECT DISTINCT edges.target, $depth + 1
+            FROM edges JOIN depths ON edges.source = depths.user_id
+            WHERE depths.depth = $depth
+              AND edges.target NOT IN (SELECT user_id FROM depths)
+            """,
+            {"depth": depth},
+        )
+        if conn.fetchone()[0] == 0:
+            break
+        depth += 1
+    conn.sql(
+        """
+        CREATE OR REPLACE TABLE crawl_depth AS
+        SELECT depths.user_id,
+               depths.depth,
+               sources.source IS NOT NULL AS crawled
+        FROM depths
+        LEFT JOIN (SELECT DISTINCT source FROM edges) AS sources
+            ON depths.user_id = sources.source
+        ORDER BY depths.depth, depths.user_id
+        """
+    )
+    conn.sql("DROP TABLE depths")
+
+
+def has_crawl_depths(conn: DuckDBPyConnection, seed_user_id: int) -> bool:
+    """Check if there's a crawl_depth table made from the seed user."""
+    tables = conn.execute(
+        "SELECT count(*) FROM duckdb_tables() WHERE table_name = 'crawl_depth'"
+    )
+    if tables.fetchone()[0] == 0:
+        return False
+    seeds = conn.execute("SELECT user_id FROM crawl_depth WHERE depth = 0")
+    return seeds.fetchall() == [(seed_user_id,)]
+
+
+def update_crawl_depth_table(conn: DuckDBPyConnection, new_user_ids: list[int]) -> None:
+    """Update crawl depths after the edges of new users were added.
+
+    New edges can only bring users closer to the seed user, so depths are
+    lowered starting from the new users already in the table, and then from
+    each user whose depth changed, until no more change. Only the edges of
+    the users reached are read, rather than walking the whole graph again.
+    This doesn't hold if edges were removed, so then the table needs to be
+    made again with `create_crawl_depth_table`.
+    """
+    conn.execute(
+        """
+        UPDATE crawl_depth SET crawled = true
+        WHERE user_id IN (
+            SELECT source FROM edges WHERE source IN (SELECT unnest(?))
+        )
+        """,
+        [new_user_ids],
+    )
+    conn.execute(
+        """
+        CREATE OR REPLACE TEMP TABLE changed AS
+        SELECT user_id, depth FROM crawl_depth WHERE user_id IN (SELECT unnest(?))
+        """,
+        [new_user_ids],
+    )
+    while conn.sql("SELECT count(*) FROM changed").fetchone()[0]:
+        conn.sql(
+            """
+            CREATE OR REPLACE TEMP TABLE changed AS
+            SELECT reached.user_id, reached.depth
+            FROM (
+                SELECT edges.target AS user_id, min(changed.depth) + 1 AS depth
+                FROM edges JOIN changed ON edges.source = changed.user_id
+                GROUP BY edges.target
+            ) AS reached
+            LEFT JOIN crawl_depth ON reached.user_id = crawl_depth.user_id
+            WHERE crawl_depth.depth IS NULL OR reached.depth < crawl_depth.depth
+            """
+        )
+        conn.sql(
+            "DELETE FROM crawl_depth WHERE user_id IN (SELECT user_id FROM changed)"
+        )
+        conn.sql(
+            """
+            INSERT INTO crawl_depth
+            SELECT user_id,
+                   depth,
+                   user_id IN (SELECT DISTINCT source FROM edges) AS crawled
+            FROM changed
+            """
+        )
+    conn.sql("DROP TABLE changed")
+
+
+def create_follows_table(conn: DuckDBPyConnection) -> None:
+    """Create a table of each follow in the edges table, with source following target.
+
+    In a crawl of both edge types, the same follow can be in the follower's
+    following list and the followed user's followers list, so edges from
+    followers lists are turned around and duplicates are dropped. `direction`
+    is the type of list a follow was found in, or "both" if it was in both.
+    """
+    conn.sql(
+        """
+        CREATE OR REPLACE TABLE follows AS
+        SELECT source,
+               target,
+               CASE WHEN count(DISTINCT edge_type) > 1 THEN 'both'
+                    ELSE any_value(edge_type)
+               END AS direction
+        FROM (
+            SELECT CASE WHEN edge_type = 'followers' THEN target ELSE source END
+                       AS source,
+                   CASE WHEN edge_type = 'followers' THEN source ELSE target END
+                       AS target,
+                   edge_type
+            FROM edges
+        )
+        GROUP BY source, target
+        ORDER BY source, target
+        """
+    )
+
+
+def sql_string(value: str) -> str:
+    """A SQL string literal, such as a file path."""
+    return "'" + value.replace("'", "''") + "'"
+
+
+def sql_string_list(values: list[str]) -> str:
+    """A SQL list literal of strings, such as file globs."""
+    return f"[{', '.join(map(sql_string, values))}]"
+
+
+def create_duckdb_table_sql(table_name: str, users_json_globs: list[str]) -> str:
+    select_users_sql = select_users_json_sql(sql_string_list(users_json_globs))
     return cleandoc(
         f"""
         CREATE OR REPLACE TABLE {table_name} AS
         SELECT * FROM (
-            SELECT row_number() OVER (PARTITION BY id) AS seqnum,
-                   id,
-                   username,
-                   name,
-                   created_at,
-                   date_diff('day', created_at::DATE, current_date) AS account_age,
-                   public_metrics.following_count AS following_count,
-                   public_metrics.followers_count AS followers_count,
-                   public_metrics.tweet_count AS tweet_count,
-                   public_metrics.listed_count AS listed_count,
-                   verified,
-                   protected,
-                   location,
-                   list_distinct(
-                       [url.expanded_url for url in entities.url.urls] +
-                       [url.expanded_url for url in entities.description.urls]
-                   ) AS urls,
-            FROM read_ndjson(
-                '{users_json_glob}',
-                columns={{
-                    id: UBIGINT,
-                    name: VARCHAR,
-                    username: VARCHAR,
-                    created_at: TIMESTAMPTZ,
-                    verified: BOOLEAN,
-                    protected: BOOLEAN,
-                    location: VARCHAR,
-                    entities: 'STRUCT(
-                        url STRUCT(urls STRUCT(expanded_url VARCHAR)[]),
-                        description STRUCT(urls STRUCT(expanded_url VARCHAR)[])
-                    )',
-                    public_metrics: 'STRUCT(
-                        following_count INTEGER,
-                        followers_count INTEGER,
-                        tweet_count INTEGER,
-                        listed_count INTEGER
-                    )'
-                }}
-            )
+            SELECT row_number() OVER (PARTITION BY id) AS seqnum, *
+            FROM ({select_users_sql})
         )
         WHERE seqnum = 1
         """
     )
+
+
+def create_duckdb_profiles_table_sql(table_name: str) -> str:
+    return cleandoc(
+        f"""
+        CREATE OR REPLACE TABLE {table_name} AS
+        {select_profiles_sql("profiles")}
+        """
+    )
+
+
+def create_duckdb_users_table_sql(table_name: str) -> str:
+    """Create an empty users table keyed by ID, for ingesting into incrementally."""
+    return cleandoc(
+        f"""
+        CREATE OR REPLACE TABLE {table_name} (
+            id UBIGINT PRIMARY KEY,
+            username VARCHAR,
+            name VARCHAR,
+            created_at TIMESTAMPTZ,
+            account_age BIGINT,
+            following_count INTEGER,
+            followers_count INTEGER,
+            tweet_count INTEGER,
+            listed_count INTEGER,
+            verified BOOLEAN,
+            protected BOOLEAN,
+            location VARCHAR,
+            urls VARCHAR[]
+        )
+        """
+    )
+
+
+def upsert_users_sql(table_name: str, select_users_sql: str) -> str:
+    """Insert users into a table, updating users that are already in it.
+
+    DuckDB can't update list columns on conflict, so `urls` keeps the value
+    from when a user was first inserted.
+    """
+    updated_columns = [
+        "username",
+        "name",
+        "created_at",
+        "account_age",
+        "following_count",
+        "followers_count",
+        "tweet_count",
+        "listed_count",
+        "verified",
+        "protected",
+        "location",
+    ]
+    return cleandoc(
+        f"""
+        INSERT INTO {table_name}
+        SELECT * FROM ({select_users_sql})
+        QUALIFY row_number() OVER (PARTITION BY id) = 1
+        ON CONFLICT DO UPDATE SET
+            {", ".join(f"{column} = excluded.{column}" for column in updated_columns)}
+        """
+    )
+
+
+def create_duckdb_edges_table_sql() -> str:
+    return cleandoc(
+        """
+        CREATE OR REPLACE TABLE edges (
+            source UBIGINT,
+            target UBIGINT,
+            edge_type VARCHAR
+        )
+        """
+    )
+
+
+def select_edges_json_sql(users_json: str) -> str:
+    """Select the edges in crawled JSON files, using their file names as sources.
+
+    `users_json` is a SQL expression for the files to read, as for
+    `select_users_json_sql`.
+    """
+    return f"""
+        SELECT regexp_extract(filename, {USER_JSON_FILE_REGEX}, 1)::UBIGINT AS source,
+               id AS target,
+               regexp_extract(filename, {USER_JSON_FILE_REGEX}, 2) AS edge_type
+        FROM read_ndjson({users_json}, columns={{id: UBIGINT}}, filename=true)
+    """
+
+
+def select_users_json_sql(users_json: str) -> str:
+    """Select cleaned user columns from crawled JSON files.
+
+    `users_json` is a SQL expression for the files to read, such as a list of
+    globs or a parameter placeholder for a list of paths. DuckDB decompresses
+    gzip and zstd files by their extensions.
+    """
+    return f"""
+        SELECT id,
+               username,
+               name,
+               created_at,
+               date_diff('day', created_at::DATE, current_date) AS account_age,
+               public_metrics.following_count AS following_count,
+               public_metrics.followers_count AS followers_count,
+               public_metrics.tweet_count AS tweet_count,
+               public_metrics.listed_count AS listed_count,
+               verified,
+               protected,
+               location,
+               list_distinct(
+                   [url.expanded_url for url in entities.url.urls] +
+                   [url.expanded_url for url in entities.description.urls]
+               ) AS urls,
+        FROM read_ndjson(
+            {users_json},
+            columns={{
+                id: UBIGINT,
+                name: VARCHAR,
+                username: VARCHAR,
+                created_at: TIMESTAMPTZ,
+                verified: BOOLEAN,
+                protected: BOOLEAN,
+                location: VARCHAR,
+                entities: 'STRUCT(
+                    url STRUCT(urls STRUCT(expanded_url VARCHAR)[]),
+                    description STRUCT(urls STRUCT(expanded_url VARCHAR)[])
+                )',
+                public_metrics: 'STRUCT(
+                    following_count INTEGER,
+                    followers_count INTEGER,
+                    tweet_count INTEGER,
+                    listed_count INTEGER
+                )'
+            }}
+        )
+    """
+
+
+def select_profiles_sql(profiles: str) -> str:
+    """Select cleaned user columns from a relation of columnar profiles."""
+    return f"""
+        SELECT DISTINCT ON (id)
+               id::UBIGINT AS id,
+               username,
+               name,
+               created_at,
+               date_diff('day', created_at::DATE, current_date) AS account_age,
+               following_count::INTEGER AS following_count,
+               followers_count::INTEGER AS followers_count,
+               tweet_count::INTEGER AS tweet_count,
+               listed_count::INTEGER AS listed_count,
+               verified,
+               protected,
+               location,
+               list_distinct(
+                   coalesce(
+                       json_extract_string(entities, '$.url.urls[*].expanded_url'),
+                       []
+                   ) ||
+                   coalesce(
+                       json_extract_string(
+                           entities, '$.description.urls[*].expanded_url'
+                       ),
+                       []
+                   )
+               ) AS urls,
+        FROM {profiles}
+    """
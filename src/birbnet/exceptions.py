@@ -3,4 +3,6 @@ class BaseBirbnetException(Exception):
 
 
 class MisconfiguredException(BaseBirbnetException):
-    pass
+    def __init__(self, msg: str) -> None:
+        super().__init__(msg)
+        self.msg = msg
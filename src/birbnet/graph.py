@@ -0,0 +1,391 @@
+import logging
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from .data_utils import RunDataset
+from .stats import SortedIdSet
+
+logger = logging.getLogger(__package__)
+
+GRAPH_ARRAYS = ["ids", "indptr", "indices", "in_indptr", "in_indices"]
+
+
+class Graph:
+    """A directed graph of users in compressed sparse row (CSR) form.
+
+    Users are numbered 0 to n - 1 in order of their user IDs, which are kept
+    in `ids`. The targets of the edges out of node i are
+    `indices[indptr[i]:indptr[i + 1]]`, and `in_indptr` and `in_indices` do
+    the same for the sources of edges into each node. Arrays are saved as
+    .npy files, and memory mapped when loaded, so a saved graph can be
+    analysed without reading it all into memory first.
+
+    Graphs of runs have an edge from each user to each user they follow,
+    whichever follow lists were crawled.
+    """
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        in_indptr: np.ndarray,
+        in_indices: np.ndarray,
+    ) -> None:
+        self.ids = ids
+        self.indptr = indptr
+        self.indices = indices
+        self.in_indptr = in_indptr
+        self.in_indices = in_indices
+
+    @classmethod
+    def from_run(cls, run_dataset: RunDataset, rebuild: bool = False) -> "Graph":
+        """Load the graph of a run, building it from its edges file if needed.
+
+        The graph is rebuilt if the edges file has changed since it was built.
+        """
+        graph_path = run_dataset.graph_path
+        edges_path = run_dataset.edges_path
+        indptr_path = graph_path / "indptr.npy"
+        if (
+            not rebuild
+            and indptr_path.exists()
+            and indptr_path.stat().st_mtime >= edges_path.stat().st_mtime
+        ):
+            return cls.load(graph_path)
+        return cls.from_edges_parquet(edges_path, graph_path)
+
+    @classmethod
+    def load(cls, graph_path: Path, mmap: bool = True) -> "Graph":
+        mmap_mode = "r" if mmap else None
+        arrays = {
+            name: np.load(graph_path / f"{name}.npy", mmap_mode=mmap_mode)
+            for name in GRAPH_ARRAYS
+        }
+        return cls(**arrays)
+
+    @classmethod
+    def from_edges_parquet(cls, edges_path: Path, graph_path: Path) -> "Graph":
+        """Build a graph from a Parquet file of source and target user IDs.
+
+        The edges are read one row group at a time and the CSR arrays are
+        filled in on disk, so only the node arrays need to fit in memory.
+        Edges from followers lists are turned around, like in
+        `create_follows_table`, and if both lists were crawled, follows found
+        in both are only kept once.
+        """
+        graph_path.mkdir(parents=True, exist_ok=True)
+        edges_file = pq.ParquetFile(edges_path)
+        logger.info("Building graph from %s", edges_path)
+        edge_types = _read_edge_types(edges_file)
+
+        node_ids = SortedIdSet()
+        for sources, targets in _iter_edges(edges_file):
+            node_ids.add(sources)
+            node_ids.add(targets)
+        ids = np.sort(np.concatenate(node_ids.runs or [np.empty(0, np.int64)]))
+        np.save(graph_path / "ids.npy", ids)
+
+        out_degree = np.zeros(len(ids), dtype=np.int64)
+        in_degree = np.zeros(len(ids), dtype=np.int64)
+        for sources, targets in _iter_edges(edges_file):
+            out_degree += np.bincount(np.searchsorted(ids, sources), minlength=len(ids))
+            in_degree += np.bincount(np.searchsorted(ids, targets), minlength=len(ids))
+
+        index_dtype = np.int32 if len(ids) < np.iinfo(np.int32).max else np.int64
+        indptrs, csr_arrays = {}, {}
+        for name, degree in [("", out_degree), ("in_", in_degree)]:
+            indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+            np.cumsum(degree, out=indptr[1:])
+            indices = np.lib.format.open_memmap(
+                graph_path / f"{name}indices.npy",
+                mode="w+",
+                dtype=index_dtype,
+                shape=(int(indptr[-1]),),
+            )
+            indptrs[name] = indptr
+            csr_arrays[name] = (indptr[:-1].copy(), indices)
+
+        for sources, targets in _iter_edges(edges_file):
+            source_nodes = np.searchsorted(ids, sources)
+            target_nodes = np.searchsorted(ids, targets)
+            _fill_csr(*csr_arrays[""], source_nodes, target_nodes)
+            _fill_csr(*csr_arrays["in_"], target_nodes, source_nodes)
+        for name, (_, indices) in csr_arrays.items():
+            indices.flush()
+            if len(edge_types) > 1:
+                indptrs[name] = _drop_duplicate_edges(
+                    indptrs[name], indices, graph_path / f"{name}indices.npy"
+                )
+        del csr_arrays
+        # indptr.npy is written last, so a partly built graph is never loaded
+        np.save(graph_path / "in_indptr.npy", indptrs["in_"])
+        np.save(graph_path / "indptr.npy", indptrs[""])
+        return cls.load(graph_path)
+
+    @classmethod
+    def from_edges(cls, sources: np.ndarray, targets: np.ndarray) -> "Graph":
+        """Build a graph in memory from arrays of source and target user IDs."""
+        ids = np.unique(np.concatenate([sources, targets]).astype(np.int64))
+        source_nodes = np.searchsorted(ids, sources)
+        target_nodes = np.searchsorted(ids, targets)
+        index_dtype = np.int32 if len(ids) < np.iinfo(np.int32).max else np.int64
+        arrays = {"ids": ids}
+        for name, rows, columns in [
+            ("", source_nodes, target_nodes),
+            ("in_", target_nodes, source_nodes),
+        ]:
+            indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(rows, minlength=len(ids)), out=indptr[1:])
+            indices = np.empty(len(rows), dtype=index_dtype)
+            _fill_csr(indptr[:-1].copy(), indices, rows, columns)
+            arrays[f"{name}indptr"] = indptr
+            arrays[f"{name}indices"] = indices
+        return cls(**arrays)
+
+    def save(self, graph_path: Path) -> None:
+        graph_path.mkdir(parents=True, exist_ok=True)
+        for name in GRAPH_ARRAYS:
+            np.save(graph_path / f"{name}.npy", getattr(self, name))
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.ids)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.indices)
+
+    def node_index(self, user_ids: np.ndarray | list[int]) -> np.ndarray:
+        """Get the nodes for user IDs, with -1 for users not in the graph."""
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.ids, user_ids), self.num_nodes - 1)
+        return np.where(self.ids[positions] == user_ids, positions, -1)
+
+    def successors(self, node: int) -> np.ndarray:
+        return self.indices[self.indptr[node] : self.indptr[node + 1]]
+
+    def predecessors(self, node: int) -> np.ndarray:
+        return self.in_indices[self.in_indptr[node] : self.in_indptr[node + 1]]
+
+    def edges_of(
+        self, nodes: np.ndarray, reverse: bool = False
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Get the edges out of several nodes, as arrays of nodes and successors.
+
+        With `reverse`, edges into the nodes are followed back to their
+        predecessors instead.
+        """
+        if reverse:
+            indptr, indices = self.in_indptr, self.in_indices
+        else:
+            indptr, indices = self.indptr, self.indices
+        nodes = np.asarray(nodes, dtype=np.int64)
+        sources = np.repeat(nodes, indptr[nodes + 1] - indptr[nodes])
+        return sources, _gather(indptr, indices, nodes)
+
+    def out_degree(self) -> np.ndarray:
+        return np.diff(self.indptr)
+
+    def in_degree(self) -> np.ndarray:
+        return np.diff(self.in_indptr)
+
+    def edge_sources(self) -> np.ndarray:
+        """The source node of every edge, aligned with `indices`."""
+        return np.repeat(np.arange(self.num_nodes), self.out_degree())
+
+    def pagerank(
+        self, damping: float = 0.85, tol: float = 1e-6, max_iter: int = 100
+    ) -> np.ndarray:
+        """Calculate PageRank by power iteration.
+
+        Rank from nodes without out edges is spread evenly over all nodes.
+        Iteration stops once the L1 change in ranks falls below `tol`.
+        """
+        num_nodes = self.num_nodes
+        out_degree = self.out_degree()
+        dangling = out_degree == 0
+        sources = self.edge_sources()
+        ranks = np.full(num_nodes, 1 / num_nodes)
+        for iteration in range(max_iter):
+            shares = np.divide(
+                ranks, out_degree, where=~dangling, out=np.zeros_like(ranks)
+            )
+            new_ranks = np.bincount(
+                self.indices, weights=shares[sources], minlength=num_nodes
+            )
+            new_ranks = (
+                damping * (new_ranks + ranks[dangling].sum() / num_nodes)
+                + (1 - damping) / num_nodes
+            )
+            change = np.abs(new_ranks - ranks).sum()
+            ranks = new_ranks
+            if change < tol:
+                break
+        logger.info("PageRank finished after %d iterations", iteration + 1)
+        return ranks
+
+    def core_number(self) -> np.ndarray:
+        """Calculate the k-core number of each node, counting in and out edges.
+
+        Nodes are peeled off in batches: all remaining nodes with degree at
+        most k are removed, repeatedly, before moving on to the next k.
+        """
+        degree = self.out_degree() + self.in_degree()
+        core = np.zeros(self.num_nodes, dtype=np.int64)
+        alive = np.ones(self.num_nodes, dtype=bool)
+        k = 0
+        while alive.any():
+            k = max(k, int(degree[alive].min()))
+            while True:
+                removed = np.flatnonzero(alive & (degree <= k))
+                if len(removed) == 0:
+                    break
+                core[removed] = k
+                alive[removed] = False
+                neighbors = np.concatenate(
+                    [
+                        self.edges_of(removed)[1],
+                        self.edges_of(removed, reverse=True)[1],
+                    ]
+                )
+                neighbors = neighbors[alive[neighbors]]
+                degree -= np.bincount(neighbors, minlength=self.num_nodes)
+        return core
+
+    def connected_components(self) -> np.ndarray:
+        """Label the weakly connected components of the graph.
+
+        Each node is labelled with the smallest node in its component, found
+        by propagating minimum labels along edges in both directions, with
+        pointer jumping to shortcut long paths.
+        """
+        labels = np.arange(self.num_nodes)
+        sources = self.edge_sources()
+        targets = np.asarray(self.indices)
+        while True:
+            new_labels = labels.copy()
+            np.minimum.at(new_labels, targets, labels[sources])
+            np.minimum.at(new_labels, sources, labels[targets])
+            while not np.array_equal(new_labels, new_labels[new_labels]):
+                new_labels = new_labels[new_labels]
+            if np.array_equal(new_labels, labels):
+                return labels
+            labels = new_labels
+
+
+def compute_node_metrics(graph: Graph) -> pa.Table:
+    """Calculate degrees, PageRank, core number and component for every user."""
+    return pa.table(
+        {
+            "user_id": pa.array(graph.ids, type=pa.int64()),
+            "in_degree": graph.in_degree(),
+            "out_degree": graph.out_degree(),
+            "pagerank": graph.pagerank(),
+            "core_number": graph.core_number(),
+            "component": graph.connected_components(),
+        }
+    )
+
+
+def _read_edge_types(edges_file: pq.ParquetFile) -> set[str]:
+    if "edge_type" not in edges_file.schema_arrow.names:
+        return {"following"}
+    edge_types = edges_file.read(columns=["edge_type"]).column("edge_type")
+    return set(pc.unique(edge_types.cast(pa.string())).drop_null().to_pylist())
+
+
+def _iter_edges(edges_file: pq.ParquetFile):
+    """Read edges a row group at a time, as follower and followed user IDs."""
+    columns = ["source", "target"]
+    has_edge_type = "edge_type" in edges_file.schema_arrow.names
+    if has_edge_type:
+        columns.append("edge_type")
+    for i in range(edges_file.num_row_groups):
+        row_group = edges_file.read_row_group(i, columns=columns)
+        sources = row_group.column("source").to_numpy().astype(np.int64)
+        targets = row_group.column("target").to_numpy().astype(np.int64)
+        if has_edge_type:
+            edge_types = row_group.column("edge_type").cast(pa.string())
+            followers = pc.fill_null(pc.equal(edge_types, "followers"), False)
+            followers = followers.to_numpy()
+            sources, targets = (
+                np.where(followers, targets, sources),
+                np.where(followers, sources, targets),
+            )
+        yield sources, targets
+
+
+def _drop_duplicate_edges(
+    indptr: np.ndarray,
+    indices: np.ndarray,
+    indices_path: Path,
+    chunk_edges: int = 1 << 24,
+) -> np.ndarray:
+    """Sort the columns of each row and drop repeated ones, returning the new indptr.
+
+    Rows are compacted in place a chunk of about `chunk_edges` edges at a
+    time, then the kept edges are copied to a new indices file, which
+    replaces the one at `indices_path`.
+    """
+    num_rows = len(indptr) - 1
+    new_indptr = np.zeros_like(indptr)
+    position = 0
+    start = 0
+    while start < num_rows:
+        end = np.searchsorted(indptr, indptr[start] + chunk_edges, side="right") - 1
+        end = min(max(end, start + 1), num_rows)
+        # copied, as the kept edges are written back over the same slots
+        columns = np.array(indices[indptr[start] : indptr[end]], dtype=np.int64)
+        rows = np.repeat(np.arange(start, end), np.diff(indptr[start : end + 1]))
+        order = np.lexsort((columns, rows))
+        rows, columns = rows[order], columns[order]
+        keep = np.ones(len(rows), dtype=bool)
+        keep[1:] = (rows[1:] != rows[:-1]) | (columns[1:] != columns[:-1])
+        rows, columns = rows[keep], columns[keep]
+        indices[position : position + len(columns)] = columns
+        counts = np.bincount(rows - start, minlength=end - start)
+        new_indptr[start + 1 : end + 1] = position + np.cumsum(counts)
+        position += len(columns)
+        start = end
+    tmp_path = indices_path.with_name(f"{indices_path.name}.tmp")
+    new_indices = np.lib.format.open_memmap(
+        tmp_path, mode="w+", dtype=indices.dtype, shape=(position,)
+    )
+    for start in range(0, position, chunk_edges):
+        stop = min(start + chunk_edges, position)
+        new_indices[start:stop] = indices[start:stop]
+    new_indices.flush()
+    del new_indices
+    tmp_path.replace(indices_path)
+    return new_indptr
+
+
+def _fill_csr(
+    next_positions: np.ndarray,
+    indices: np.ndarray,
+    rows: np.ndarray,
+    columns: np.ndarray,
+) -> None:
+    """Write a batch of edges into the next free slots of each row."""
+    order = np.argsort(rows, kind="stable")
+    rows, columns = rows[order], columns[order]
+    unique_rows, starts, counts = np.unique(rows, return_index=True, return_counts=True)
+    offsets = np.arange(len(rows)) - np.repeat(starts, counts)
+    indices[next_positions[rows] + offsets] = columns
+    next_positions[unique_rows] += counts
+
+
+def _gather(indptr: np.ndarray, indices: np.ndarray, nodes: np.ndarray) -> np.ndarray:
+    """Concatenate the neighbors of several nodes."""
+    starts = indptr[nodes]
+    counts = indptr[nodes + 1] - starts
+    total = counts.sum()
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.asarray(indices[np.repeat(starts, counts) + offsets], dtype=np.int64)
@@ -1,20 +1,142 @@
+import asyncio
+import importlib.util
+import logging
+import random
+import time
+
+import httpx
+
 from . import config
+from .config import DEFAULTS
 from .exceptions import MisconfiguredException
+from .metrics import REQUEST_SECONDS
+from .rate_limit import Credential, CredentialPool, get_retry_after
+
+logger = logging.getLogger(__package__)
 
+# statuses the API returns for transient errors, which are worth retrying
+RETRY_STATUSES = {500, 502, 503, 504}
 
-def create_headers() -> dict:
+
+def create_headers(token: str | None = None) -> dict:
     """Get HTTP headers required for authenticating to Twitter's API."""
-    if config.BEARER_TOKEN is None:
+    token = token or config.BEARER_TOKEN
+    if token is None:
         raise MisconfiguredException("BEARER_TOKEN environment variable not set.")
-    return {"Authorization": f"Bearer {config.BEARER_TOKEN}"}
+    return {"Authorization": f"Bearer {token}"}
+
+
+def get_bearer_tokens() -> list[str]:
+    """Get all bearer tokens available for making requests."""
+    if config.BEARER_TOKENS:
+        return [token.strip() for token in config.BEARER_TOKENS]
+    if config.BEARER_TOKEN is None:
+        raise MisconfiguredException(
+            "Neither BEARER_TOKEN nor BEARER_TOKENS environment variable set."
+        )
+    return [config.BEARER_TOKEN]
 
 
 def prepare_params(params: dict) -> dict:
     """Convert dictionary into a prepared params dictionary."""
     preppared_params = {}
     for key, value in params.items():
+        if value is None:
+            continue
         if isinstance(value, (list, tuple, set)):
             preppared_params[key] = ",".join(value)
         else:
             preppared_params[key] = value
     return preppared_params
+
+
+def make_async_client(
+    max_connections: int = 10, http2: bool | None = None
+) -> httpx.AsyncClient:
+    """Create an HTTP client with a pool of reusable connections.
+
+    One client is shared by every request made while crawling, so connections
+    are kept alive and reused rather than opened for each user. HTTP/2 is used
+    if `http2` is True, or by default if the h2 package is installed, letting
+    concurrent requests share one connection.
+
+    The client is not authenticated, as the bearer token to use is chosen per
+    request. See `rate_limit.CredentialPool`.
+    """
+    if http2 is None:
+        http2 = importlib.util.find_spec("h2") is not None
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        ),
+        timeout=httpx.Timeout(30.0),
+    )
+
+
+def backoff_delay(
+    attempt: int,
+    base: float = DEFAULTS.http_backoff_base,
+    cap: float = DEFAULTS.http_backoff_max,
+) -> float:
+    """Seconds to wait before retry number `attempt`, counting from 0.
+
+    Uses "full jitter": a random time up to an exponentially growing limit, so
+    requests that failed together don't all retry at once.
+    """
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+async def get_with_credentials(
+    client: httpx.AsyncClient,
+    url: str,
+    params: dict,
+    credential_pool: CredentialPool,
+    endpoint: str,
+    max_retries: int = DEFAULTS.http_max_retries,
+) -> tuple[httpx.Response, Credential]:
+    """Make a GET request with a token from the pool, retrying transient errors.
+
+    Requests rejected by the rate limit are retried once a token has budget
+    again, which takes any Retry-After header into account. Connection errors
+    and 5xx responses are retried up to `max_retries` times with jittered
+    exponential backoff, waiting at least as long as any Retry-After. Returns
+    the response and the token it was made with, raising for error statuses.
+    """
+    attempt = 0
+    while True:
+        credential = await credential_pool.acquire()
+        start_time = time.perf_counter()
+        try:
+            response = await client.get(url, params=params, headers=credential.headers)
+        except httpx.TransportError as error:
+            response, transport_error = None, error
+        status = response.status_code if response is not None else "error"
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - start_time, endpoint=endpoint, status=status
+        )
+        if response is not None:
+            if response.status_code == 429:
+                credential.rate_limited += 1
+                credential.budget.exhaust(response.headers)
+                continue
+            credential.budget.update(response.headers)
+            if response.status_code not in RETRY_STATUSES:
+                response.raise_for_status()
+                return response, credential
+        if attempt >= max_retries:
+            if response is None:
+                raise transport_error
+            response.raise_for_status()
+        delay = backoff_delay(attempt)
+        if response is not None:
+            delay = max(delay, get_retry_after(response.headers) or 0)
+        logger.warning(
+            "Request to %s failed (%s), retrying in %.1f seconds",
+            endpoint,
+            status if response is not None else repr(transport_error),
+            delay,
+        )
+        await asyncio.sleep(delay)
+        attempt += 1
@@ -0,0 +1,226 @@
+import logging
+import sqlite3
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+
+from .compression import JSON_EXTENSIONS, is_json_user_file, read_compressed
+from .data_utils import RunDataset, get_edge_type_from_path, get_user_id_from_path
+from .snapshots import DELTA_EXTENSION, RunSnapshot
+
+logger = logging.getLogger(__package__)
+
+MANIFEST_SCHEMA = pa.schema(
+    [
+        ("user_id", pa.int64()),
+        ("edge", pa.string()),
+        # distance of the user from the seed user, if known
+        ("depth", pa.int64()),
+        ("edges", pa.int64()),
+        ("bytes", pa.int64()),
+        ("fetched_at", pa.timestamp("s", tz="UTC")),
+        # path of the user file, relative to the run's dataset directory
+        ("path", pa.string()),
+    ]
+)
+
+# extensions of completed user files, of every storage format
+USER_FILE_EXTENSIONS = [*JSON_EXTENSIONS.values(), "edges.npy", DELTA_EXTENSION]
+
+
+@dataclass
+class ManifestStats:
+    users_crawled: int
+    edges: int
+    mean_edges: float
+    median_edges: float
+    size: int
+    users_by_depth: dict[int | None, int]
+
+
+class RunManifest:
+    """Record of every user file saved in a run, in a SQLite database.
+
+    Each completed user is added when their file is written, with their depth,
+    number of edges, file size and when they were fetched. The users in the
+    manifest are loaded into memory when it's opened, so the crawler can tell
+    whether a user is done without checking for their file on disk, and stats
+    about the run can be read without opening any user files.
+
+    Runs from before the manifest are added to it from their user files the
+    first time it's opened, without depths. Files saved without it since, such
+    as by older versions, are only added by calling `backfill`, so opening the
+    manifest never lists the users directory of a run it already has. Like the
+    work queue, the database is in WAL mode so the workers of a run can share
+    it.
+    """
+
+    def __init__(self, run_dataset: RunDataset) -> None:
+        self.run_dataset = run_dataset
+        path = run_dataset.manifest_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS manifest (
+                user_id INTEGER NOT NULL,
+                edge TEXT NOT NULL,
+                depth INTEGER,
+                edges INTEGER NOT NULL,
+                bytes INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                path TEXT NOT NULL,
+                PRIMARY KEY (user_id, edge)
+            )
+            """
+        )
+        rows = self.conn.execute("SELECT user_id, edge, path FROM manifest")
+        self._paths = {(user_id, edge): path for user_id, edge, path in rows}
+        if not self._paths:
+            self.backfill()
+
+    def __enter__(self) -> "RunManifest":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def is_complete(self, user_id: int, edge: str) -> bool:
+        return (user_id, edge) in self._paths
+
+    def get_path(self, user_id: int, edge: str) -> Path | None:
+        """Path of a user's saved file, or None if they haven't been saved."""
+        path = self._paths.get((user_id, edge))
+        return None if path is None else self.run_dataset.dataset_path / path
+
+    def record(
+        self,
+        user_id: int,
+        edge: str,
+        path: Path,
+        edges: int,
+        depth: int | None = None,
+        fetched_at: float | None = None,
+    ) -> None:
+        """Add a saved user file, replacing any earlier record of the user."""
+        path = path.relative_to(self.run_dataset.dataset_path).as_posix()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO manifest VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                user_id,
+                edge,
+                depth,
+                edges,
+                (self.run_dataset.dataset_path / path).stat().st_size,
+                time.time() if fetched_at is None else fetched_at,
+                path,
+            ],
+        )
+        self._paths[(user_id, edge)] = path
+
+    def backfill(self) -> int:
+        """Add user files saved without the manifest, returning how many.
+
+        The user directories are listed once, and only files of users not
+        already in the manifest are read.
+        """
+        suffixes = tuple(f".{extension}" for extension in USER_FILE_EXTENSIONS)
+        user_paths = [
+            path
+            for path in self.run_dataset.glob_user_files("*")
+            if path.name.endswith(suffixes)
+        ]
+        if not self._get_unrecorded(user_paths):
+            return 0
+        # takes the write lock up front, as workers may open the manifest at once,
+        # then skips any files another worker recorded in the meantime
+        self.conn.execute("BEGIN IMMEDIATE")
+        rows = self.conn.execute("SELECT user_id, edge, path FROM manifest")
+        self._paths = {(user_id, edge): path for user_id, edge, path in rows}
+        user_paths = self._get_unrecorded(user_paths)
+        logger.info("Adding %d saved user files to manifest", len(user_paths))
+        snapshot = None
+        for path in user_paths:
+            user_id, edge = get_user_id_from_path(path), get_edge_type_from_path(path)
+            if path.name.endswith(DELTA_EXTENSION):
+                snapshot = snapshot or RunSnapshot(self.run_dataset)
+                edges = len(snapshot.get_user_ids(user_id, edge))
+            elif is_json_user_file(path):
+                edges = read_compressed(path).count(b"\n")
+            else:
+                edges = len(np.load(path, mmap_mode="r"))
+            self.record(user_id, edge, path, edges, fetched_at=path.stat().st_mtime)
+        self.conn.execute("COMMIT")
+        return len(user_paths)
+
+    def _get_unrecorded(self, user_paths: list[Path]) -> list[Path]:
+        return [
+            path
+            for path in user_paths
+            if (get_user_id_from_path(path), get_edge_type_from_path(path))
+            not in self._paths
+        ]
+
+    def get_user_paths(self, deltas: bool = False) -> list[Path]:
+        """Paths of saved follow lists, sorted, without listing directories.
+
+        Like `RunDataset.get_user_paths`, the delta files of recrawls are left
+        out, unless `deltas` is True.
+        """
+        dataset_path = self.run_dataset.dataset_path
+        return sorted(
+            dataset_path / path
+            for path in self._paths.values()
+            if deltas or not path.endswith(DELTA_EXTENSION)
+        )
+
+    def read_table(self) -> pa.Table:
+        rows = self.conn.execute(
+            """
+            SELECT user_id, edge, depth, edges, bytes,
+                   CAST(fetched_at AS INTEGER), path
+            FROM manifest ORDER BY rowid
+            """
+        ).fetchall()
+        columns = list(zip(*rows)) or [[] for _ in MANIFEST_SCHEMA]
+        return pa.table(
+            [
+                pa.array(column, type=field.type)
+                for column, field in zip(columns, MANIFEST_SCHEMA)
+            ],
+            schema=MANIFEST_SCHEMA,
+        )
+
+    def stats(self) -> ManifestStats:
+        """Stats about the saved users, read from the manifest alone.
+
+        Delta files of recrawls are counted by the edges of the full follow
+        list, and their own size on disk.
+        """
+        edges = np.array(
+            [row[0] for row in self.conn.execute("SELECT edges FROM manifest")],
+            dtype=np.int64,
+        )
+        size = self.conn.execute("SELECT coalesce(sum(bytes), 0) FROM manifest")
+        depths = self.conn.execute(
+            "SELECT depth, count(*) FROM manifest GROUP BY depth ORDER BY depth"
+        )
+        return ManifestStats(
+            users_crawled=len(edges),
+            edges=int(edges.sum()),
+            mean_edges=float(edges.mean()) if len(edges) else 0.0,
+            median_edges=float(np.median(edges)) if len(edges) else 0.0,
+            size=size.fetchone()[0],
+            users_by_depth=dict(depths.fetchall()),
+        )
+
+    def close(self) -> None:
+        self.conn.close()
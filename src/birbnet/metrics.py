@@ -0,0 +1,401 @@
+import asyncio
+import bisect
+import contextlib
+import logging
+import threading
+import time
+from collections.abc import AsyncIterator, Iterator
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__package__)
+
+# upper bounds in seconds of histogram buckets. rate limit waits can be as long as
+# a whole 15 minute window, so the buckets go well beyond typical request times.
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+METRICS_LOG_SCHEMA = pa.schema(
+    [
+        ("timestamp", pa.timestamp("ms", tz="UTC")),
+        ("name", pa.string()),
+        # JSON object of label names to values
+        ("labels", pa.string()),
+        ("value", pa.float64()),
+    ]
+)
+
+
+class Metric:
+    """A named value, kept separately for each combination of label values.
+
+    Label values are passed as keyword arguments when the metric is updated.
+    Updates can come from any thread, and are read by the metrics server from
+    its own thread, so every access takes the metric's lock.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> Iterator[tuple[str, dict, float]]:
+        """Yield the name, labels and value of every sample of this metric."""
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield self.name, dict(zip(self.label_names, key)), value
+
+    def _key(self, labels: dict) -> tuple[str, ...]:
+        if labels.keys() != set(self.label_names):
+            raise ValueError(f"{self.name} needs labels {self.label_names}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+
+class Counter(Metric):
+    """A total that only goes up, such as the number of pages fetched."""
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    """A value that can go up and down, such as the size of a frontier."""
+
+    type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Histogram(Metric):
+    """Counts of observed values, such as request times, in buckets.
+
+    As in Prometheus, buckets are cumulative, each counting the observations
+    less than or equal to its upper bound, and the sum and count of all
+    observations are kept alongside them.
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._histograms: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            # counts of each bucket, then +Inf, then the sum of values
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            histogram[bisect.bisect_left(self.buckets, value)] += 1
+            histogram[-1] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observe the number of seconds taken by the body of a with block."""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, **labels)
+
+    def get(self, **labels) -> float:
+        """The sum of all values observed."""
+        with self._lock:
+            histogram = self._histograms.get(self._key(labels))
+        return histogram[-1] if histogram else 0.0
+
+    def samples(self) -> Iterator[tuple[str, dict, float]]:
+        with self._lock:
+            histograms = [(key, list(hist)) for key, hist in self._histograms.items()]
+        for key, histogram in histograms:
+            labels = dict(zip(self.label_names, key))
+            total = 0
+            for bound, count in zip([*self.buckets, "+Inf"], histogram[:-1]):
+                total += count
+                yield f"{self.name}_bucket", {**labels, "le": str(bound)}, total
+            yield f"{self.name}_sum", labels, histogram[-1]
+            yield f"{self.name}_count", labels, total
+
+
+class MetricsRegistry:
+    """The metrics collected by a process, in Prometheus text format or a table."""
+
+    def __init__(self) -> None:
+        self.metrics: dict[str, Metric] = {}
+
+    def counter(self, name: str, help: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labels))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {value!r}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> pa.Table:
+        """Current value of every sample, one row each, for the metrics log.
+
+        Histogram buckets are left out to keep the log small. Their sums and
+        counts are enough to get the mean of each stage between snapshots.
+        """
+        timestamp = datetime.now(timezone.utc)
+        rows = [
+            {
+                "timestamp": timestamp,
+                "name": name,
+                "labels": orjson.dumps(labels).decode(),
+                "value": float(value),
+            }
+            for metric in self.metrics.values()
+            for name, labels, value in metric.samples()
+            if not name.endswith("_bucket")
+        ]
+        return pa.Table.from_pylist(rows, schema=METRICS_LOG_SCHEMA)
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels.items():
+        value = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+# metrics collected by this process, shared by everything it crawls
+REGISTRY = MetricsRegistry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "birbnet_request_seconds",
+    "Time taken by API requests, including reading the response.",
+    ("endpoint", "status"),
+)
+RATE_LIMIT_WAIT_SECONDS = REGISTRY.histogram(
+    "birbnet_rate_limit_wait_seconds",
+    "Time spent waiting for a bearer token with rate-limit budget left.",
+    ("pool",),
+)
+PAGES_FETCHED = REGISTRY.counter(
+    "birbnet_pages_fetched_total", "Pages of follows fetched.", ("edge",)
+)
+USERS_FETCHED = REGISTRY.counter(
+    "birbnet_users_fetched_total", "Users in pages of follows fetched.", ("edge",)
+)
+WRITE_SECONDS = REGISTRY.histogram(
+    "birbnet_write_seconds",
+    "Time taken to write a page of users to disk.",
+    ("storage",),
+)
+BYTES_WRITTEN = REGISTRY.counter(
+    "birbnet_bytes_written_total",
+    "Bytes of crawled users written to disk, before any compression.",
+    ("kind",),
+)
+USERS_EXPANDED = REGISTRY.counter(
+    "birbnet_users_expanded_total",
+    "Users expanded at each depth, by whether they were fetched, loaded or skipped.",
+    ("depth", "source"),
+)
+FRONTIER_SIZE = REGISTRY.gauge(
+    "birbnet_frontier_size", "Users in the frontier of each depth.", ("depth",)
+)
+FRONTIER_REMAINING = REGISTRY.gauge(
+    "birbnet_frontier_remaining",
+    "Users in the frontier of each depth not yet expanded.",
+    ("depth",),
+)
+
+
+class MetricsServer:
+    """Serves a registry's metrics at /metrics for Prometheus to scrape.
+
+    The server runs in a background thread. It only listens on localhost
+    unless given another host, such as "0.0.0.0" for all interfaces.
+    """
+
+    def __init__(
+        self,
+        registry: MetricsRegistry = REGISTRY,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ) -> None:
+        self.server = ThreadingHTTPServer((host, port), _make_handler(registry))
+        self.server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host or 'localhost'}:{port}/metrics"
+
+    def __enter__(self) -> "MetricsServer":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info("Serving metrics at %s", self.url)
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def _make_handler(registry: MetricsRegistry) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            data = registry.render().encode()
+            self.send_response(200)
+            self.send_header("content-type", "text/plain; version=0.0.4")
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format: str, *args) -> None:
+            logger.debug(format, *args)
+
+    return Handler
+
+
+class MetricsLog:
+    """Periodic snapshots of a registry's metrics, in a directory of Parquet files.
+
+    Each snapshot adds a row per sample to the current part file, which is
+    rewritten whole and atomically replaced, so it can be read at any time
+    during a crawl and survives the crawl being killed. Once a part holds
+    `part_snapshots` snapshots a new part is started, so each write only
+    rewrites the latest part however long the crawl runs. Parts from before
+    a crawl was resumed are kept, and the whole log can be read with
+    `pq.read_table(path)`. Counters are totals for this process, so rates
+    come from the differences between snapshots.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        registry: MetricsRegistry = REGISTRY,
+        interval: float = 60,
+        part_snapshots: int = 60,
+    ) -> None:
+        self.path = path
+        self.registry = registry
+        self.interval = interval
+        self.part_snapshots = part_snapshots
+        self._part = len(list(path.glob("part-*.parquet"))) if path.exists() else 0
+        self._tables: list[pa.Table] = []
+        # writes run in a worker thread, which carries on if `run` is cancelled
+        # mid write, so the last write waits for it to finish
+        self._lock = threading.Lock()
+
+    def write(self) -> None:
+        with self._lock:
+            if len(self._tables) >= self.part_snapshots:
+                self._part += 1
+                self._tables = []
+            self._tables.append(self.registry.snapshot())
+            table = pa.concat_tables(self._tables).combine_chunks()
+            self.path.mkdir(parents=True, exist_ok=True)
+            part_path = self.path / f"part-{self._part:05d}.parquet"
+            tmp_path = part_path.with_name(f"{part_path.name}.tmp")
+            pq.write_table(table, tmp_path)
+            tmp_path.replace(part_path)
+
+    async def run(self) -> None:
+        """Write a snapshot every `interval` seconds, until cancelled."""
+        while True:
+            await asyncio.sleep(self.interval)
+            await asyncio.to_thread(self.write)
+
+
+@asynccontextmanager
+async def record_metrics(
+    log_path: Path,
+    interval: float = 60,
+    port: int | None = None,
+    host: str = "127.0.0.1",
+) -> AsyncIterator[MetricsLog]:
+    """Log metrics to `log_path` while the body runs, serving them on `port`.
+
+    Metrics are only served if `port` is given, on `host`. A last snapshot is
+    written to the log when the body finishes.
+    """
+    metrics_log = MetricsLog(log_path, interval=interval)
+    server = MetricsServer(host=host, port=port) if port is not None else None
+    if server is not None:
+        server.start()
+    task = asyncio.create_task(metrics_log.run())
+    try:
+        yield metrics_log
+    finally:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+        metrics_log.write()
+        if server is not None:
+            server.stop()
@@ -0,0 +1,266 @@
+import logging
+import math
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import orjson
+
+from .graph import Graph
+from .types import Edge
+
+logger = logging.getLogger(__package__)
+
+# synthetic user IDs start here, so they look like real Twitter IDs
+FIRST_USER_ID = 1_000_000_000
+
+DEFAULT_MAX_RESULTS = 100
+MAX_RESULTS_LIMIT = 1000
+MAX_LOOKUP_IDS = 100
+
+EDGES = Edge.__args__
+
+
+def make_power_law_graph(
+    num_users: int,
+    mean_follows: float = 50,
+    exponent: float = 2.1,
+    seed: int = 0,
+) -> Graph:
+    """Make a random follow graph with power law degree distributions.
+
+    The number of users each user follows is drawn from a Pareto distribution
+    with the given exponent, scaled to have about `mean_follows` on average.
+    Who they follow is skewed towards a small number of popular users, so the
+    numbers of followers are heavy tailed too, as on Twitter.
+    """
+    rng = np.random.default_rng(seed)
+    shape = exponent - 1
+    scale = mean_follows * (shape - 1) / shape if shape > 1 else 1
+    follows = (rng.pareto(shape, num_users) + 1) * scale
+    follows = np.minimum(follows.astype(np.int64), num_users - 1)
+    sources = np.repeat(np.arange(num_users), follows)
+    # users earlier in this random order are much more likely to be followed
+    popularity = rng.permutation(num_users)
+    targets = popularity[(num_users * rng.random(len(sources)) ** 3).astype(np.int64)]
+    not_self = sources != targets
+    edges = np.unique(sources[not_self] * num_users + targets[not_self])
+    sources, targets = np.divmod(edges, num_users)
+    return Graph.from_edges(sources + FIRST_USER_ID, targets + FIRST_USER_ID)
+
+
+class MockTwitterAPI:
+    """A stand-in for the parts of the Twitter API used by the crawler.
+
+    Serves the follows and users lookup endpoints from a synthetic graph, with
+    pagination and rate-limit headers like the real API. Every response can be
+    delayed by `latency` seconds, plus up to `jitter` seconds at random, and
+    fail with a 503 with probability `error_rate`. If `rate_limit` is set,
+    each bearer token can make that many requests to each endpoint every
+    `rate_window` seconds, after which requests get a 429.
+    """
+
+    def __init__(
+        self,
+        graph: Graph,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit: int | None = None,
+        rate_window: float = 15 * 60,
+        seed: int = 0,
+    ) -> None:
+        self.graph = graph
+        self.following_counts = graph.out_degree()
+        self.followers_counts = graph.in_degree()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.stats = Counter()
+        self._random = random.Random(seed)
+        self._windows: dict[tuple[str, str], tuple[float, int]] = {}
+        self._lock = threading.Lock()
+
+    def handle(self, url: str, headers: dict) -> tuple[int, dict, dict]:
+        """Respond to a GET request, returning its status, headers and body."""
+        parsed = urlparse(url)
+        params = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        parts = parsed.path.strip("/").split("/")
+        if len(parts) == 4 and parts[:2] == ["2", "users"] and parts[3] in EDGES:
+            endpoint = parts[3]
+        elif parts == ["2", "users"]:
+            endpoint = "users"
+        else:
+            return 404, {}, {"title": "Not Found Error"}
+
+        delay = self.latency + self._random.random() * self.jitter
+        if delay:
+            time.sleep(delay)
+        with self._lock:
+            self.stats["requests"] += 1
+            rate_headers, limited = self._take_request(
+                headers.get("authorization", ""), endpoint
+            )
+            if limited:
+                self.stats["rate_limited"] += 1
+                return 429, rate_headers, {"title": "Too Many Requests"}
+            if self._random.random() < self.error_rate:
+                self.stats["errors"] += 1
+                return 503, rate_headers, {"title": "Service Unavailable"}
+
+        if endpoint == "users":
+            body = self._lookup_users(params)
+        else:
+            body = self._follows_page(int(parts[2]), endpoint, params)
+        return 200, rate_headers, body
+
+    def _take_request(self, token: str, endpoint: str) -> tuple[dict, bool]:
+        if self.rate_limit is None:
+            return {}, False
+        now = time.time()
+        window_start, used = self._windows.get((token, endpoint), (now, 0))
+        if now >= window_start + self.rate_window:
+            window_start, used = now, 0
+        limited = used >= self.rate_limit
+        if not limited:
+            used += 1
+        self._windows[(token, endpoint)] = (window_start, used)
+        rate_headers = {
+            "x-rate-limit-limit": str(self.rate_limit),
+            "x-rate-limit-remaining": str(self.rate_limit - used),
+            "x-rate-limit-reset": str(math.ceil(window_start + self.rate_window)),
+        }
+        return rate_headers, limited
+
+    def _follows_page(self, user_id: int, endpoint: str, params: dict) -> dict:
+        [node] = self.graph.node_index([user_id])
+        if node < 0:
+            return {"errors": [{"title": "Not Found Error", "value": str(user_id)}]}
+        if endpoint == "following":
+            nodes = self.graph.successors(node)
+        else:
+            nodes = self.graph.predecessors(node)
+        max_results = int(params.get("max_results", DEFAULT_MAX_RESULTS))
+        max_results = min(max(max_results, 1), MAX_RESULTS_LIMIT)
+        offset = int(params.get("pagination_token", "0"), 16)
+        page_nodes = nodes[offset : offset + max_results].tolist()
+        meta = {"result_count": len(page_nodes)}
+        if offset + max_results < len(nodes):
+            meta["next_token"] = f"{offset + max_results:016x}"
+        with self._lock:
+            self.stats["pages"] += 1
+            self.stats["users_served"] += len(page_nodes)
+        if not page_nodes:
+            return {"meta": meta}
+        return {"data": [self._profile(node) for node in page_nodes], "meta": meta}
+
+    def _lookup_users(self, params: dict) -> dict:
+        user_ids = [
+            int(user_id) for user_id in params.get("ids", "").split(",") if user_id
+        ]
+        nodes = self.graph.node_index(user_ids[:MAX_LOOKUP_IDS])
+        body = {"data": [self._profile(node) for node in nodes.tolist() if node >= 0]}
+        missing = [user_id for user_id, node in zip(user_ids, nodes) if node < 0]
+        if missing:
+            body["errors"] = [
+                {"title": "Not Found Error", "value": str(user_id)}
+                for user_id in missing
+            ]
+        with self._lock:
+            self.stats["users_served"] += len(body["data"])
+        return body
+
+    def _profile(self, node: int) -> dict:
+        user_id = int(self.graph.ids[node])
+        days_old = user_id % 5000
+        created_at = datetime(2023, 1, 1, tzinfo=timezone.utc) - timedelta(
+            days=days_old
+        )
+        return {
+            "id": str(user_id),
+            "username": f"user{user_id}",
+            "name": f"User {user_id}",
+            "description": f"Synthetic user {user_id}",
+            "created_at": created_at.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            "url": "",
+            "profile_image_url": f"https://example.com/{user_id}.jpg",
+            "protected": False,
+            "verified": False,
+            "public_metrics": {
+                "followers_count": int(self.followers_counts[node]),
+                "following_count": int(self.following_counts[node]),
+                "tweet_count": days_old * 3,
+                "listed_count": days_old % 7,
+            },
+        }
+
+
+class MockAPIServer:
+    """Serves a MockTwitterAPI over HTTP from a background thread.
+
+    Use as a context manager, and point the crawler at `url` through
+    `config.API_URL` or the BIRBNET_API_URL environment variable.
+    """
+
+    def __init__(self, api: MockTwitterAPI, host: str = "127.0.0.1", port: int = 0):
+        self.api = api
+        self.server = ThreadingHTTPServer((host, port), _make_handler(api))
+        self.server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/2"
+
+    def __enter__(self) -> "MockAPIServer":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info("Mock Twitter API serving at %s", self.url)
+
+    def serve_forever(self) -> None:
+        logger.info("Mock Twitter API serving at %s", self.url)
+        self.server.serve_forever()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def _make_handler(api: MockTwitterAPI) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        # keep-alive, so clients can reuse connections as with the real API
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self) -> None:
+            headers = {key.lower(): value for key, value in self.headers.items()}
+            status, response_headers, body = api.handle(self.path, headers)
+            data = orjson.dumps(body)
+            self.send_response(status)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(data)))
+            for key, value in response_headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format: str, *args) -> None:
+            logger.debug(format, *args)
+
+    return Handler
@@ -1,7 +1,13 @@
+import dataclasses
+import os
 from datetime import datetime
 from typing import Self
 
+import numpy as np
 import orjson
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.json as pa_json
 from pydantic.dataclasses import dataclass
 
 
@@ -22,6 +28,75 @@ USER_FIELDS = [
     "withheld",
 ]
 
+_URLS_TYPE = pa.list_(pa.struct([("url", pa.string()), ("expanded_url", pa.string())]))
+
+# the parts of user objects returned by the API that are used by User
+RAW_USER_TYPE = pa.struct(
+    [
+        ("id", pa.string()),
+        ("description", pa.string()),
+        ("created_at", pa.string()),
+        ("name", pa.string()),
+        ("location", pa.string()),
+        ("username", pa.string()),
+        ("verified", pa.bool_()),
+        ("protected", pa.bool_()),
+        (
+            "public_metrics",
+            pa.struct(
+                [
+                    ("followers_count", pa.int64()),
+                    ("following_count", pa.int64()),
+                    ("tweet_count", pa.int64()),
+                    ("listed_count", pa.int64()),
+                ]
+            ),
+        ),
+        (
+            "entities",
+            pa.struct(
+                [
+                    ("url", pa.struct([("urls", _URLS_TYPE)])),
+                    (
+                        "description",
+                        pa.struct(
+                            [
+                                ("urls", _URLS_TYPE),
+                                (
+                                    "mentions",
+                                    pa.list_(pa.struct([("username", pa.string())])),
+                                ),
+                            ]
+                        ),
+                    ),
+                ]
+            ),
+        ),
+        ("profile_image_url", pa.string()),
+    ]
+)
+
+# columns of the tables made by users_to_table, which are the fields of User
+USER_SCHEMA = pa.schema(
+    [
+        ("id", pa.int64()),
+        ("description", pa.string()),
+        ("created_at", pa.timestamp("ms", tz="UTC")),
+        ("name", pa.string()),
+        ("location", pa.string()),
+        ("username", pa.string()),
+        ("verified", pa.bool_()),
+        ("protected", pa.bool_()),
+        ("followers_count", pa.int64()),
+        ("following_count", pa.int64()),
+        ("tweet_count", pa.int64()),
+        ("listed_count", pa.int64()),
+        ("urls", pa.list_(pa.string())),
+        ("mentions", pa.list_(pa.string())),
+        ("profile_image_url", pa.string()),
+    ]
+)
+
 
 @dataclass(frozen=True)
 class User:
@@ -48,40 +123,176 @@ class User:
 
     @classmethod
     def from_data(cls, data: dict) -> Self:
-        urls = list(
-            {
-                url.get("expanded_url", url["url"])
-                for url in data.get("entities", {}).get("url", {}).get("urls", [])
-            }
-            | {
-                url.get("expanded_url", url["url"])
-                for url in data.get("entities", {})
-                .get("description", {})
-                .get("urls", [])
-            }
-        )
-        mentions = list(
+        return cls(**get_user_fields(data))
+
+
+@dataclasses.dataclass(slots=True)
+class UserRecord:
+    """Unvalidated counterpart of User, for creating many users per second.
+
+    Fields are the same as User, but a plain dataclass with __slots__ is used,
+    so creating a record only assigns attributes, with no type checking or
+    coercion. Use `validate` to get a User, checking the record's fields.
+    """
+
+    id: str
+    description: str
+    created_at: datetime
+    name: str
+    location: str | None
+    username: str
+    verified: bool
+    protected: bool
+    followers_count: int
+    following_count: int
+    tweet_count: int
+    listed_count: int
+    urls: list[str]
+    mentions: list[str]
+    profile_image_url: str
+
+    @classmethod
+    def from_json(cls, data_str: str) -> Self:
+        data = orjson.loads(data_str)
+        return cls.from_data(data)
+
+    @classmethod
+    def from_data(cls, data: dict) -> Self:
+        fields = get_user_fields(data)
+        fields["created_at"] = datetime.fromisoformat(fields["created_at"])
+        return cls(**fields)
+
+    def validate(self) -> User:
+        return User(**{name: getattr(self, name) for name in self.__slots__})
+
+
+def get_user_fields(data: dict) -> dict:
+    """Get the fields of a User from a user object returned by the API."""
+    entities = data.get("entities", {})
+    description_entities = entities.get("description", {})
+    urls = {
+        url.get("expanded_url", url["url"])
+        for url in entities.get("url", {}).get("urls", [])
+    }
+    urls.update(
+        url.get("expanded_url", url["url"])
+        for url in description_entities.get("urls", [])
+    )
+    public_metrics = data["public_metrics"]
+    return {
+        "id": data["id"],
+        "description": data["description"],
+        "created_at": data["created_at"],
+        "name": data["name"],
+        "location": data.get("location"),
+        "username": data["username"],
+        "verified": data["verified"],
+        "protected": data["protected"],
+        "followers_count": public_metrics["followers_count"],
+        "following_count": public_metrics["following_count"],
+        "tweet_count": public_metrics["tweet_count"],
+        "listed_count": public_metrics.get("listed_count", 0),
+        "urls": list(urls),
+        "mentions": list(
             {
                 mention["username"]
-                for mention in data.get("entities", {})
-                .get("description", {})
-                .get("mentions", [])
+                for mention in description_entities.get("mentions", [])
             }
-        )
-        return cls(
-            id=data["id"],
-            description=data["description"],
-            created_at=data["created_at"],
-            name=data["name"],
-            location=data.get("location"),
-            username=data["username"],
-            verified=data["verified"],
-            protected=data["protected"],
-            followers_count=data["public_metrics"]["followers_count"],
-            following_count=data["public_metrics"]["following_count"],
-            tweet_count=data["public_metrics"]["tweet_count"],
-            listed_count=data["public_metrics"].get("listed_count", 0),
-            urls=urls,
-            mentions=mentions,
-            profile_image_url=data["profile_image_url"],
-        )
+        ),
+        "profile_image_url": data["profile_image_url"],
+    }
+
+
+def users_to_table(users: list[dict]) -> pa.Table:
+    """Convert user objects from the API into a table with the fields of User.
+
+    The whole list is converted by Arrow in one pass, rather than creating a
+    User for each user object, and fields missing from a user object are null
+    instead of raising an error. User IDs are int64, as in the rest of a run's
+    dataset.
+    """
+    raw_users = pa.array(users, type=RAW_USER_TYPE)
+    return _raw_users_to_table(pa.RecordBatch.from_struct_array(raw_users))
+
+
+def read_users_table(path: os.PathLike | str) -> pa.Table:
+    """Read a JSON lines file of user objects into a table like `users_to_table`.
+
+    The file is parsed by Arrow's multi-threaded JSON reader, without the user
+    objects ever being loaded into Python.
+    """
+    parse_options = pa_json.ParseOptions(
+        explicit_schema=pa.schema(list(RAW_USER_TYPE)),
+        unexpected_field_behavior="ignore",
+    )
+    return _raw_users_to_table(
+        pa_json.read_json(path, parse_options=parse_options).combine_chunks()
+    )
+
+
+def _raw_users_to_table(raw_users: pa.Table | pa.RecordBatch) -> pa.Table:
+    def column(*names: str) -> pa.Array:
+        array = raw_users.column(names[0])
+        if isinstance(array, pa.ChunkedArray):
+            array = array.combine_chunks()
+        return pc.struct_field(array, list(names[1:])) if names[1:] else array
+
+    num_rows = raw_users.num_rows
+    url_lists = [
+        column("entities", "url", "urls"),
+        column("entities", "description", "urls"),
+    ]
+    urls = [pc.list_flatten(url_list) for url_list in url_lists]
+    mentions = column("entities", "description", "mentions")
+    columns = {
+        "id": pc.cast(column("id"), pa.int64()),
+        "description": column("description"),
+        "created_at": pc.cast(column("created_at"), pa.timestamp("ms", tz="UTC")),
+        "name": column("name"),
+        "location": column("location"),
+        "username": column("username"),
+        "verified": column("verified"),
+        "protected": column("protected"),
+        "followers_count": column("public_metrics", "followers_count"),
+        "following_count": column("public_metrics", "following_count"),
+        "tweet_count": column("public_metrics", "tweet_count"),
+        "listed_count": pc.fill_null(column("public_metrics", "listed_count"), 0),
+        "urls": _unique_lists(
+            num_rows,
+            [pc.list_parent_indices(url_list) for url_list in url_lists],
+            [
+                pc.coalesce(
+                    pc.struct_field(url, "expanded_url"), pc.struct_field(url, "url")
+                )
+                for url in urls
+            ],
+        ),
+        "mentions": _unique_lists(
+            num_rows,
+            [pc.list_parent_indices(mentions)],
+            [pc.struct_field(pc.list_flatten(mentions), "username")],
+        ),
+        "profile_image_url": column("profile_image_url"),
+    }
+    return pa.table(columns, schema=USER_SCHEMA)
+
+
+def _unique_lists(
+    num_rows: int, parent_indices: list[pa.Array], values: list[pa.Array]
+) -> pa.ListArray:
+    # builds a list for each row of the distinct values with that row as parent,
+    # like the sets made for each user by get_user_fields
+    rows = np.concatenate([indices.to_numpy() for indices in parent_indices])
+    values = pa.concat_arrays(values)
+    valid = pc.is_valid(values)
+    encoded = pc.dictionary_encode(values.filter(valid))
+    num_values = max(len(encoded.dictionary), 1)
+    # sorting row and value code pairs puts each row's distinct values together
+    pairs = np.unique(
+        rows[valid.to_numpy(zero_copy_only=False)].astype(np.int64) * num_values
+        + encoded.indices.to_numpy()
+    )
+    rows, codes = np.divmod(pairs, num_values)
+    offsets = np.zeros(num_rows + 1, dtype=np.int32)
+    np.cumsum(np.bincount(rows, minlength=num_rows), out=offsets[1:])
+    return pa.ListArray.from_arrays(offsets, encoded.dictionary.take(codes))
@@ -0,0 +1,134 @@
+import math
+from dataclasses import dataclass
+
+from .types import LargeUserPolicy
+
+
+@dataclass
+class FrontierEstimate:
+    """Projected cost of expanding the users in a frontier, before fetching any.
+
+    Estimates come from the number of follows in users' profiles. Users whose
+    counts aren't known are assumed to take the mean number of pages of those
+    whose counts are.
+    """
+
+    depth: int
+    # users that still need to be fetched, and how many of them have known counts
+    users: int = 0
+    counted: int = 0
+    # follows and pages expected to be fetched, after any budgets are applied
+    edges: int = 0
+    pages: int = 0
+    # users with more follows than the budget, only partly fetched or not at all
+    sampled: int = 0
+    skipped: int = 0
+    # projected time to make the requests, given the rate limits
+    seconds: float = 0.0
+    # pages and time for the rest of the crawl from this depth on. an upper
+    # bound, extrapolated from this depth. see `projected_pages`
+    crawl_pages: int = 0
+    crawl_seconds: float = 0.0
+
+    def projected_pages(self, further_depths: int) -> int:
+        """Pages for this depth and `further_depths` more.
+
+        Each further depth is assumed to have users like this one's, with
+        every follow a new user, so this is an upper bound: users followed
+        more than once are only expanded once.
+        """
+        if self.users == 0:
+            return self.pages
+        branching = self.edges / self.users
+        pages_per_user = self.pages / self.users
+        users, pages = self.users, self.pages
+        for _ in range(further_depths):
+            users *= branching
+            pages += users * pages_per_user
+        return round(pages)
+
+
+def combine_estimates(estimates: list[FrontierEstimate]) -> FrontierEstimate:
+    """Combine the estimates for each edge type fetched from the same frontier.
+
+    Edge types are fetched at the same time under their own rate limits, so
+    users and pages add up, counting each follow list, but the time taken is
+    that of the slowest edge type.
+    """
+    if len(estimates) == 1:
+        return estimates[0]
+    combined = FrontierEstimate(depth=estimates[0].depth)
+    for field in [
+        "users",
+        "counted",
+        "edges",
+        "pages",
+        "sampled",
+        "skipped",
+        "crawl_pages",
+    ]:
+        setattr(
+            combined, field, sum(getattr(estimate, field) for estimate in estimates)
+        )
+    combined.seconds = max(estimate.seconds for estimate in estimates)
+    combined.crawl_seconds = max(estimate.crawl_seconds for estimate in estimates)
+    return combined
+
+
+def plan_fetch(
+    count: int | None, max_edges: int | None, large_users: LargeUserPolicy
+) -> tuple[bool, int | None]:
+    """Decide whether to fetch a user, and how many of their follows to fetch.
+
+    Returns whether to fetch them, and the number of follows to stop at, or
+    None to fetch them all. Users with more than `max_edges` follows are
+    either sampled, fetching only their first `max_edges` follows, or skipped.
+    """
+    if count is None or max_edges is None or count <= max_edges:
+        return True, None
+    if large_users == "skip":
+        return False, None
+    return True, max_edges
+
+
+def estimate_pages(count: int, max_results: int, max_pages: int | None) -> int:
+    """Number of requests to fetch `count` follows, `max_results` per page."""
+    pages = max(math.ceil(count / max_results), 1)
+    return pages if max_pages is None else min(pages, max_pages)
+
+
+def estimate_frontier(
+    depth: int,
+    counts: dict[int, int | None],
+    max_results: int,
+    max_pages: int | None,
+    max_edges: int | None,
+    large_users: LargeUserPolicy,
+) -> FrontierEstimate:
+    """Estimate the pages needed to fetch users, from their follow counts.
+
+    `counts` maps the users still to be fetched to their number of follows of
+    the type being crawled, or None where it isn't known.
+    """
+    estimate = FrontierEstimate(depth=depth, users=len(counts))
+    for count in counts.values():
+        if count is None:
+            continue
+        fetch, stop_at = plan_fetch(count, max_edges, large_users)
+        if not fetch:
+            estimate.skipped += 1
+            continue
+        if stop_at is not None:
+            estimate.sampled += 1
+            count = stop_at
+        estimate.counted += 1
+        estimate.edges += count
+        estimate.pages += estimate_pages(
+            count, min(max_results, stop_at or max_results), max_pages
+        )
+    uncounted = estimate.users - estimate.counted - estimate.skipped
+    if uncounted:
+        counted = max(estimate.counted, 1)
+        estimate.pages += round(uncounted * max(estimate.pages / counted, 1))
+        estimate.edges += round(uncounted * estimate.edges / counted)
+    return estimate
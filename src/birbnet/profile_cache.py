@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from collections.abc import Callable, Iterable
+from pathlib import Path
+
+import httpx
+import orjson
+
+from . import config, http_utils
+from .config import DEFAULTS
+from .models import USER_FIELDS
+from .rate_limit import CredentialPool
+
+logger = logging.getLogger(__package__)
+
+# maximum number of user IDs the users lookup endpoint accepts per request
+USERS_LOOKUP_BATCH_SIZE = 100
+
+# number of IDs to put in each SQLite query, below its limit on parameters
+SQLITE_BATCH_SIZE = 500
+
+# users lookups are limited to 300 requests every 15 minutes per token, separately
+# from follow lookups, so they get their own pool.
+_lookup_credential_pool: CredentialPool | None = None
+
+
+def get_lookup_credential_pool() -> CredentialPool:
+    """Get the process-wide pool of bearer tokens used for users lookups."""
+    global _lookup_credential_pool
+    if _lookup_credential_pool is None:
+        _lookup_credential_pool = CredentialPool.from_tokens(
+            http_utils.get_bearer_tokens(), limit=300, window=15 * 60, name="users"
+        )
+    return _lookup_credential_pool
+
+
+class ProfileCache:
+    """User profiles from the API, shared by all runs, in a SQLite database.
+
+    Profiles are kept as the JSON returned by the API, keyed by user ID, along
+    with when they were fetched. Profiles older than `ttl` seconds are treated
+    as missing, so they are looked up again the next time they are needed.
+    The database is in WAL mode, so several processes can use it at once.
+    """
+
+    def __init__(
+        self,
+        path: Path | None = None,
+        ttl: float = DEFAULTS.profile_cache_ttl,
+    ) -> None:
+        path = path or config.PROFILE_CACHE_PATH
+        self.path = path
+        self.ttl = ttl
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS profiles (
+                id INTEGER PRIMARY KEY,
+                fetched_at REAL NOT NULL,
+                data BLOB NOT NULL
+            )
+            """
+        )
+
+    def __enter__(self) -> "ProfileCache":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT count(*) FROM profiles").fetchone()[0]
+
+    def put(self, users: list[dict], fetched_at: float | None = None) -> None:
+        """Store profiles, replacing any already stored for the same users."""
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO profiles VALUES (?, ?, ?)",
+                [(int(user["id"]), fetched_at, orjson.dumps(user)) for user in users],
+            )
+
+    def get(self, user_id: int) -> dict | None:
+        return self.get_many([user_id]).get(int(user_id))
+
+    def get_many(self, user_ids: Iterable[int]) -> dict[int, dict]:
+        """Get the fresh profiles of users, skipping users without one."""
+        user_ids = [int(user_id) for user_id in user_ids]
+        fresh_after = time.time() - self.ttl
+        profiles = {}
+        for i in range(0, len(user_ids), SQLITE_BATCH_SIZE):
+            batch = user_ids[i : i + SQLITE_BATCH_SIZE]
+            rows = self.conn.execute(
+                f"""
+                SELECT id, data FROM profiles
+                WHERE fetched_at >= ? AND id IN ({",".join("?" * len(batch))})
+                """,
+                [fresh_after, *batch],
+            )
+            profiles.update((user_id, orjson.loads(data)) for user_id, data in rows)
+        return profiles
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+async def get_users_request(client: httpx.AsyncClient, user_ids: list[int]) -> dict:
+    """Look up the profiles of up to 100 users in one request."""
+    params = http_utils.prepare_params(
+        {"ids": [str(user_id) for user_id in user_ids], "user.fields": USER_FIELDS}
+    )
+    response, credential = await http_utils.get_with_credentials(
+        client, f"{config.API_URL}/users", params, get_lookup_credential_pool(), "users"
+    )
+    logger.info("Looked up %d users (%s)", len(user_ids), credential.name)
+    return response.json()
+
+
+async def hydrate_async(
+    client: httpx.AsyncClient,
+    user_ids: Iterable[int],
+    profile_cache: ProfileCache,
+    refresh: bool = False,
+    concurrency: int = DEFAULTS.crawler_concurrency,
+    progress: Callable[[int], None] | None = None,
+) -> dict[int, dict]:
+    """Get the profiles of users, looking up any not fresh in the cache.
+
+    Users missing from the cache, or all users if `refresh` is True, are looked
+    up in batches of 100 with up to `concurrency` requests at once, and added
+    to the cache. Users the API doesn't return, such as suspended accounts,
+    are left out of the result. `progress` is called with the number of users
+    in each batch once it has been looked up.
+    """
+    user_ids = list(dict.fromkeys(int(user_id) for user_id in user_ids))
+    profiles = {} if refresh else profile_cache.get_many(user_ids)
+    missing = [user_id for user_id in user_ids if user_id not in profiles]
+    logger.info("Found %d of %d users in profile cache", len(profiles), len(user_ids))
+    batches = (
+        missing[i : i + USERS_LOOKUP_BATCH_SIZE]
+        for i in range(0, len(missing), USERS_LOOKUP_BATCH_SIZE)
+    )
+
+    async def worker() -> None:
+        for batch in batches:
+            response = await get_users_request(client, batch)
+            users = response.get("data", [])
+            profile_cache.put(users)
+            profiles.update((int(user["id"]), user) for user in users)
+            if progress is not None:
+                progress(len(batch))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return profiles
+
+
+def hydrate(
+    user_ids: Iterable[int],
+    profile_cache: ProfileCache | None = None,
+    refresh: bool = False,
+    concurrency: int = DEFAULTS.crawler_concurrency,
+    progress: Callable[[int], None] | None = None,
+) -> dict[int, dict]:
+    """Get the profiles of users, blocking until done. See `hydrate_async`."""
+
+    async def run(profile_cache: ProfileCache) -> dict[int, dict]:
+        async with http_utils.make_async_client(concurrency) as client:
+            return await hydrate_async(
+                client,
+                user_ids,
+                profile_cache,
+                refresh=refresh,
+                concurrency=concurrency,
+                progress=progress,
+            )
+
+    if profile_cache is not None:
+        return asyncio.run(run(profile_cache))
+    with ProfileCache() as profile_cache:
+        return asyncio.run(run(profile_cache))
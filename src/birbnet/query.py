@@ -0,0 +1,157 @@
+import numpy as np
+import pyarrow as pa
+
+from .data_utils import RunDataset
+from .exceptions import MisconfiguredException
+from .graph import Graph
+from .types import Direction
+
+NEIGHBORHOOD_SCHEMA = pa.schema([("user_id", pa.int64()), ("distance", pa.int8())])
+
+
+class GraphQuery:
+    """Queries about the neighborhoods of users in a run's follow graph.
+
+    Queries take and return user IDs, and run against the graph's CSR arrays,
+    which are memory mapped, so each query only reads the rows of the users
+    it visits rather than the whole graph. Edges point from each user to the
+    users they follow, whichever follow lists were crawled, so "out" edges go
+    to the users someone follows and "in" edges come from their followers.
+    "both" ignores the direction of edges.
+    """
+
+    def __init__(self, graph: Graph) -> None:
+        self.graph = graph
+
+    @classmethod
+    def from_run(cls, run_dataset: RunDataset, rebuild: bool = False) -> "GraphQuery":
+        """Query the graph of a run, building it from its edges file if needed."""
+        if not run_dataset.edges_path.exists():
+            raise MisconfiguredException(
+                f"No edges file found for run {run_dataset.run_id}. "
+                "Run crawl-stats with --write-edges, or snapshot, first."
+            )
+        return cls(Graph.from_run(run_dataset, rebuild=rebuild))
+
+    def neighborhood(
+        self,
+        user_id: int,
+        hops: int = 1,
+        direction: Direction = "out",
+        linked_to: int | None = None,
+    ) -> pa.Table:
+        """Get the users within `hops` edges of a user, with their distance.
+
+        The user themselves is left out. If `linked_to` is given, only users
+        with an edge to that user are kept, such as the people in someone's
+        2-hop network who follow an account.
+        """
+        node = self._node(user_id)
+        visited = np.array([node], dtype=np.int64)
+        frontier = visited
+        found, distances = [], []
+        for distance in range(1, hops + 1):
+            frontier = np.setdiff1d(
+                self._neighbors(frontier, direction), visited, assume_unique=True
+            )
+            if len(frontier) == 0:
+                break
+            visited = np.union1d(visited, frontier)
+            found.append(frontier)
+            distances.append(np.full(len(frontier), distance, dtype=np.int8))
+        nodes = np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+        distances = np.concatenate(distances) if found else np.empty(0, dtype=np.int8)
+        if linked_to is not None:
+            linkers = self._neighbors(np.array([self._node(linked_to)]), "in")
+            keep = np.isin(nodes, linkers)
+            nodes, distances = nodes[keep], distances[keep]
+        return pa.table(
+            [pa.array(self.graph.ids[nodes]), pa.array(distances)],
+            schema=NEIGHBORHOOD_SCHEMA,
+        )
+
+    def mutual_follows(self, user_id: int) -> np.ndarray:
+        """Get the sorted users with edges both to and from a user."""
+        nodes = np.array([self._node(user_id)])
+        mutual = np.intersect1d(
+            self._neighbors(nodes, "out"), self._neighbors(nodes, "in")
+        )
+        return self.graph.ids[mutual]
+
+    def common_neighbors(
+        self, user_id: int, other_user_id: int, direction: Direction = "out"
+    ) -> np.ndarray:
+        """Get the sorted users that are neighbors of both users."""
+        common = np.intersect1d(
+            self._neighbors(np.array([self._node(user_id)]), direction),
+            self._neighbors(np.array([self._node(other_user_id)]), direction),
+        )
+        return self.graph.ids[common]
+
+    def shortest_path(
+        self, source_user_id: int, target_user_id: int, direction: Direction = "out"
+    ) -> list[int] | None:
+        """Get the users on a shortest path between two users, or None if none.
+
+        Searches breadth first from both ends at once, always growing the
+        smaller side, so only the neighborhoods around the two users are read
+        rather than everything within the path's length of the source.
+        """
+        source, target = self._node(source_user_id), self._node(target_user_id)
+        reverse = {"out": "in", "in": "out", "both": "both"}[direction]
+        # parents and distances of the nodes reached from each end
+        sides = [
+            ({source: -1}, {source: 0}, np.array([source]), direction),
+            ({target: -1}, {target: 0}, np.array([target]), reverse),
+        ]
+        meeting = None
+        if source == target:
+            meeting = source
+        while meeting is None and len(sides[0][2]) and len(sides[1][2]):
+            side = 0 if len(sides[0][2]) <= len(sides[1][2]) else 1
+            parents, distances, frontier, side_direction = sides[side]
+            other_distances = sides[1 - side][1]
+            sources, targets = self._edges(frontier, side_direction)
+            new = ~np.isin(targets, np.fromiter(parents, dtype=np.int64))
+            targets, index = np.unique(targets[new], return_index=True)
+            sources = sources[new][index]
+            distance = distances[int(frontier[0])] + 1
+            for node, parent in zip(targets.tolist(), sources.tolist()):
+                parents[node] = parent
+                distances[node] = distance
+            sides[side] = (parents, distances, targets, side_direction)
+            reached = [node for node in targets.tolist() if node in other_distances]
+            if reached:
+                meeting = min(reached, key=other_distances.get)
+        if meeting is None:
+            return None
+        path = _walk(sides[0][0], meeting)[::-1] + _walk(sides[1][0], meeting)[1:]
+        return self.graph.ids[path].tolist()
+
+    def _node(self, user_id: int) -> int:
+        [node] = self.graph.node_index([user_id])
+        if node < 0:
+            raise MisconfiguredException(f"User {user_id} isn't in the graph.")
+        return int(node)
+
+    def _neighbors(self, nodes: np.ndarray, direction: Direction) -> np.ndarray:
+        """Get the sorted, distinct neighbors of nodes."""
+        return np.unique(self._edges(nodes, direction)[1])
+
+    def _edges(
+        self, nodes: np.ndarray, direction: Direction
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Get the edges from nodes, as arrays of nodes and their neighbors."""
+        reverses = {"out": [False], "in": [True], "both": [False, True]}[direction]
+        sources, targets = zip(
+            *(self.graph.edges_of(nodes, reverse=reverse) for reverse in reverses)
+        )
+        return np.concatenate(sources), np.concatenate(targets)
+
+
+def _walk(parents: dict[int, int], node: int) -> list[int]:
+    """Follow parents from a node back to the end a search started at."""
+    path = [node]
+    while (node := parents[node]) != -1:
+        path.append(node)
+    return path
@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import math
+import time
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+
+from .metrics import RATE_LIMIT_WAIT_SECONDS
+
+logger = logging.getLogger(__package__)
+
+
+def get_retry_after(headers: Mapping[str, str]) -> float | None:
+    """Seconds to wait from a Retry-After header, given in seconds or as a date."""
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimitBudget:
+    """Request budget for one Twitter API rate-limit window.
+
+    The budget starts out as a local estimate of `limit` requests per
+    `window` seconds, and is corrected from the `x-rate-limit-remaining` and
+    `x-rate-limit-reset` headers of every response, so requests are only held
+    back when the API reports the window is actually used up.
+
+    Acquiring is not guarded by a lock: instances are shared between tasks on
+    a single event loop, and `reserve` never yields to the loop.
+    """
+
+    def __init__(self, limit: int = 15, window: float = 15 * 60) -> None:
+        self.limit = limit
+        self.window = window
+        self.remaining = limit
+        self.reset_at: float | None = None
+
+    def available(self, now: float | None = None) -> int:
+        """Number of requests that can be made now, without taking any."""
+        now = time.time() if now is None else now
+        if self.reset_at is not None and now >= self.reset_at:
+            return self.limit
+        return self.remaining
+
+    def wait_time(self, now: float | None = None) -> float:
+        """Seconds until a request can be made, without taking one."""
+        now = time.time() if now is None else now
+        if self.available(now) > 0:
+            return 0
+        return self.reset_at - now
+
+    def reserve(self, now: float | None = None) -> float:
+        """Take one request from the budget if possible.
+
+        Returns 0 if a request was taken, otherwise the number of seconds until
+        the current window resets.
+        """
+        now = time.time() if now is None else now
+        if self.reset_at is not None and now >= self.reset_at:
+            self.remaining = self.limit
+            self.reset_at = None
+        if self.remaining > 0:
+            self.remaining -= 1
+            if self.reset_at is None:
+                self.reset_at = now + self.window
+            return 0
+        return self.reset_at - now
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        """Correct the budget from the rate-limit headers of a response."""
+        remaining = headers.get("x-rate-limit-remaining")
+        reset = headers.get("x-rate-limit-reset")
+        if remaining is None or reset is None:
+            return
+        remaining, reset_at = int(remaining), float(reset)
+        if self.reset_at is None or reset_at > self.reset_at + 1:
+            # the API has started a new window since our estimate was made
+            self.remaining = remaining
+        else:
+            # requests still in flight were already taken from local budget
+            self.remaining = min(self.remaining, remaining)
+        self.reset_at = reset_at
+
+    def exhaust(self, headers: Mapping[str, str]) -> None:
+        """Mark the budget as spent, after the API rejected a request.
+
+        The budget resets when the rate-limit headers say it does, or after
+        any Retry-After, whichever is later, and otherwise after a window.
+        """
+        self.update(headers)
+        self.remaining = 0
+        retry_after = get_retry_after(headers)
+        if retry_after is not None:
+            self.reset_at = max(self.reset_at or 0, time.time() + retry_after)
+        if self.reset_at is None:
+            self.reset_at = time.time() + self.window
+
+
+@dataclass
+class Credential:
+    """A bearer token with its own rate-limit budget and usage counters."""
+
+    token: str
+    budget: RateLimitBudget
+    requests: int = 0
+    rate_limited: int = 0
+    wait_seconds: float = 0
+
+    @property
+    def name(self) -> str:
+        """Identifies the token in logs without revealing it."""
+        return f"...{self.token[-4:]}"
+
+    @property
+    def headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.token}"}
+
+
+@dataclass
+class CredentialPool:
+    """Schedules requests across several bearer tokens.
+
+    Each token has its own rate limit, so requests are sent with whichever
+    token has budget available soonest, and throughput grows with the number
+    of tokens in the pool. `name` labels the pool's metrics.
+    """
+
+    credentials: list[Credential] = field(default_factory=list)
+    name: str = "follows"
+
+    @classmethod
+    def from_tokens(
+        cls,
+        tokens: list[str],
+        limit: int = 15,
+        window: float = 15 * 60,
+        name: str = "follows",
+    ) -> "CredentialPool":
+        return cls(
+            [Credential(token, RateLimitBudget(limit, window)) for token in tokens],
+            name=name,
+        )
+
+    def wait_time(self) -> float:
+        """Seconds until any token in the pool can make a request."""
+        now = time.time()
+        return min(credential.budget.wait_time(now) for credential in self.credentials)
+
+    def projected_time(self, requests: int) -> float:
+        """Seconds it would take to make `requests` more requests with the pool.
+
+        Requests the tokens have budget for are made straight away, and the
+        rest at the full limit of every token in each window after the next
+        reset. Time spent on the requests themselves is ignored.
+        """
+        now = time.time()
+        requests -= sum(
+            credential.budget.available(now) for credential in self.credentials
+        )
+        if requests <= 0:
+            return 0.0
+        budgets = [credential.budget for credential in self.credentials]
+        next_reset = min(
+            budget.reset_at - now
+            if budget.reset_at is not None and budget.reset_at > now
+            else budget.window
+            for budget in budgets
+        )
+        windows = math.ceil(requests / sum(budget.limit for budget in budgets))
+        return next_reset + (windows - 1) * max(budget.window for budget in budgets)
+
+    async def acquire(self) -> Credential:
+        """Wait for a token with budget left, and take a request from it."""
+        waited = 0
+        while True:
+            now = time.time()
+            credential = min(
+                self.credentials,
+                key=lambda c: (c.budget.wait_time(now), -c.budget.available(now)),
+            )
+            if (wait := credential.budget.reserve(now)) == 0:
+                credential.requests += 1
+                credential.wait_seconds += waited
+                RATE_LIMIT_WAIT_SECONDS.observe(waited, pool=self.name)
+                return credential
+            logger.info("All credentials rate limited, waiting %.0f seconds", wait)
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def usage(self) -> list[dict]:
+        """Per-token counters, for reporting how evenly work was spread."""
+        return [
+            {
+                "credential": credential.name,
+                "requests": credential.requests,
+                "rate_limited": credential.rate_limited,
+                "wait_seconds": round(credential.wait_seconds, 1),
+                "remaining": credential.budget.remaining,
+            }
+            for credential in self.credentials
+        ]
@@ -0,0 +1,100 @@
+import heapq
+import itertools
+import logging
+import math
+from pathlib import Path
+
+from .data_utils import get_crawl_edges, read_user_id_file
+from .types import CrawlEdge, SchedulerPolicy
+
+logger = logging.getLogger(__package__)
+
+
+def read_exclusion_file(path: Path | None) -> set[int]:
+    """Read user IDs to never expand, one per line, ignoring # comments."""
+    if path is None or not path.exists():
+        return set()
+    user_ids = set(read_user_id_file(path))
+    logger.info("Excluding %d users listed in %s", len(user_ids), path)
+    return user_ids
+
+
+class FrontierScheduler:
+    """Decides which user in a frontier to expand next, using a heap.
+
+    With the rate limit allowing so few requests, the order users are expanded
+    in decides how much of the graph is covered before the budget runs out.
+    Policies are:
+
+    bfs           -- expand users in the order they were discovered.
+    fewest_edges  -- expand users with the fewest connections of the edge types
+                     being crawled first, as they take the fewest pages.
+    most_inlinks  -- expand users linked to by the most already expanded users
+                     first, as they are the most central to the crawl so far.
+
+    Ties, and users whose counts aren't known, fall back to discovery order.
+    Priorities can change while users wait in the heap, so stale entries are
+    left in place and skipped when popped.
+    """
+
+    def __init__(self, policy: SchedulerPolicy = "bfs", edge: CrawlEdge = "following"):
+        self.policy = policy
+        self.count_fields = [f"{edge}_count" for edge in get_crawl_edges(edge)]
+        self.edge_counts: dict[int, int] = {}
+        self.inlinks: dict[int, int] = {}
+        self._heap: list[tuple] = []
+        self._pending: dict[int, tuple] = {}
+        self._sequence = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    @property
+    def needs_profiles(self) -> bool:
+        """Whether profiles of expanded users' connections are used to schedule."""
+        return self.policy == "fewest_edges"
+
+    def push(self, user_id: int) -> None:
+        self._push(user_id, next(self._sequence))
+
+    def pop(self) -> int | None:
+        """Take the user with the highest priority, or None if there are none."""
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            user_id = entry[-1]
+            if self._pending.get(user_id) == entry:
+                del self._pending[user_id]
+                return user_id
+        return None
+
+    def record_expansion(self, user_ids: list[int], users: list[dict] | None) -> None:
+        """Update priorities from the connections of a user that was expanded.
+
+        `users` are the full profiles of the connections, if they were read.
+        """
+        updated = []
+        if self.policy == "most_inlinks":
+            for user_id in user_ids:
+                self.inlinks[user_id] = self.inlinks.get(user_id, 0) + 1
+                updated.append(user_id)
+        elif self.policy == "fewest_edges" and users is not None:
+            for user in users:
+                public_metrics = user.get("public_metrics", {})
+                counts = [public_metrics.get(field) for field in self.count_fields]
+                if None not in counts:
+                    self.edge_counts[int(user["id"])] = sum(counts)
+                    updated.append(int(user["id"]))
+        for user_id in updated:
+            if user_id in self._pending:
+                self._push(user_id, self._pending[user_id][-2])
+
+    def _push(self, user_id: int, sequence: int) -> None:
+        if self.policy == "fewest_edges":
+            priority = self.edge_counts.get(user_id, math.inf)
+        elif self.policy == "most_inlinks":
+            priority = -self.inlinks.get(user_id, 0)
+        else:
+            priority = 0
+        entry = (priority, sequence, user_id)
+        self._pending[user_id] = entry
+        heapq.heappush(self._heap, entry)
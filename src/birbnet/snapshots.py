@@ -0,0 +1,246 @@
+import logging
+from collections.abc import Iterator
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .compression import JSON_EXTENSIONS
+from .data_utils import (
+    EDGES_SCHEMA,
+    RunDataset,
+    get_edge_type_from_path,
+    get_user_id_from_path,
+)
+from .exceptions import MisconfiguredException
+from .stats import (
+    EDGE_TYPES,
+    EDGES_BATCH_SIZE,
+    concatenate_arrays,
+    edges_record_batch,
+    read_user_ids,
+)
+from .storage import write_edge_file
+
+logger = logging.getLogger(__package__)
+
+CHANGES = ["added", "removed"]
+
+CHANGES_SCHEMA = pa.schema(
+    [
+        ("source", pa.int64()),
+        ("target", pa.int64()),
+        ("edge_type", pa.dictionary(pa.int8(), pa.string())),
+        ("change", pa.dictionary(pa.int8(), pa.string())),
+    ]
+)
+
+# file extensions of user files, from full follow lists to deltas
+FULL_EXTENSIONS = [*JSON_EXTENSIONS.values(), "edges.npy"]
+DELTA_EXTENSION = "delta.npy"
+
+
+def diff_edges(old: np.ndarray, new: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Get the sorted user IDs added to and removed from a follow list."""
+    old, new = np.unique(old), np.unique(new)
+    added = np.setdiff1d(new, old, assume_unique=True)
+    removed = np.setdiff1d(old, new, assume_unique=True)
+    return added.astype(np.int64), removed.astype(np.int64)
+
+
+def apply_delta(old: np.ndarray, added: np.ndarray, removed: np.ndarray) -> np.ndarray:
+    """Rebuild a follow list from an earlier one and the changes since, sorted."""
+    kept = np.setdiff1d(np.unique(old), removed, assume_unique=True)
+    return np.union1d(kept, added).astype(np.int64)
+
+
+def write_delta_file(path: Path, added: np.ndarray, removed: np.ndarray) -> None:
+    """Write the changes to a follow list as one sorted int64 .npy file.
+
+    User IDs are positive, so removed users are stored negated, ahead of the
+    added users, keeping the file as small as a follow list of the changes.
+    The file is replaced atomically.
+    """
+    delta = np.concatenate(
+        [-np.asarray(removed, dtype=np.int64)[::-1], np.asarray(added, dtype=np.int64)]
+    )
+    write_edge_file(path, delta)
+
+
+def read_delta_file(path: Path) -> tuple[np.ndarray, np.ndarray]:
+    """Read the sorted user IDs added to and removed from a follow list."""
+    delta = np.load(path)
+    split = np.searchsorted(delta, 0)
+    return delta[split:], -delta[:split][::-1]
+
+
+class RunSnapshot:
+    """The follow lists of every user crawled in a run, at the time it was crawled.
+
+    A recrawl is a run with another run as its baseline, and only stores the
+    users added to and removed from each follow list since the baseline, as a
+    delta file. Baselines can themselves be recrawls, so a chain of weekly
+    recrawls stores one full crawl and then only the changes each week. The
+    full follow lists of any run in the chain are rebuilt by applying deltas
+    to the follow lists of its baseline, and rebuilt lists are sorted.
+
+    A user's follow list is only in a snapshot if the user was crawled in that
+    run. Users in the baseline that the recrawl didn't reach are left out,
+    rather than treated as having no follows.
+    """
+
+    def __init__(self, run_dataset: RunDataset) -> None:
+        self.run_dataset = run_dataset
+        recrawl = run_dataset.read_recrawl_info()
+        self.baseline = None
+        if recrawl is not None:
+            baseline_dataset = RunDataset(
+                recrawl["baseline_run_id"], run_dataset.output_dir_path
+            )
+            self.baseline = RunSnapshot(baseline_dataset)
+
+    @classmethod
+    def as_of(cls, run_dataset: RunDataset, date: datetime) -> "RunSnapshot":
+        """Get the latest snapshot in a run's chain of baselines crawled by `date`."""
+        snapshot = cls(run_dataset)
+        while snapshot is not None:
+            if snapshot.run_dataset.get_created_at() <= date:
+                return snapshot
+            snapshot = snapshot.baseline
+        raise MisconfiguredException(
+            f"No run in the chain of {run_dataset.run_id} was crawled by {date}."
+        )
+
+    @property
+    def run_id(self) -> str:
+        return self.run_dataset.run_id
+
+    def get_user_ids(self, user_id: int, edge: str) -> np.ndarray:
+        """Get the sorted follow list of a user, or an empty one if not crawled."""
+        for extension in [*FULL_EXTENSIONS, DELTA_EXTENSION]:
+            path = self.run_dataset.find_user_path(f"{user_id}_{edge}.{extension}")
+            if path is not None:
+                return np.unique(self.read_user_file(path)).astype(np.int64)
+        return np.empty(0, dtype=np.int64)
+
+    def read_user_file(self, path: Path) -> np.ndarray:
+        """Read the follow list of a user file of this run, in any format.
+
+        The follow list of a delta file is rebuilt from the baseline's.
+        """
+        if not path.name.endswith(DELTA_EXTENSION):
+            return read_user_ids(path)
+        added, removed = read_delta_file(path)
+        return apply_delta(
+            self.get_baseline_user_ids(
+                get_user_id_from_path(path), get_edge_type_from_path(path)
+            ),
+            added,
+            removed,
+        )
+
+    def get_delta_paths(self) -> list[Path]:
+        return self.run_dataset.glob_user_files(f"*.{DELTA_EXTENSION}")
+
+    def get_baseline_user_ids(self, user_id: int, edge: str) -> np.ndarray:
+        if self.baseline is None:
+            return np.empty(0, dtype=np.int64)
+        return self.baseline.get_user_ids(user_id, edge)
+
+    def crawled_users(self) -> list[tuple[int, str]]:
+        """The user IDs and edge types of every follow list crawled in this run."""
+        paths = [*self.run_dataset.get_user_paths(), *self.get_delta_paths()]
+        return sorted(
+            {
+                (get_user_id_from_path(path), get_edge_type_from_path(path))
+                for path in paths
+            }
+        )
+
+    def iter_edges(self) -> Iterator[pa.RecordBatch]:
+        """Yield the edges of every crawled follow list, in record batches."""
+        sources, targets, edge_codes = [], [], []
+        buffered = 0
+        for user_id, edge in self.crawled_users():
+            user_ids = self.get_user_ids(user_id, edge)
+            sources.append(np.full(len(user_ids), user_id, dtype=np.int64))
+            targets.append(user_ids)
+            edge_codes.append(
+                np.full(len(user_ids), EDGE_TYPES.index(edge), dtype=np.int8)
+            )
+            buffered += len(user_ids)
+            if buffered >= EDGES_BATCH_SIZE:
+                yield edges_record_batch(sources, targets, edge_codes)
+                sources, targets, edge_codes = [], [], []
+                buffered = 0
+        if sources:
+            yield edges_record_batch(sources, targets, edge_codes)
+
+    def write_edges(self, path: Path | None = None) -> int:
+        """Write all edges to a Parquet file like crawl-stats, returning how many.
+
+        Defaults to the run's edges file, so the graph of a recrawl can be
+        analysed in the same way as a full crawl.
+        """
+        path = path or self.run_dataset.edges_path
+        edges = 0
+        with pq.ParquetWriter(path, EDGES_SCHEMA, compression="snappy") as writer:
+            for batch in self.iter_edges():
+                writer.write_batch(batch)
+                edges += batch.num_rows
+        return edges
+
+    def read_changes(self) -> pa.Table:
+        """Get every edge added or removed in this run since its baseline."""
+        sources, targets, edge_codes, change_codes = [], [], [], []
+        for path in self.get_delta_paths():
+            user_id = get_user_id_from_path(path)
+            edge_code = EDGE_TYPES.index(get_edge_type_from_path(path))
+            for change_code, user_ids in enumerate(read_delta_file(path)):
+                sources.append(np.full(len(user_ids), user_id, dtype=np.int64))
+                targets.append(user_ids)
+                edge_codes.append(np.full(len(user_ids), edge_code, dtype=np.int8))
+                change_codes.append(np.full(len(user_ids), change_code, dtype=np.int8))
+        return pa.table(
+            [
+                pa.array(concatenate_arrays(sources, np.int64)),
+                pa.array(concatenate_arrays(targets, np.int64)),
+                pa.DictionaryArray.from_arrays(
+                    concatenate_arrays(edge_codes, np.int8), EDGE_TYPES
+                ),
+                pa.DictionaryArray.from_arrays(
+                    concatenate_arrays(change_codes, np.int8), CHANGES
+                ),
+            ],
+            schema=CHANGES_SCHEMA,
+        )
+
+
+def start_recrawl(run_dataset: RunDataset, baseline_run_id: str) -> None:
+    """Record that a run is a recrawl of another, checking it's consistent."""
+    baseline_dataset = RunDataset(baseline_run_id, run_dataset.output_dir_path)
+    if baseline_run_id == run_dataset.run_id:
+        raise MisconfiguredException("A run can't be its own baseline.")
+    if not baseline_dataset.dataset_path.exists():
+        raise MisconfiguredException(f"Baseline run {baseline_run_id} doesn't exist.")
+    recrawl = run_dataset.read_recrawl_info()
+    if recrawl is not None:
+        if recrawl["baseline_run_id"] != baseline_run_id:
+            raise MisconfiguredException(
+                f"Run {run_dataset.run_id} is a recrawl of "
+                f"{recrawl['baseline_run_id']}, not {baseline_run_id}."
+            )
+        return
+    if any(run_dataset.get_user_paths()):
+        raise MisconfiguredException(
+            f"Run {run_dataset.run_id} already has full follow lists, so it "
+            "can't be resumed as a recrawl."
+        )
+    run_dataset.write_recrawl_info(
+        {
+            "baseline_run_id": baseline_run_id,
+            "created_at": datetime.now().astimezone().isoformat(),
+        }
+    )
@@ -0,0 +1,310 @@
+import time
+from array import array
+from collections import deque
+from collections.abc import Callable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .compression import read_compressed
+from .data_utils import (
+    EDGES_SCHEMA,
+    RunDataset,
+    get_edge_type_from_path,
+    get_user_id_from_path,
+)
+from .types import Edge
+
+EDGE_TYPES = list(Edge.__args__)
+
+# number of edges to buffer before writing a record batch to edges.parquet
+EDGES_BATCH_SIZE = 1_000_000
+
+# number of user files read together, either in one go or by a worker process
+FILES_CHUNK_SIZE = 256
+
+
+class SortedIdSet:
+    """A set of int64 IDs stored as sorted numpy arrays.
+
+    IDs are held in a handful of disjoint sorted runs. Each call to `add`
+    appends a run of IDs not seen before, and runs are merged whenever a run
+    grows as large as the one before it, so there are only ever O(log n) runs
+    to search. This takes 8 bytes per ID, where a Python set of ints takes
+    around ten times as much.
+    """
+
+    def __init__(self) -> None:
+        self.runs: list[np.ndarray] = []
+
+    def __len__(self) -> int:
+        return sum(len(run) for run in self.runs)
+
+    def add(self, ids: np.ndarray) -> int:
+        """Add IDs to the set, returning how many were not already in it."""
+        return len(self.add_new(ids))
+
+    def add_new(self, ids: np.ndarray) -> np.ndarray:
+        """Add IDs to the set, returning the sorted IDs not already in it."""
+        new_ids = np.unique(ids)
+        for run in self.runs:
+            if len(new_ids) == 0:
+                break
+            positions = np.minimum(np.searchsorted(run, new_ids), len(run) - 1)
+            new_ids = new_ids[run[positions] != new_ids]
+        if len(new_ids) == 0:
+            return new_ids
+        self.runs.append(new_ids)
+        while len(self.runs) > 1 and len(self.runs[-2]) <= len(self.runs[-1]):
+            last = self.runs.pop()
+            merged = np.concatenate([self.runs.pop(), last])
+            merged.sort(kind="stable")
+            self.runs.append(merged)
+        return new_ids
+
+
+class HyperLogLog:
+    """Estimates the number of distinct int64 IDs using a fixed 2^precision bytes.
+
+    With the default precision the estimate is typically within a couple of
+    percent of the true count.
+    """
+
+    def __init__(self, precision: int = 14) -> None:
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def __len__(self) -> int:
+        num_registers = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / num_registers)
+        estimate = (
+            alpha
+            * num_registers**2
+            / np.sum(np.ldexp(1.0, -self.registers.astype(np.int32)))
+        )
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * num_registers and zeros > 0:
+            estimate = num_registers * np.log(num_registers / zeros)
+        return int(round(estimate))
+
+    def add(self, ids: np.ndarray) -> int:
+        """Add IDs, returning the estimated number that were not seen before."""
+        before = len(self)
+        hashes = _splitmix64(ids.astype(np.uint64))
+        index_bits = np.uint64(64 - self.precision)
+        indices = (hashes >> index_bits).astype(np.intp)
+        remainder = hashes & ((np.uint64(1) << index_bits) - np.uint64(1))
+        ranks = (index_bits - _bit_length(remainder) + np.uint64(1)).astype(np.uint8)
+        np.maximum.at(self.registers, indices, ranks)
+        return max(len(self) - before, 0)
+
+
+def _splitmix64(values: np.ndarray) -> np.ndarray:
+    with np.errstate(over="ignore"):
+        values = values + np.uint64(0x9E3779B97F4A7C15)
+        values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return values ^ (values >> np.uint64(31))
+
+
+def _bit_length(values: np.ndarray) -> np.ndarray:
+    lengths = np.zeros(values.shape, dtype=np.uint64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        shifted = values >> np.uint64(shift)
+        mask = shifted != 0
+        lengths[mask] += np.uint64(shift)
+        values = np.where(mask, shifted, values)
+    return lengths + (values != 0).astype(np.uint64)
+
+
+@dataclass
+class CrawlStats:
+    users_crawled: int
+    nodes: int
+    edges: int
+    mean_edges: float
+    median_edges: float
+    size: int
+    elapsed: float
+
+    @property
+    def files_per_second(self) -> float:
+        return self.users_crawled / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.size / self.elapsed if self.elapsed else 0.0
+
+
+@dataclass
+class UserFilesBatch:
+    """Edges read from a chunk of user files, in the order the files were given."""
+
+    edges: pa.RecordBatch
+    edge_counts: np.ndarray
+    size: int
+
+
+def read_user_ids(user_path: Path) -> np.ndarray:
+    """Read the target user IDs from a user file in either storage format."""
+    if user_path.name.endswith(".npy"):
+        return np.load(user_path)
+    lines = read_compressed(user_path).splitlines()
+    return np.fromiter(
+        (int(orjson.loads(line)["id"]) for line in lines), dtype=np.int64
+    )
+
+
+def read_user_files(
+    user_paths: list[Path],
+    read_ids: Callable[[Path], np.ndarray] = read_user_ids,
+) -> UserFilesBatch:
+    """Read the edges from a list of user files into a single record batch.
+
+    Each file's follow list is read with `read_ids`, such as
+    `RunSnapshot.read_user_file` for the delta files of a recrawl.
+    """
+    sources, targets, edge_codes = [], [], []
+    edge_counts = np.zeros(len(user_paths), dtype=np.int64)
+    size = 0
+    for i, user_path in enumerate(user_paths):
+        user_ids = read_ids(user_path)
+        source_user_id = get_user_id_from_path(user_path)
+        edge_code = EDGE_TYPES.index(get_edge_type_from_path(user_path))
+        sources.append(np.full(len(user_ids), source_user_id, dtype=np.int64))
+        targets.append(user_ids)
+        edge_codes.append(np.full(len(user_ids), edge_code, dtype=np.int8))
+        edge_counts[i] = len(user_ids)
+        size += user_path.stat().st_size
+    edges = edges_record_batch(sources, targets, edge_codes)
+    return UserFilesBatch(edges=edges, edge_counts=edge_counts, size=size)
+
+
+def edges_record_batch(
+    sources: list[np.ndarray], targets: list[np.ndarray], edge_codes: list[np.ndarray]
+) -> pa.RecordBatch:
+    """A record batch of edges, from arrays of sources, targets and edge types.
+
+    Edge types are given as indexes into `EDGE_TYPES`.
+    """
+    return pa.record_batch(
+        [
+            pa.array(concatenate_arrays(sources, np.int64), type=pa.int64()),
+            pa.array(concatenate_arrays(targets, np.int64), type=pa.int64()),
+            pa.DictionaryArray.from_arrays(
+                concatenate_arrays(edge_codes, np.int8), EDGE_TYPES
+            ),
+        ],
+        schema=EDGES_SCHEMA,
+    )
+
+
+def concatenate_arrays(arrays: list[np.ndarray], dtype: type) -> np.ndarray:
+    """Concatenate arrays, or make an empty array of `dtype` if there are none."""
+    return np.concatenate(arrays) if arrays else np.empty(0, dtype=dtype)
+
+
+def iter_user_file_batches(
+    user_paths: list[Path],
+    workers: int = 1,
+    chunk_size: int = FILES_CHUNK_SIZE,
+    read_ids: Callable[[Path], np.ndarray] = read_user_ids,
+) -> Iterator[UserFilesBatch]:
+    """Read user files in chunks, yielding batches in the order of `user_paths`.
+
+    With more than one worker, chunks are parsed in a pool of processes. Only
+    a few chunks per worker are in flight at a time, so results don't pile up
+    in memory when they are consumed more slowly than they are read.
+    """
+    chunks = (
+        user_paths[i : i + chunk_size] for i in range(0, len(user_paths), chunk_size)
+    )
+    if workers <= 1:
+        yield from (read_user_files(chunk, read_ids) for chunk in chunks)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(read_user_files, chunk, read_ids))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def compute_crawl_stats(
+    run_dataset: RunDataset,
+    user_paths: list[Path],
+    write_edges: bool = False,
+    approx_nodes: bool = False,
+    workers: int = 1,
+    progress: Callable[[int], None] | None = None,
+    read_ids: Callable[[Path], np.ndarray] = read_user_ids,
+) -> CrawlStats:
+    """Calculate stats over the user files of a crawl in a single streaming pass.
+
+    Per-user edge and new node counts are written to the run's crawl stats
+    file, and if `write_edges` is True, all edges are written to the run's
+    edges file in record batches as they are read. If `approx_nodes` is True
+    distinct nodes are estimated with a HyperLogLog, using constant memory,
+    rather than counted exactly. Files are parsed by `workers` processes, and
+    `progress` is called with the number of files in each chunk once it has
+    been processed. Follow lists are read with `read_ids`, as for
+    `read_user_files`.
+    """
+    start_time = time.perf_counter()
+    node_ids = HyperLogLog() if approx_nodes else SortedIdSet()
+    edge_counts = array("q")
+    node_counts = array("q")
+    size = 0
+    edges_writer = (
+        pq.ParquetWriter(run_dataset.edges_path, EDGES_SCHEMA, compression="snappy")
+        if write_edges
+        else None
+    )
+    edge_batches = []
+    buffered = 0
+    for batch in iter_user_file_batches(user_paths, workers=workers, read_ids=read_ids):
+        targets = batch.edges.column("target").to_numpy()
+        offset = 0
+        for edge_count in batch.edge_counts:
+            node_counts.append(node_ids.add(targets[offset : offset + edge_count]))
+            offset += edge_count
+        edge_counts.extend(batch.edge_counts.tolist())
+        size += batch.size
+        if edges_writer is not None:
+            edge_batches.append(batch.edges)
+            buffered += batch.edges.num_rows
+            if buffered >= EDGES_BATCH_SIZE:
+                edges_writer.write_table(pa.Table.from_batches(edge_batches))
+                edge_batches = []
+                buffered = 0
+        if progress is not None:
+            progress(len(batch.edge_counts))
+    if edges_writer is not None:
+        if edge_batches:
+            edges_writer.write_table(pa.Table.from_batches(edge_batches))
+        edges_writer.close()
+
+    stats_table = pa.table(
+        {
+            "nodes_counts": pa.array(node_counts, type=pa.int64()),
+            "edge_counts": pa.array(edge_counts, type=pa.int64()),
+        }
+    )
+    pq.write_table(stats_table, run_dataset.crawl_stats_path, compression="snappy")
+    counts = np.frombuffer(edge_counts, dtype=np.int64)
+    return CrawlStats(
+        users_crawled=len(counts),
+        nodes=len(node_ids),
+        edges=int(counts.sum()),
+        mean_edges=float(counts.mean()) if len(counts) else 0.0,
+        median_edges=float(np.median(counts)) if len(counts) else 0.0,
+        size=size,
+        elapsed=time.perf_counter() - start_time,
+    )
@@ -0,0 +1,370 @@
+import fcntl
+import logging
+from pathlib import Path
+from typing import BinaryIO
+
+import numpy as np
+import orjson
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from .data_utils import RunDataset
+from .metrics import BYTES_WRITTEN
+from .stats import SortedIdSet
+
+logger = logging.getLogger(__package__)
+
+PROFILE_SCHEMA = pa.schema(
+    [
+        ("id", pa.int64()),
+        ("username", pa.string()),
+        ("name", pa.string()),
+        ("description", pa.string()),
+        ("created_at", pa.timestamp("ms", tz="UTC")),
+        ("location", pa.string()),
+        ("url", pa.string()),
+        ("profile_image_url", pa.string()),
+        ("pinned_tweet_id", pa.string()),
+        ("verified", pa.bool_()),
+        ("protected", pa.bool_()),
+        ("followers_count", pa.int64()),
+        ("following_count", pa.int64()),
+        ("tweet_count", pa.int64()),
+        ("listed_count", pa.int64()),
+        # nested objects are kept as JSON so that no fields are lost
+        ("entities", pa.string()),
+        ("withheld", pa.string()),
+    ]
+)
+
+STRING_FIELDS = [
+    "username",
+    "name",
+    "description",
+    "location",
+    "url",
+    "profile_image_url",
+    "pinned_tweet_id",
+]
+METRIC_FIELDS = ["followers_count", "following_count", "tweet_count", "listed_count"]
+JSON_FIELDS = ["entities", "withheld"]
+
+
+def users_to_record_batch(users: list[dict]) -> pa.RecordBatch:
+    """Convert user objects from the API into a record batch of profiles."""
+    metrics = [user.get("public_metrics", {}) for user in users]
+    columns = {
+        "id": pa.array([int(user["id"]) for user in users], type=pa.int64()),
+        "created_at": pc.cast(
+            pa.array([user.get("created_at") for user in users], type=pa.string()),
+            pa.timestamp("ms", tz="UTC"),
+        ),
+        "verified": pa.array([user.get("verified") for user in users], pa.bool_()),
+        "protected": pa.array([user.get("protected") for user in users], pa.bool_()),
+    }
+    for field in STRING_FIELDS:
+        columns[field] = pa.array([user.get(field) for user in users], pa.string())
+    for field in METRIC_FIELDS:
+        columns[field] = pa.array([m.get(field) for m in metrics], pa.int64())
+    for field in JSON_FIELDS:
+        columns[field] = pa.array(
+            [
+                orjson.dumps(user[field]).decode() if field in user else None
+                for user in users
+            ],
+            pa.string(),
+        )
+    return pa.record_batch(
+        [columns[name] for name in PROFILE_SCHEMA.names], schema=PROFILE_SCHEMA
+    )
+
+
+def profiles_to_users(profiles: pa.Table | pa.RecordBatch) -> list[dict]:
+    """Convert profiles back into user objects shaped like API responses."""
+    users = []
+    for row in profiles.to_pylist():
+        user = {"id": str(row["id"])}
+        if row["created_at"] is not None:
+            user["created_at"] = row["created_at"].strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        for field in STRING_FIELDS + ["verified", "protected"]:
+            if row[field] is not None:
+                user[field] = row[field]
+        user["public_metrics"] = {
+            field: row[field] for field in METRIC_FIELDS if row[field] is not None
+        }
+        for field in JSON_FIELDS:
+            if row[field] is not None:
+                user[field] = orjson.loads(row[field])
+        users.append(user)
+    return users
+
+
+def write_edge_file(path: Path, user_ids: np.ndarray) -> None:
+    """Write target user IDs as an int64 .npy file, replacing it atomically."""
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, np.asarray(user_ids, dtype=np.int64))
+    tmp_path.replace(path)
+
+
+def read_edge_file(path: Path) -> np.ndarray:
+    """Memory map the target user IDs in an edge file."""
+    return np.load(path, mmap_mode="r")
+
+
+class ProfileIndex:
+    """The part and row of each profile in a store, by user ID.
+
+    Like `SortedIdSet`, IDs are held in sorted runs that are merged whenever a
+    run grows as large as the one before it. The part and row of each ID are
+    packed into an int64 alongside it, so this takes 16 bytes per profile.
+    """
+
+    def __init__(self) -> None:
+        self.runs: list[tuple[np.ndarray, np.ndarray]] = []
+
+    def add(self, ids: np.ndarray, part: int, rows: np.ndarray) -> None:
+        """Add the rows of a part holding IDs that aren't already in the index."""
+        if len(ids) == 0:
+            return
+        order = np.argsort(ids, kind="stable")
+        locations = (np.int64(part) << 32) | np.asarray(rows, dtype=np.int64)
+        self.runs.append((ids[order], locations[order]))
+        while len(self.runs) > 1 and len(self.runs[-2][0]) <= len(self.runs[-1][0]):
+            last_ids, last_locations = self.runs.pop()
+            run_ids, run_locations = self.runs.pop()
+            merged_ids = np.concatenate([run_ids, last_ids])
+            order = np.argsort(merged_ids, kind="stable")
+            merged_locations = np.concatenate([run_locations, last_locations])
+            self.runs.append((merged_ids[order], merged_locations[order]))
+
+    def find(self, ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Get the parts and rows of IDs, with a part of -1 for unknown IDs."""
+        locations = np.full(len(ids), -1, dtype=np.int64)
+        for run_ids, run_locations in self.runs:
+            positions = np.minimum(np.searchsorted(run_ids, ids), len(run_ids) - 1)
+            found = run_ids[positions] == ids
+            locations[found] = run_locations[positions[found]]
+        parts = np.where(locations < 0, -1, locations >> 32)
+        return parts, locations & 0xFFFFFFFF
+
+
+class ProfileStore:
+    """Deduplicated profiles of all users seen in a run, as Arrow IPC files.
+
+    Profiles are appended one record batch per page to a part file, which is
+    finished once it reaches `rows_per_part` rows or the store is closed.
+    Finished parts are read through memory maps, so reading them doesn't copy
+    any data, and the batches of the open part are kept in memory until it's
+    finished. A part left unfinished by a crashed process is recovered up to
+    its last complete batch when the store is next opened.
+
+    The part and row of each profile are kept in an index, so looking up
+    profiles only reads the rows needed, including those in the open part.
+    Parts finished by other writers since the store was opened are added to
+    the index when a lookup doesn't find every user.
+
+    Several processes can add to the same store if each is given its own
+    `writer_id`, which goes in the names of the parts it writes. Unfinished
+    parts are locked while they are written, so only parts left by processes
+    that have died are recovered.
+    """
+
+    def __init__(
+        self,
+        run_dataset: RunDataset,
+        rows_per_part: int = 100_000,
+        writer_id: str | None = None,
+    ):
+        self.path = run_dataset.profiles_path
+        self.rows_per_part = rows_per_part
+        self.part_prefix = "part-" if writer_id is None else f"part-{writer_id}-"
+        self.path.mkdir(parents=True, exist_ok=True)
+        for tmp_path in sorted(self.path.glob("*.arrow.tmp")):
+            self._recover_part(tmp_path)
+        self.ids = SortedIdSet()
+        self._index = ProfileIndex()
+        # finished parts, memory mapped, then the batches of the open part
+        self._parts: list[pa.Table | list[pa.RecordBatch]] = []
+        self._indexed_paths: set[Path] = set()
+        self._writer: pa.ipc.RecordBatchFileWriter | None = None
+        self._part_file: BinaryIO | None = None
+        self._part_path: Path | None = None
+        self._part_rows = 0
+        self._open_part_index: int | None = None
+        self._index_new_parts()
+
+    def __enter__(self) -> "ProfileStore":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def part_paths(self) -> list[Path]:
+        return sorted(self.path.glob("part-*.arrow"))
+
+    def add(self, users: list[dict]) -> int:
+        """Store profiles of users not already in the store, returning how many."""
+        if not users:
+            return 0
+        batch = users_to_record_batch(users)
+        page_ids = batch.column("id").to_numpy()
+        new_ids = self.ids.add_new(page_ids)
+        if len(new_ids) == 0:
+            return 0
+        # a page can list the same user more than once, so keep the first row
+        unique_ids, first_rows = np.unique(page_ids, return_index=True)
+        batch = batch.take(np.sort(first_rows[np.isin(unique_ids, new_ids)]))
+        if self._writer is None:
+            self._open_part()
+        self._writer.write_batch(batch)
+        BYTES_WRITTEN.inc(batch.nbytes, kind="profiles")
+        self._parts[self._open_part_index].append(batch)
+        self._index.add(
+            batch.column("id").to_numpy(),
+            self._open_part_index,
+            np.arange(self._part_rows, self._part_rows + batch.num_rows),
+        )
+        self._part_rows += batch.num_rows
+        if self._part_rows >= self.rows_per_part:
+            self._close_part()
+        return batch.num_rows
+
+    def read_table(self) -> pa.Table:
+        """Read all finished parts, memory mapped."""
+        tables = [_read_part(part_path) for part_path in self.part_paths()]
+        if not tables:
+            return PROFILE_SCHEMA.empty_table()
+        return pa.concat_tables(tables)
+
+    def lookup(self, user_ids: np.ndarray) -> pa.Table:
+        """Get the profiles of users, in the order given, skipping unknown users."""
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        parts, rows = self._index.find(user_ids)
+        if np.any(parts < 0) and self._index_new_parts():
+            parts, rows = self._index.find(user_ids)
+        found = parts >= 0
+        parts, rows = parts[found], rows[found]
+        # take the rows of each part in turn, then put them back in order
+        order = np.argsort(parts, kind="stable")
+        tables = []
+        for part in np.unique(parts):
+            part_rows = rows[order[parts[order] == part]]
+            tables.append(self._read_indexed_part(part).take(part_rows))
+        if not tables:
+            return PROFILE_SCHEMA.empty_table()
+        return pa.concat_tables(tables).take(np.argsort(order))
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._close_part()
+
+    def _create_part_file(self) -> tuple[Path, BinaryIO]:
+        """Create and lock the unfinished file for a new part, with a free name."""
+        index = 0
+        while True:
+            part_path = self.path / f"{self.part_prefix}{index:05d}.arrow"
+            tmp_path = part_path.with_name(f"{part_path.name}.tmp")
+            if not part_path.exists():
+                try:
+                    # unbuffered, so each batch is on disk as soon as it's
+                    # written, and can be recovered if the process dies
+                    part_file = open(tmp_path, "xb", buffering=0)
+                except FileExistsError:
+                    pass
+                else:
+                    fcntl.flock(part_file, fcntl.LOCK_EX)
+                    return part_path, part_file
+            index += 1
+
+    def _open_part(self) -> None:
+        self._part_path, self._part_file = self._create_part_file()
+        self._writer = pa.ipc.new_file(self._part_file, PROFILE_SCHEMA)
+        self._part_rows = 0
+        self._open_part_index = len(self._parts)
+        self._parts.append([])
+
+    def _close_part(self) -> None:
+        self._writer.close()
+        tmp_path = self._part_path.with_name(f"{self._part_path.name}.tmp")
+        # renamed before unlocking, so the part is never recovered as unfinished
+        tmp_path.replace(self._part_path)
+        self._part_file.close()
+        # the rows are in the same order in the finished part, so the index
+        # still points at them once it replaces the batches held in memory
+        self._parts[self._open_part_index] = _read_part(self._part_path)
+        self._indexed_paths.add(self._part_path)
+        self._open_part_index = None
+        self._writer = None
+        self._part_file = None
+        self._part_path = None
+
+    def _index_new_parts(self) -> bool:
+        """Index finished parts not yet in the index, returning if there were any."""
+        new_paths = [
+            part_path
+            for part_path in self.part_paths()
+            if part_path not in self._indexed_paths
+        ]
+        for part_path in new_paths:
+            table = _read_part(part_path)
+            part_ids = table.column("id").to_numpy()
+            # another writer may have stored some of the same users, so only
+            # the first row of each user not already in the store is indexed
+            new_ids = self.ids.add_new(part_ids)
+            unique_ids, first_rows = np.unique(part_ids, return_index=True)
+            new_rows = np.sort(first_rows[np.isin(unique_ids, new_ids)])
+            self._index.add(part_ids[new_rows], len(self._parts), new_rows)
+            self._parts.append(table)
+            self._indexed_paths.add(part_path)
+        return bool(new_paths)
+
+    def _read_indexed_part(self, part: int) -> pa.Table:
+        table = self._parts[part]
+        if isinstance(table, list):
+            return pa.Table.from_batches(table, schema=PROFILE_SCHEMA)
+        return table
+
+    def _recover_part(self, tmp_path: Path) -> None:
+        try:
+            lock_file = open(tmp_path, "rb")
+        except FileNotFoundError:
+            return
+        with lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # another process is still writing this part
+                return
+            # an empty file may have just been created by another process,
+            # which hasn't locked it yet
+            if not tmp_path.exists() or tmp_path.stat().st_size == 0:
+                return
+            self._recover_locked_part(tmp_path)
+
+    def _recover_locked_part(self, tmp_path: Path) -> None:
+        # an unfinished IPC file is a stream of batches after an 8 byte magic
+        # number, it's only missing the footer written on close
+        batches = []
+        with pa.memory_map(str(tmp_path)) as source:
+            source.seek(8)
+            try:
+                reader = pa.ipc.open_stream(source)
+                for batch in reader:
+                    batches.append(batch)
+            except (pa.ArrowInvalid, OSError):
+                pass
+        logger.info("Recovered %d batches from %s", len(batches), tmp_path.name)
+        if batches:
+            part_path, part_file = self._create_part_file()
+            with part_file:
+                with pa.ipc.new_file(part_file, PROFILE_SCHEMA) as writer:
+                    for batch in batches:
+                        writer.write_batch(batch)
+                part_file.flush()
+                part_path.with_name(f"{part_path.name}.tmp").replace(part_path)
+        tmp_path.unlink()
+
+
+def _read_part(part_path: Path) -> pa.Table:
+    return pa.ipc.open_file(pa.memory_map(str(part_path))).read_all()
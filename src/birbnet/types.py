@@ -1,3 +1,20 @@
 from typing import Literal
 
 Edge = Literal["following", "followers"]
+
+# edges a crawl can follow, with "both" crawling following and followers at once
+CrawlEdge = Literal["following", "followers", "both"]
+
+Direction = Literal["out", "in", "both"]
+
+DateInterval = Literal["day", "week", "month", "year"]
+
+StorageFormat = Literal["json", "columnar"]
+
+Compression = Literal["gzip", "zstd"]
+
+SchedulerPolicy = Literal["bfs", "fewest_edges", "most_inlinks"]
+
+LargeUserPolicy = Literal["sample", "skip"]
+
+Benchmark = Literal["crawl", "fetch_users", "crawl_stats", "make_db"]
@@ -1,5 +1,14 @@
 from .exceptions import MisconfiguredException
-from .types import Edge
+from .types import (
+    Compression,
+    CrawlEdge,
+    DateInterval,
+    Direction,
+    Edge,
+    LargeUserPolicy,
+    SchedulerPolicy,
+    StorageFormat,
+)
 
 
 def validate_user_id(value: str):
@@ -14,3 +23,64 @@ def validate_edge(value: str):
     if value not in Edge.__args__:
         raise MisconfiguredException(f"Edge type must be one of {Edge.__args__}.")
     return value
+
+
+def validate_crawl_edge(value: str):
+    """Checks if the edges a crawl follows are valid."""
+    if value not in CrawlEdge.__args__:
+        raise MisconfiguredException(
+            f"Crawl edge type must be one of {CrawlEdge.__args__}."
+        )
+    return value
+
+
+def validate_direction(value: str):
+    """Checks if a direction of edges to follow in graph queries is valid."""
+    if value not in Direction.__args__:
+        raise MisconfiguredException(f"Direction must be one of {Direction.__args__}.")
+    return value
+
+
+def validate_date_interval(value: str):
+    """Checks if an interval to group dates by is valid."""
+    if value not in DateInterval.__args__:
+        raise MisconfiguredException(
+            f"Date interval must be one of {DateInterval.__args__}."
+        )
+    return value
+
+
+def validate_storage_format(value: str):
+    """Checks if a storage format is valid."""
+    if value not in StorageFormat.__args__:
+        raise MisconfiguredException(
+            f"Storage format must be one of {StorageFormat.__args__}."
+        )
+    return value
+
+
+def validate_compression(value: str | None):
+    """Checks if a compression for JSON user files is valid, if one is given."""
+    if value is not None and value not in Compression.__args__:
+        raise MisconfiguredException(
+            f"Compression must be one of {Compression.__args__}."
+        )
+    return value
+
+
+def validate_scheduler_policy(value: str):
+    """Checks if a crawl scheduler policy is valid."""
+    if value not in SchedulerPolicy.__args__:
+        raise MisconfiguredException(
+            f"Scheduler policy must be one of {SchedulerPolicy.__args__}."
+        )
+    return value
+
+
+def validate_large_user_policy(value: str):
+    """Checks if a policy for users over the follow budget is valid."""
+    if value not in LargeUserPolicy.__args__:
+        raise MisconfiguredException(
+            f"Large user policy must be one of {LargeUserPolicy.__args__}."
+        )
+    return value
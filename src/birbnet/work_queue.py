@@ -0,0 +1,182 @@
+import logging
+import sqlite3
+import threading
+import time
+from collections import Counter
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from .data_utils import RunDataset
+
+logger = logging.getLogger(__package__)
+
+
+class WorkQueue:
+    """A durable queue of users to expand, shared by crawl workers of a run.
+
+    The queue is a SQLite database in the run's dataset directory. Workers
+    claim users by taking a lease on them, and either mark them done, adding
+    the users they link to, or let the lease expire if they die, at which point
+    the user is put back in the queue for another worker to claim. Users are
+    claimed in order of depth, so the crawl proceeds roughly breadth first.
+    Every change is made in its own transaction, so workers on one machine can
+    share the queue safely. Methods can be called from any thread, such as
+    with `asyncio.to_thread` so waiting for another worker's transaction
+    doesn't block an event loop, and calls are run one at a time.
+    """
+
+    def __init__(
+        self, run_dataset: RunDataset, max_depth: int, lease_seconds: float = 300
+    ) -> None:
+        self.path = run_dataset.queue_path
+        self.max_depth = max_depth
+        self.lease_seconds = lease_seconds
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(
+            self.path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self._lock = threading.Lock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS queue (
+                user_id INTEGER PRIMARY KEY,
+                depth INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker_id TEXT,
+                lease_expires REAL
+            )
+            """
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS queue_status ON queue (status, depth)"
+        )
+
+    def __enter__(self) -> "WorkQueue":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def seed(self, user_id: int) -> None:
+        """Add the user a crawl starts at, if the queue is new."""
+        self.conn.execute(
+            "INSERT OR IGNORE INTO queue (user_id, depth) VALUES (?, 0)", [user_id]
+        )
+
+    def claim(self, worker_id: str, limit: int = 1) -> list[tuple[int, int]]:
+        """Lease up to `limit` users for a worker, returning their IDs and depths.
+
+        Users whose leases have expired are put back in the queue first.
+        """
+        now = time.time()
+        with self._transaction():
+            requeued = self.conn.execute(
+                """
+                UPDATE queue SET status = 'pending', worker_id = NULL
+                WHERE status = 'leased' AND lease_expires < ?
+                """,
+                [now],
+            ).rowcount
+            if requeued:
+                logger.info("Requeued %d users with expired leases", requeued)
+            claimed = self.conn.execute(
+                """
+                UPDATE queue SET status = 'leased', worker_id = ?, lease_expires = ?
+                WHERE user_id IN (
+                    SELECT user_id FROM queue WHERE status = 'pending'
+                    ORDER BY depth, rowid LIMIT ?
+                )
+                RETURNING user_id, depth
+                """,
+                [worker_id, now + self.lease_seconds, limit],
+            ).fetchall()
+        return sorted(claimed, key=lambda row: row[1])
+
+    def renew(self, worker_id: str) -> None:
+        """Extend the leases held by a worker, while it is still working on them."""
+        with self._lock:
+            self.conn.execute(
+                """
+                UPDATE queue SET lease_expires = ?
+                WHERE status = 'leased' AND worker_id = ?
+                """,
+                [time.time() + self.lease_seconds, worker_id],
+            )
+
+    def complete(
+        self,
+        worker_id: str,
+        user_id: int,
+        depth: int,
+        linked_user_ids: list[int],
+        status: str = "done",
+    ) -> int:
+        """Mark a user leased by a worker as expanded and queue the users it links to.
+
+        Linked users already in the queue at a greater depth are moved up to
+        this one, as claims can complete out of order. Returns the number of
+        users added or moved up. If the worker's lease expired and the user
+        was claimed again, nothing is changed, and the other worker queues the
+        linked users instead.
+        """
+        with self._transaction():
+            completed = self.conn.execute(
+                """
+                UPDATE queue SET status = ?, worker_id = NULL, lease_expires = NULL
+                WHERE user_id = ? AND status = 'leased' AND worker_id = ?
+                """,
+                [status, user_id, worker_id],
+            ).rowcount
+            if not completed:
+                logger.warning(
+                    "Lease on user %s was lost by worker %s", user_id, worker_id
+                )
+                return 0
+            if depth + 1 >= self.max_depth or not linked_user_ids:
+                return 0
+            before = self.conn.total_changes
+            self.conn.executemany(
+                """
+                INSERT INTO queue (user_id, depth) VALUES (?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET depth = excluded.depth
+                WHERE excluded.depth < queue.depth AND queue.status = 'pending'
+                """,
+                [(linked_user_id, depth + 1) for linked_user_id in linked_user_ids],
+            )
+            return self.conn.total_changes - before
+
+    def release(self, worker_id: str) -> None:
+        """Put back the users leased by a worker that is stopping early."""
+        with self._lock:
+            self.conn.execute(
+                """
+                UPDATE queue SET status = 'pending', worker_id = NULL
+                WHERE status = 'leased' AND worker_id = ?
+                """,
+                [worker_id],
+            )
+
+    def counts(self) -> Counter:
+        """Number of users with each status."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT status, count(*) FROM queue GROUP BY status"
+            ).fetchall()
+        return Counter(dict(rows))
+
+    def close(self) -> None:
+        self.conn.close()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can't
+        # both read the same pending users before either has claimed them
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
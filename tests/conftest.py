@@ -0,0 +1,88 @@
+import sys
+
+import numpy as np
+import pytest
+from typer.testing import CliRunner
+
+from birbnet import config, crawler
+from birbnet.cli import app
+from birbnet.graph import Graph
+from birbnet.mock_api import MockAPIServer, MockTwitterAPI, make_power_law_graph
+from birbnet.rate_limit import CredentialPool
+from birbnet.types import Edge
+
+
+@pytest.fixture
+def data_path(tmp_path, monkeypatch):
+    """Save runs and the profile cache in a temporary directory, with no rate limit."""
+    monkeypatch.setattr(config, "DATA_PATH", tmp_path)
+    monkeypatch.setattr(config, "PROFILE_CACHE_PATH", tmp_path / "profiles.db")
+    credential_pools = {
+        edge: CredentialPool.from_tokens(["token"], limit=sys.maxsize, name=edge)
+        for edge in Edge.__args__
+    }
+    monkeypatch.setattr(crawler, "_credential_pools", credential_pools)
+    return tmp_path
+
+
+@pytest.fixture
+def graph() -> Graph:
+    return make_power_law_graph(1500, mean_follows=10, seed=5)
+
+
+@pytest.fixture
+def seed_user_id(graph) -> str:
+    """A user with enough follows for a crawl to reach a few hundred users."""
+    return str(graph.ids[np.argsort(graph.out_degree())[-30]])
+
+
+@pytest.fixture
+def serve_graph(data_path, monkeypatch):
+    """Serve graphs from the mock API, pointing the crawler at the latest one."""
+    servers = []
+
+    def serve(graph: Graph) -> None:
+        if servers:
+            servers.pop().stop()
+        server = MockAPIServer(MockTwitterAPI(graph))
+        server.start()
+        servers.append(server)
+        monkeypatch.setattr(config, "API_URL", server.url)
+
+    yield serve
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def crawl(serve_graph, seed_user_id):
+    """Crawl a run from the seed user, returning the crawler."""
+
+    def crawl(
+        run_id: str, depth: int = 2, edge: str = "following", **kwargs
+    ) -> crawler.BirbCrawler:
+        birb_crawler = crawler.BirbCrawler(
+            edge,
+            user_id=seed_user_id,
+            run_id=run_id,
+            depth=depth,
+            exclude_path=None,
+            **kwargs,
+        )
+        birb_crawler.crawl()
+        return birb_crawler
+
+    return crawl
+
+
+@pytest.fixture
+def run_cli(data_path):
+    """Run a birbnet command, failing the test if it fails."""
+    runner = CliRunner()
+
+    def run_cli(*args: str) -> str:
+        result = runner.invoke(app, list(args), catch_exceptions=False)
+        assert result.exit_code == 0, result.output
+        return result.output
+
+    return run_cli
@@ -0,0 +1,26 @@
+import subprocess
+import sys
+
+from birbnet.bench import STARTUP_BUDGET, measure_startup
+
+# imported by commands that need them, not when the CLI starts
+HEAVY_MODULES = ["duckdb", "pandas", "pydantic", "httpx", "pyarrow"]
+
+
+def test_cli_import_within_budget():
+    assert measure_startup().seconds < STARTUP_BUDGET
+
+
+def test_cli_import_skips_heavy_modules():
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, birbnet.cli; print(' '.join(sys.modules))",
+        ],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    imported = {module.split(".")[0] for module in output.stdout.split()}
+    assert imported.isdisjoint(HEAVY_MODULES)
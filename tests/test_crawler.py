@@ -0,0 +1,20 @@
+from birbnet import crawler
+
+
+def test_crawl_reuses_estimate(serve_graph, graph, seed_user_id, monkeypatch):
+    serve_graph(graph)
+    preflight = crawler.BirbCrawler.preflight
+    preflight_depths = []
+
+    async def record_preflight(self, client, frontier, depth):
+        preflight_depths.append(depth)
+        return await preflight(self, client, frontier, depth)
+
+    monkeypatch.setattr(crawler.BirbCrawler, "preflight", record_preflight)
+    birb_crawler = crawler.BirbCrawler(
+        "following", user_id=seed_user_id, run_id="run", depth=2, exclude_path=None
+    )
+    estimate = birb_crawler.estimate()
+    birb_crawler.crawl()
+    assert preflight_depths == [0, 1]
+    assert birb_crawler.estimates[0] is estimate
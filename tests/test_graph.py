@@ -0,0 +1,48 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import pytest
+
+from birbnet.data_utils import RunDataset
+from birbnet.graph import Graph
+from birbnet.mock_api import make_power_law_graph
+
+
+@pytest.fixture
+def graph() -> Graph:
+    """A graph where every user can be reached from every other by following."""
+    power_law_graph = make_power_law_graph(200, mean_follows=5, seed=3)
+    ids = power_law_graph.ids
+    return Graph.from_edges(
+        np.concatenate([ids[power_law_graph.edge_sources()], ids]),
+        np.concatenate([ids[power_law_graph.indices], np.roll(ids, -1)]),
+    )
+
+
+def read_degrees(run_id: str) -> pa.Table:
+    degrees = pq.read_table(RunDataset(run_id).analysis_path / "degrees.parquet")
+    return degrees.filter(pc.field("metric").isin(["in_degree", "out_degree"]))
+
+
+@pytest.mark.parametrize("edge", ["both", "followers"])
+def test_crawl_matches_following_crawl(graph, serve_graph, crawl, run_cli, edge):
+    serve_graph(graph)
+    # deep enough for each crawl to find every follow, twice in a crawl of both
+    crawl("following_run", depth=graph.num_nodes)
+    crawl(f"{edge}_run", depth=graph.num_nodes, edge=edge)
+
+    run_graphs = {}
+    for run_id in ["following_run", f"{edge}_run"]:
+        run_cli("crawl-stats", run_id, "--write-edges")
+        run_cli("make-db", run_id)
+        run_cli("analyze", "degrees", run_id)
+        run_graphs[run_id] = Graph.from_run(RunDataset(run_id))
+
+    following_graph, run_graph = run_graphs["following_run"], run_graphs[f"{edge}_run"]
+    assert run_graph.num_edges == graph.num_edges
+    assert np.array_equal(run_graph.ids, following_graph.ids)
+    assert np.array_equal(run_graph.out_degree(), following_graph.out_degree())
+    assert np.array_equal(run_graph.in_degree(), following_graph.in_degree())
+    assert np.allclose(run_graph.pagerank(), following_graph.pagerank())
+    assert read_degrees(f"{edge}_run").equals(read_degrees("following_run"))
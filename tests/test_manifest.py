@@ -0,0 +1,30 @@
+from birbnet.crawler import UserFetcher
+from birbnet.data_utils import RunDataset
+from birbnet.manifest import RunManifest
+
+
+def write_user_file(user_id: int) -> None:
+    user_fetcher = UserFetcher(str(user_id), "following", run_id="run")
+    user_fetcher.write_users([{"id": "1", "username": "user1"}])
+
+
+def test_backfill_only_on_first_open(data_path, monkeypatch, run_cli):
+    write_user_file(100)
+    run_dataset = RunDataset("run")
+    with RunManifest(run_dataset) as manifest:
+        assert manifest.is_complete(100, "following")
+
+    write_user_file(101)
+
+    def glob_user_files(self, pattern):
+        raise AssertionError("users directory listed")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(RunDataset, "glob_user_files", glob_user_files)
+        with RunManifest(run_dataset) as manifest:
+            assert not manifest.is_complete(101, "following")
+
+    assert "Added 1 user files" in run_cli("backfill-manifest", "run")
+    with RunManifest(run_dataset) as manifest:
+        assert manifest.is_complete(101, "following")
+        assert len(manifest) == 2
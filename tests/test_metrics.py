@@ -0,0 +1,29 @@
+import asyncio
+import time
+
+import pyarrow.parquet as pq
+
+from birbnet import metrics
+
+
+def test_last_write_waits_for_interval_write(tmp_path, monkeypatch):
+    write_table = pq.write_table
+
+    def slow_write_table(table, path):
+        write_table(table, path)
+        time.sleep(0.2)
+
+    monkeypatch.setattr(metrics.pq, "write_table", slow_write_table)
+    log_path = tmp_path / "metrics"
+    # so each snapshot has a row
+    metrics.BYTES_WRITTEN.inc(0, kind="users")
+
+    async def record() -> None:
+        async with metrics.record_metrics(log_path, interval=0.01):
+            # ends while the first snapshot is being written
+            await asyncio.sleep(0.05)
+
+    asyncio.run(record())
+    assert [path.name for path in log_path.iterdir()] == ["part-00000.parquet"]
+    timestamps = pq.read_table(log_path).column("timestamp").unique()
+    assert len(timestamps) == 2
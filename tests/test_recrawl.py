@@ -0,0 +1,61 @@
+import duckdb
+import numpy as np
+import pyarrow.parquet as pq
+
+from birbnet.data_utils import RunDataset
+from birbnet.graph import Graph
+from birbnet.snapshots import RunSnapshot
+
+
+def change_follows(graph: Graph, seed: int = 0) -> Graph:
+    """A copy of a graph with some follows removed and others added."""
+    rng = np.random.default_rng(seed)
+    sources = graph.ids[graph.edge_sources()]
+    targets = graph.ids[graph.indices]
+    kept = rng.random(len(sources)) > 0.1
+    added = rng.choice(graph.ids, size=(2, len(sources) // 10))
+    return Graph.from_edges(
+        np.concatenate([sources[kept], added[0]]),
+        np.concatenate([targets[kept], added[1]]),
+    )
+
+
+def sorted_edges(table) -> list[tuple[int, int, str]]:
+    columns = [table[name].to_pylist() for name in ["source", "target", "edge_type"]]
+    return sorted(zip(*columns))
+
+
+def parse_stats(output: str) -> dict[str, str]:
+    lines = [line.split(":", 1) for line in output.splitlines() if ":" in line]
+    return {name.strip(): value.strip() for name, value in lines}
+
+
+def read_db_edges(run_dataset: RunDataset) -> list[tuple[int, int, str]]:
+    with duckdb.connect(str(run_dataset.db_path), read_only=True) as conn:
+        return sorted(
+            conn.sql("SELECT source, target, edge_type FROM edges").fetchall()
+        )
+
+
+def test_recrawl_stats_and_db(graph, serve_graph, crawl, run_cli, data_path):
+    serve_graph(graph)
+    crawl("baseline", storage="columnar")
+    serve_graph(change_follows(graph))
+    crawl("recrawl", storage="columnar", baseline_run_id="baseline")
+    run_dataset = RunDataset("recrawl")
+    assert run_dataset.get_user_paths() == []
+
+    run_cli("snapshot", "recrawl", "--output", str(data_path / "snapshot.parquet"))
+    snapshot_edges = sorted_edges(pq.read_table(data_path / "snapshot.parquet"))
+    assert len(snapshot_edges) > 0
+
+    stats = parse_stats(run_cli("crawl-stats", "recrawl", "--write-edges"))
+    assert int(stats["Users crawled"]) == len(RunSnapshot(run_dataset).crawled_users())
+    assert int(stats["Edges"]) == len(snapshot_edges)
+    assert sorted_edges(pq.read_table(run_dataset.edges_path)) == snapshot_edges
+
+    run_cli("make-db", "recrawl")
+    assert read_db_edges(run_dataset) == snapshot_edges
+    run_dataset.db_path.unlink()
+    run_cli("make-db", "recrawl", "--incremental")
+    assert read_db_edges(run_dataset) == snapshot_edges
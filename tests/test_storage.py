@@ -0,0 +1,89 @@
+import numpy as np
+
+from birbnet.crawler import UserFetcher
+from birbnet.data_utils import RunDataset
+from birbnet.storage import ProfileStore
+
+
+def make_users(user_ids) -> list[dict]:
+    return [
+        {
+            "id": str(user_id),
+            "username": f"user{user_id}",
+            "public_metrics": {"followers_count": int(user_id) * 2},
+        }
+        for user_id in user_ids
+    ]
+
+
+def usernames(profiles) -> list[str]:
+    return profiles["username"].to_pylist()
+
+
+def test_lookup_reads_finished_and_open_parts(data_path):
+    with ProfileStore(RunDataset("run"), rows_per_part=50) as profile_store:
+        for start in range(0, 130, 10):
+            # each page repeats a user from the one before
+            page_ids = [max(start - 1, 0), *range(start, start + 10)]
+            profile_store.add(make_users(page_ids))
+        assert len(profile_store.part_paths()) == 2
+        user_ids = np.random.default_rng(0).permutation(130)
+        lookup_ids = np.concatenate([user_ids, [1000]])
+        profiles = profile_store.lookup(lookup_ids)
+        assert usernames(profiles) == [f"user{user_id}" for user_id in user_ids]
+        assert profiles["followers_count"].to_pylist() == list(user_ids * 2)
+
+    # and once the store is reopened, from the finished parts alone
+    profile_store = ProfileStore(RunDataset("run"))
+    profiles = profile_store.lookup(user_ids)
+    assert usernames(profiles) == [f"user{user_id}" for user_id in user_ids]
+
+
+def test_lookup_finds_parts_finished_by_other_writers(data_path):
+    with ProfileStore(RunDataset("run"), writer_id="0") as profile_store:
+        profile_store.add(make_users(range(10)))
+        with ProfileStore(RunDataset("run"), writer_id="1") as other_store:
+            other_store.add(make_users(range(5, 20)))
+        profiles = profile_store.lookup(np.arange(20))
+        assert usernames(profiles) == [f"user{user_id}" for user_id in range(20)]
+
+
+def test_read_users_before_part_is_closed(serve_graph, graph, seed_user_id):
+    serve_graph(graph)
+    profile_store = ProfileStore(RunDataset("run"))
+    user_fetcher = UserFetcher(
+        seed_user_id,
+        "following",
+        run_id="run",
+        storage="columnar",
+        profile_store=profile_store,
+    )
+    users = user_fetcher.fetch_users(resume=False)
+    assert profile_store.part_paths() == []
+    read_users = user_fetcher.read_users()
+    assert [user["username"] for user in read_users] == [
+        user["username"] for user in users
+    ]
+    profile_store.close()
+
+    # without a store, a fetcher opens one and keeps it for later reads
+    user_fetcher = UserFetcher(
+        seed_user_id, "following", run_id="run", storage="columnar"
+    )
+    assert user_fetcher.read_users() == read_users
+    opened_store = user_fetcher.profile_store
+    user_fetcher.read_users()
+    assert user_fetcher.profile_store is opened_store
+
+
+def test_write_users_without_profile_store(data_path):
+    users = make_users(range(10))
+    user_fetcher = UserFetcher("1", "following", run_id="run", storage="columnar")
+    user_fetcher.write_users(users)
+    assert len(ProfileStore(RunDataset("run")).part_paths()) == 1
+
+    user_fetcher = UserFetcher("1", "following", run_id="run", storage="columnar")
+    read_users = user_fetcher.read_users()
+    assert [user["username"] for user in read_users] == [
+        user["username"] for user in users
+    ]
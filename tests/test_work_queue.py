@@ -0,0 +1,36 @@
+from birbnet import crawler
+from birbnet.data_utils import RunDataset
+from birbnet.work_queue import WorkQueue
+
+
+def test_complete_after_lease_lost(data_path):
+    # leases expire as soon as they're taken
+    with WorkQueue(RunDataset("run"), max_depth=3, lease_seconds=-1) as work_queue:
+        work_queue.seed(1)
+        assert work_queue.claim("a") == [(1, 0)]
+        assert work_queue.claim("b") == [(1, 0)]
+        assert work_queue.complete("a", 1, 0, [2, 3]) == 0
+        assert work_queue.counts() == {"leased": 1}
+        assert work_queue.complete("b", 1, 0, [2, 3]) == 2
+        assert work_queue.counts() == {"done": 1, "pending": 2}
+
+
+def test_workers_crawl_every_user(serve_graph, graph, seed_user_id):
+    serve_graph(graph)
+    following_crawler = crawler.BirbCrawler(
+        "following", user_id=seed_user_id, run_id="run", depth=2, exclude_path=None
+    )
+    following_crawler.crawl()
+    worker_crawler = crawler.BirbCrawler(
+        "following",
+        user_id=seed_user_id,
+        run_id="worker_run",
+        depth=2,
+        exclude_path=None,
+        concurrency=4,
+    )
+    worker_crawler.work(worker_id="worker", poll_interval=0.01)
+    with WorkQueue(RunDataset("worker_run"), max_depth=2) as work_queue:
+        counts = work_queue.counts()
+    assert counts["pending"] == counts["leased"] == 0
+    assert worker_crawler.crawled_count == following_crawler.crawled_count